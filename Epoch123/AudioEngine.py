@@ -0,0 +1,504 @@
+import time
+import atexit
+import logging
+import threading
+import weakref
+
+import numpy as np
+import soundfile as sf
+import pygame as pg
+
+from StreamingDSP import StreamChain
+from EditList import resampled
+
+logger = logging.getLogger(__name__)
+
+# Frames handed to a sink per pull (about 46 ms at 44.1 kHz)
+BLOCK_FRAMES = 2048
+
+# Blocks decoded ahead of the sink
+RING_BLOCKS = 16
+
+# Engines that may have threads running, stopped at exit before pygame shuts down
+_engines = weakref.WeakSet()
+
+# Channel sinks playing through the (shared) pygame mixer
+_open_channel_sinks = weakref.WeakSet()
+
+
+@atexit.register
+def _stop_engines():
+    for engine in list(_engines):
+        engine.stop()
+
+
+def to_mixer_pcm(block, mixer_size, mixer_channels):
+    """
+    Convert float samples shaped (n,) or (n, channels) to the mixer's sample
+    format and channel count. This is the only copy made on the way to the mixer.
+    """
+    if block.ndim == 1:
+        block = block[:, np.newaxis]
+    if block.shape[1] != mixer_channels:
+        if block.shape[1] == 1:
+            block = np.broadcast_to(block, (len(block), mixer_channels))
+        elif mixer_channels == 1:
+            block = block.mean(axis=1, keepdims=True)
+        else:
+            block = block[:, np.arange(mixer_channels) % block.shape[1]]
+    if mixer_size == 32:
+        return np.ascontiguousarray(block, dtype=np.float32)
+
+    bits = abs(mixer_size)
+    scale = 2 ** (bits - 1) - 1
+    pcm = np.clip(block, -1.0, 1.0) * scale
+    if mixer_size > 0:
+        # Unsigned formats are offset to the middle of their range
+        pcm += scale + 1
+    return np.ascontiguousarray(pcm, dtype=f"{'u' if mixer_size > 0 else 'i'}{bits // 8}")
+
+
+class RingBuffer:
+    """
+    Single-producer / single-consumer ring of audio blocks.
+    The producer only advances `written` and the consumer only advances
+    `consumed`, so neither side takes a lock. Every block is tagged with the
+    generation it was decoded for; blocks from before a seek are skipped.
+    """
+    def __init__(self, blocks, block_frames, channels):
+        self.data = np.zeros((blocks, block_frames, channels), dtype=np.float32)
+        self.starts = np.zeros(blocks, dtype=np.int64)
+        self.counts = np.zeros(blocks, dtype=np.int64)
+        self.generations = np.zeros(blocks, dtype=np.int64)
+        self.written = 0
+        self.consumed = 0
+
+    def free(self):
+        return len(self.data) - (self.written - self.consumed)
+
+    def push(self, generation, start, frames):
+        """Copy `frames` into the next slot. Only call when free() > 0."""
+        slot = self.written % len(self.data)
+        count = len(frames)
+        self.data[slot, :count] = frames
+        self.starts[slot] = start
+        self.counts[slot] = count
+        self.generations[slot] = generation
+        self.written += 1
+
+    def pop(self, generation):
+        """Return (start, frames) of the next block of `generation`, or None if empty."""
+        while self.written > self.consumed:
+            slot = self.consumed % len(self.data)
+            if self.generations[slot] == generation:
+                count = self.counts[slot]
+                block = self.data[slot, :count].copy()
+                start = int(self.starts[slot])
+                self.consumed += 1
+                return start, block
+            self.consumed += 1
+        return None
+
+
+class AudioEngine:
+    """
+    Pull-driven playback engine.
+    A decoder thread renders the source (an array or an EditList) into a ring
+    buffer ahead of time; the sink calls pull() from its own thread whenever
+    the device needs more audio and reports which frame is actually being
+    heard. That frame is published in `position`, a plain int that the UI
+    reads without locking at its own refresh rate.
+    """
+    def __init__(self, sink=None, block_frames=BLOCK_FRAMES, ring_blocks=RING_BLOCKS):
+        self.sink = sink or ChannelSink()
+        self.block_frames = block_frames
+        self.ring_blocks = ring_blocks
+        self.data = None
+        self.fs = 0
+        self.ring = None
+
+        self.position = 0
+        self.finished = False
+        self.paused = False
+        # Bumped on every seek; decoder and sink restart from seek_frame when it changes
+        self.generation = 0
+        self.seek_frame = 0
+        self.decoded = -1
+        # Effects previewed live on pulled blocks (not part of the data itself)
+        self.preview = StreamChain()
+        self._preview_generation = None
+        self._running = False
+        self._decoder = None
+        self._wake = threading.Event()
+        _engines.add(self)
+
+    # ---- control (UI thread) ----
+
+    def load(self, data, fs):
+        """
+        Stop playback and set the data to play. Data at another rate than the
+        sink's device is converted explicitly (polyphase, cached per rate);
+        `fs` then becomes the device rate.
+        """
+        self.stop()
+        rate = self.sink.device_rate(int(fs))
+        if rate != int(fs):
+            logger.info(f"Resampling playback from {fs} Hz to the device's {rate} Hz")
+            data = resampled(data, fs, rate)
+        self.data = data
+        self.fs = int(rate)
+        channels = 1 if data.ndim == 1 else data.shape[1]
+        self.ring = RingBuffer(self.ring_blocks, self.block_frames, channels)
+        self.position = 0
+        self.finished = False
+
+    def start(self, frame=0):
+        """Start playback at `frame`."""
+        if self.data is None:
+            raise ValueError("No audio data to play.")
+        self.stop()
+        self.finished = False
+        self.paused = False
+        self._running = True
+        self.seek(frame)
+        self._decoder = threading.Thread(target=self._decode_loop, name="AudioEngineDecoder", daemon=True)
+        self._decoder.start()
+        self.sink.start(self)
+
+    def seek(self, frame):
+        """Jump to `frame`; blocks decoded for the old position are dropped."""
+        frame = int(min(max(frame, 0), len(self.data)))
+        self.seek_frame = frame
+        self.generation += 1
+        self.position = frame
+        self.finished = False
+        self._wake.set()
+
+    def pause(self):
+        self.paused = True
+        self.sink.pause()
+
+    def resume(self):
+        self.paused = False
+        self.sink.resume()
+
+    def stop(self):
+        """Stop the sink and the decoder thread."""
+        self._running = False
+        self._wake.set()
+        self.sink.stop()
+        if self._decoder is not None:
+            self._decoder.join(timeout=1)
+            self._decoder = None
+
+    def latency_ms(self):
+        """Audio handed to the sink but not heard yet, in ms."""
+        return self.sink.latency_frames() * 1000 / self.fs if self.fs else 0.0
+
+    # ---- decoder thread ----
+
+    def _decode_loop(self):
+        generation, fill, done = None, 0, False
+        while self._running:
+            if generation != self.generation:
+                generation, fill, done = self.generation, self.seek_frame, False
+            if done or self.ring.free() == 0:
+                self._wake.wait(self.block_frames / self.fs / 4)
+                self._wake.clear()
+                continue
+            try:
+                frames = self.data[fill:fill + self.block_frames]
+            except Exception as e:
+                logger.error(f"Failed to render audio for playback: {e}")
+                done = True
+                self.decoded = generation
+                continue
+            if len(frames):
+                self.ring.push(generation, fill, frames.reshape(len(frames), -1))
+            fill += len(frames)
+            if not len(frames) or fill >= len(self.data):
+                done = True
+                self.decoded = generation
+
+    # ---- sink thread ----
+
+    def pull(self):
+        """
+        Return the next (start_frame, frames) block for the sink, or None if
+        none is decoded yet. Preview effects run here, after the ring buffer,
+        so a change to them is heard in the next block the sink plays.
+        """
+        generation = self.generation
+        block = self.ring.pop(generation)
+        self._wake.set()
+        if block is not None and self.preview:
+            if generation != self._preview_generation:
+                self.preview.reset()
+                self._preview_generation = generation
+            start, frames = block
+            block = start, self.preview.process(frames, self.fs).astype(np.float32, copy=False)
+        return block
+
+    def at_end(self):
+        """True once every frame up to the end has been decoded and pulled."""
+        return self.decoded == self.generation and self.ring.written == self.ring.consumed
+
+    def publish(self, frame):
+        """Called by the sink with the frame currently being heard."""
+        self.position = int(frame)
+
+
+class Sink:
+    """
+    Where the engine's audio goes. A sink runs its own thread, pulls blocks
+    from the engine and publishes the frame being heard.
+    """
+    POLL_SECONDS = 0.002
+
+    def __init__(self):
+        self.engine = None
+        self.generation = None
+        self._thread = None
+        self._running = False
+        self._paused = False
+
+    def start(self, engine):
+        self.engine = engine
+        self.generation = None
+        self._running = True
+        self._paused = False
+        self.open()
+        self._thread = threading.Thread(target=self._loop, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+        self._thread = None
+        self.close()
+
+    def device_rate(self, fs):
+        """Rate the sink will play at when given audio at `fs` (the audio is resampled to it)."""
+        return fs
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def _loop(self):
+        while self._running:
+            if self._paused:
+                time.sleep(self.POLL_SECONDS)
+                continue
+            generation = self.engine.generation
+            if generation != self.generation:
+                # Seeked: drop what was queued for the old position
+                self.generation = generation
+                self.flush()
+                self.engine.publish(self.engine.seek_frame)
+            if not self.step():
+                time.sleep(self.POLL_SECONDS)
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def flush(self):
+        """Forget audio queued for the old position after a seek."""
+
+    def step(self):
+        """Do one unit of work; return False when the thread should sleep."""
+        raise NotImplementedError
+
+    def latency_frames(self):
+        return 0
+
+
+class ChannelSink(Sink):
+    """
+    Plays through a reserved pygame mixer Channel: one block playing and one
+    queued behind it, so the latency is at most two blocks. The heard frame
+    is interpolated from when the playing block started.
+    """
+    def __init__(self, channel_id=0):
+        super().__init__()
+        self.channel_id = channel_id
+        self.channel = None
+        self.volume = 1.0
+        self._paused_at = 0.0
+        self._playing = None   # (start_frame, frames, started_at)
+        self._queued = None    # (start_frame, frames)
+
+    def device_rate(self, fs):
+        """
+        Reopen the pygame mixer at `fs` so nothing needs resampling, unless
+        other sinks are playing through it; returns the rate it runs at.
+        """
+        init = pg.mixer.get_init()
+        if init and init[0] != fs and not any(sink is not self for sink in _open_channel_sinks):
+            pg.mixer.quit()
+            init = None
+        if not init:
+            pg.mixer.init(frequency=fs)
+            init = pg.mixer.get_init()
+        return init[0]
+
+    def open(self):
+        if not pg.mixer.get_init():
+            pg.mixer.init(frequency=self.engine.fs)
+        if pg.mixer.get_init()[0] != self.engine.fs:
+            logger.warning(f"The mixer runs at {pg.mixer.get_init()[0]} Hz, not {self.engine.fs} Hz")
+        _open_channel_sinks.add(self)
+        pg.mixer.set_reserved(self.channel_id + 1)
+        self.channel = pg.mixer.Channel(self.channel_id)
+        self.channel.stop()
+        self.channel.set_volume(self.volume)
+        self._playing = self._queued = None
+
+    def close(self):
+        if self.channel is not None and pg.mixer.get_init():
+            self.channel.stop()
+        self.channel = None
+        _open_channel_sinks.discard(self)
+        self._playing = self._queued = None
+
+    def pause(self):
+        super().pause()
+        self._paused_at = time.perf_counter()
+        if self.channel is not None:
+            self.channel.pause()
+            self.publish_heard(self._paused_at)
+
+    def resume(self):
+        # After a seek while paused the loop flushes instead, so the old block is never heard
+        if self.channel is not None and self._playing is not None and self.generation == self.engine.generation:
+            start, frames, started_at = self._playing
+            self._playing = (start, frames, started_at + time.perf_counter() - self._paused_at)
+            self.channel.unpause()
+        super().resume()
+
+    def set_volume(self, volume):
+        self.volume = volume
+        if self.channel is not None:
+            self.channel.set_volume(volume)
+
+    def flush(self):
+        if self.channel is not None:
+            self.channel.stop()
+        self._playing = self._queued = None
+
+    def sound(self, block):
+        _, size, channels = pg.mixer.get_init()
+        return pg.mixer.Sound(buffer=to_mixer_pcm(block, size, channels))
+
+    def step(self):
+        now = time.perf_counter()
+        channel = self.channel
+        if channel is None:
+            return False
+
+        if not channel.get_busy():
+            # Starting, after a seek, or the queue ran dry
+            self._playing = self._queued = None
+            block = self.engine.pull()
+            if block is None:
+                if self.engine.at_end():
+                    self.engine.finished = True
+                return False
+            start, frames = block
+            channel.play(self.sound(frames))
+            self._playing = (start, len(frames), now)
+        elif channel.get_queue() is None:
+            if self._queued is not None:
+                # The queued block has just started playing
+                self._playing = (*self._queued, now)
+                self._queued = None
+            block = self.engine.pull()
+            if block is not None:
+                start, frames = block
+                channel.queue(self.sound(frames))
+                self._queued = (start, len(frames))
+
+        self.publish_heard(now)
+        return False
+
+    def publish_heard(self, now):
+        """Publish the frame heard at `now`, interpolated within the playing block."""
+        if self._playing is not None:
+            start, frames, started_at = self._playing
+            heard = min(int((now - started_at) * self.engine.fs), frames)
+            self.engine.publish(start + heard)
+
+    def latency_frames(self):
+        if self._playing is None:
+            return 0
+        start, frames, _ = self._playing
+        queued = self._queued[1] if self._queued else 0
+        return start + frames + queued - self.engine.position
+
+
+class NullSink(Sink):
+    """
+    Discards the audio. With `realtime` it consumes blocks at the audio's
+    rate like a device would; otherwise as fast as they are decoded.
+    """
+    def __init__(self, realtime=True):
+        super().__init__()
+        self.realtime = realtime
+        self.blocks_played = 0
+        self._next_at = None
+
+    def open(self):
+        self._next_at = time.perf_counter()
+
+    def resume(self):
+        self._next_at = time.perf_counter()
+        super().resume()
+
+    def flush(self):
+        self._next_at = time.perf_counter()
+
+    def step(self):
+        if self.realtime and time.perf_counter() < self._next_at:
+            return False
+        block = self.engine.pull()
+        if block is None:
+            if self.engine.at_end():
+                self.engine.finished = True
+            return False
+        start, frames = block
+        self.consume(frames)
+        self.blocks_played += 1
+        self.engine.publish(start + len(frames))
+        self._next_at += len(frames) / self.engine.fs
+        return not self.realtime
+
+    def consume(self, frames):
+        pass
+
+
+class FileSink(NullSink):
+    """Writes everything the engine plays to a sound file (for tests and offline checks)."""
+    def __init__(self, path, realtime=False, **kwargs):
+        super().__init__(realtime)
+        self.path = path
+        self.kwargs = kwargs
+        self.file = None
+
+    def open(self):
+        super().open()
+        channels = 1 if self.engine.data.ndim == 1 else self.engine.data.shape[1]
+        self.file = sf.SoundFile(self.path, 'w', samplerate=self.engine.fs, channels=channels, **self.kwargs)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def consume(self, frames):
+        self.file.write(frames)
@@ -1,21 +1,27 @@
 import numpy as np
 import soundfile as sf
-import pygame as pg
-import os
-import tempfile
 import logging
-from PySide6.QtWidgets import QWidget, QHBoxLayout, QMessageBox
+import pygame as pg
+from PySide6.QtWidgets import QWidget, QHBoxLayout
+from PySide6.QtGui import QGuiApplication
 from PySide6.QtCore import QObject, Signal, QThread, QTimer, Qt
 from pydub import AudioSegment
 from GUIElements import Button
-import time
+from EditList import EditList
+from AudioEngine import AudioEngine, ChannelSink
+from Mixer import Mixer
+
+# Blocks and ring size for layered playback: short, so added layers are heard quickly
+LAYER_BLOCK_FRAMES = 1024
+LAYER_RING_BLOCKS = 2
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 class AudioProcessor(QObject):
     """
-    Loads and processes raw audio data for visualization and playback.
+    Loads raw audio data for visualization, editing and playback, as
+    (frames, channels) with every channel kept; views that need mono mix down.
     Signals:
       - data_loaded(data: np.ndarray, samplerate: float, audio_segment: pydub.AudioSegment)
       - error_occurred(error_msg: str)
@@ -32,10 +38,6 @@ class AudioProcessor(QObject):
         try:
             data, samplerate = sf.read(self.audio_path, always_2d=True)
             audio_segment = AudioSegment.from_file(self.audio_path)
-
-            if data.shape[1] > 1:
-                data = np.mean(data, axis=1)
-
             self.data_loaded.emit(data, samplerate, audio_segment)
         except Exception as e:
             error_message = f"Error processing audio: {e}"
@@ -45,48 +47,71 @@ class AudioProcessor(QObject):
 
 class AudioPlayer(QThread):
     """
-    Handles audio playback using pygame mixer in a background thread-like structure.
+    Handles audio playback through an AudioEngine (see AudioEngine.py), which
+    pulls blocks from the current data into a sink on its own threads.
+    The engine's heard-frame counter is sampled at the display refresh rate.
     Signals:
       - error(str)
       - update_position(int)   -> Sends the current playback position in ms
+      - update_frame(int)      -> Sends the current playback position in samples of the full data
       - playback_finished()    -> Emitted when playback stops
     """
     error = Signal(str)
     update_position = Signal(int)
+    update_frame = Signal(int)
     playback_finished = Signal()
 
-    def __init__(self, audio_path=None, sample_rate=0, audio_data=None):
+    def __init__(self, audio_path=None, sample_rate=0, audio_data=None, sink=None):
         super().__init__()
         self.audio_path = audio_path
         self.sample_rate = sample_rate
         self.audio_data = audio_data
-        self.temp_file = None
         self.playing = False
-        self.start_time = None
-        self.start_frame = 0
-        self.pause_time = 0
+        self.reversed = False
         self.initial_frame = 0
+        self.engine = AudioEngine(sink)
+
+        # Layers (files, regions, loops) summed by a live Mixer on their own channel
+        self.mixer = None
+        self.layer_engine = None
+        # PlaybackQueue being auditioned on the main engine, if any
+        self.queue = None
 
         self.timer = QTimer()
+        self.timer.setTimerType(Qt.PreciseTimer)
         self.timer.timeout.connect(self.emit_position)
-        self.timer.setInterval(50)
-
-        if not pg.mixer.get_init():
-            pg.mixer.init()
+        screen = QGuiApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen else 60
+        self.timer.setInterval(max(1, int(1000 / (refresh_rate or 60))))
 
     def set_initial_frame(self, frame):
-        """Set the initial frame to start playback from."""
+        """Set the frame of the full data where audio_data starts (a selection's start)."""
         self.initial_frame = frame
 
+    def current_frame(self):
+        """Frame of the full data being heard right now."""
+        position = self.engine.position
+        if self.reversed:
+            position = len(self.engine.data) - position
+        return self.initial_frame + int(position * self.sample_rate / self.engine.fs)
+
     def emit_position(self):
-        """Emit the current position in ms, adjusted by the initial frame."""
-        if pg.mixer.music.get_busy():
-            position = pg.mixer.music.get_pos()
-            self.update_position.emit(position + int(self.initial_frame * (1000 / self.sample_rate)))
-        else:
+        """Emit the heard position, or finish once the engine has played everything."""
+        if self.engine.finished:
             if self.playing:
-                self.playback_finished.emit()
                 self.stop_playback()
+            return
+        if self.queue is not None:
+            position = self.engine.position
+            if self.queue.tick(position):
+                self.update_position.emit(self.queue.item_ms(position))
+            else:
+                self.stop_playback()
+            return
+        frame = self.current_frame()
+        self.update_frame.emit(frame)
+        if self.sample_rate:
+            self.update_position.emit(int(frame * 1000 / self.sample_rate))
 
     def set_audio(self, audio_segment, audio_data, sample_rate, audio_path):
         """Set the audio for playback."""
@@ -103,43 +128,104 @@ class AudioPlayer(QThread):
 
     def start_playback(self):
         """
-        Begin playback. If audio_data is set, writes the data to a temp file 
-        and uses pygame to play. Use 'stop_playback()' to end playback.
+        Begin playback straight from audio_data (an array or an EditList).
+        Use 'stop_playback()' to end playback.
+        """
+        self.play(self.audio_data)
+
+    def play_reverse(self):
         """
-        if self.audio_data is None:
+        Play the current audio (or selection) in reverse, from a reversed
+        view of the data through the same path as start_playback.
+        """
+        data = self.audio_data
+        if isinstance(data, EditList):
+            data = data.reverse()
+        elif data is not None:
+            data = data[::-1]
+        self.play(data, reverse=True)
+
+    def play(self, data, reverse=False):
+        """Play `data` from its start; later set_audio_data calls do not affect it."""
+        if data is None:
             logger.error("No audio data to play.")
             self.error.emit("No audio data to play.")
             return
 
-        self.playing = True
         try:
-            self.temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
-            sf.write(self.temp_file.name, self.audio_data, self.sample_rate)
-            pg.mixer.music.load(self.temp_file.name)
-            pg.mixer.music.play()
-            self.start_time = time.time()
+            self.stop_queue()
+            # While layers share the device the engine resamples to its rate instead of reopening it
+            self.engine.load(data, self.sample_rate)
+            self.reversed = reverse
+            self.engine.start()
+            self.playing = True
             self.timer.start()
         except Exception as e:
+            self.playing = False
             self.error.emit(str(e))
             logger.error(f"Error playing audio: {e}")
 
+    def play_queue(self, queue):
+        """
+        Audition a PlaybackQueue: its items play back to back through a live
+        Mixer on the main engine while the next ones are decoded ahead.
+        """
+        try:
+            self.stop_queue()
+            init = pg.mixer.get_init()
+            rate = self.mixer.fs if self.mixer is not None else (init[0] if init else 44100)
+            mixer = Mixer(fs=rate, live=True)
+            self.engine.load(mixer, rate)
+            queue.start(mixer)
+            self.queue = queue
+            self.reversed = False
+            self.initial_frame = 0
+            self.engine.start()
+            self.playing = True
+            self.timer.start()
+        except Exception as e:
+            self.playing = False
+            self.error.emit(str(e))
+            logger.error(f"Error playing queue: {e}")
+
+    def next_item(self):
+        """Skip to the next item of the queue being played."""
+        if self.queue is not None:
+            offset = self.queue.next_start(self.engine.position)
+            if offset is not None:
+                self.engine.seek(offset)
+
+    def stop_queue(self):
+        """Stop scheduling queue items and shut the queue's decoder down; the next play starts from plain data again."""
+        if self.queue is not None:
+            self.queue.close()
+            self.queue = None
+
+    def seek(self, frame):
+        """Continue playback from `frame` of the full data (sample accurate)."""
+        if self.engine.data is None or self.queue is not None:
+            return
+        position = int((frame - self.initial_frame) * self.engine.fs / self.sample_rate)
+        if self.reversed:
+            position = len(self.engine.data) - position
+        self.engine.seek(position)
+
     def stop_playback(self):
         """Stop playback and cleanup."""
-        if pg.mixer.get_init():
-            pg.mixer.music.stop()
+        self.stop_queue()
+        self.engine.stop()
         self.timer.stop()
         self.playing = False
         self.playback_finished.emit()
-        self.cleanup()
 
     def pause(self):
-        """Pause the current playback."""
+        """Pause the current playback; the position stays on the last heard frame."""
         try:
-            if pg.mixer.get_init() and self.playing:
-                pg.mixer.music.pause()
-                self.pause_time = pg.mixer.music.get_pos()
+            if self.playing:
+                self.engine.pause()
                 self.timer.stop()
                 self.playing = False
+                self.emit_position()
         except Exception as e:
             self.error.emit(str(e))
             logger.error(f"Error pausing audio: {e}")
@@ -147,9 +233,8 @@ class AudioPlayer(QThread):
     def resume(self):
         """Resume playback from a paused state."""
         try:
-            if pg.mixer.get_init() and not self.playing:
-                pg.mixer.music.unpause()
-                self.start_time = time.time() - self.pause_time / 1000.0
+            if not self.playing and self.engine.paused:
+                self.engine.resume()
                 self.timer.start()
                 self.playing = True
         except Exception as e:
@@ -157,41 +242,46 @@ class AudioPlayer(QThread):
             logger.error(f"Error resuming audio: {e}")
 
     def set_volume(self, volume):
-        """Set the mixer volume (0-100)."""
+        """Set the playback volume (0-100)."""
         try:
-            pg.mixer.music.set_volume(volume / 100.0)
+            if isinstance(self.engine.sink, ChannelSink):
+                self.engine.sink.set_volume(volume / 100.0)
         except Exception as e:
             self.error.emit(str(e))
             logger.error(f"Error setting volume: {e}")
 
-    def play_reverse(self):
+    def latency_ms(self):
+        """Audio handed to the sound device but not heard yet, in ms."""
+        return self.engine.latency_ms()
+
+    def set_preview(self, effects):
+        """Run stream effects (see StreamingDSP) live on the playback path, without touching the data."""
+        self.engine.preview.set_effects(effects)
+
+    def layer(self, data, fs, gain=1.0, pan=0.0, loop=False):
         """
-        Play the current audio in reverse by exporting reversed AudioSegment 
-        to a temporary mp3 and playing that via pygame.
+        Play `data` on top of whatever is already playing, through a live
+        Mixer. Returns the Voice, whose gain and pan can be changed while it plays.
         """
         try:
-            if not hasattr(self, 'audio'):
-                raise ValueError("No AudioSegment loaded to reverse.")
-            with tempfile.NamedTemporaryFile(suffix=".mp3", delete=True) as temp:
-                reversed_segment = self.audio.reverse()
-                reversed_segment.export(temp.name, format="mp3")
-                pg.mixer.music.load(temp.name)
-                pg.mixer.music.play()
-            self.playing = True
-            self.start_time = time.time()
+            if self.layer_engine is None:
+                init = pg.mixer.get_init()
+                self.mixer = Mixer(fs=init[0] if init else (self.sample_rate or 44100), live=True)
+                self.layer_engine = AudioEngine(ChannelSink(channel_id=1),
+                                                block_frames=LAYER_BLOCK_FRAMES, ring_blocks=LAYER_RING_BLOCKS)
+                self.layer_engine.load(self.mixer, self.mixer.fs)
+                self.layer_engine.start()
+            return self.mixer.add(data, fs, gain, pan, loop=loop)
         except Exception as e:
-            QMessageBox.critical(None, "Error", f"Error playing audio in reverse: {e}")
-            logger.error(f"Error playing audio in reverse: {e}")
-            raise
+            self.error.emit(str(e))
+            logger.error(f"Error playing layer: {e}")
 
-    def cleanup(self):
-        """Remove any temporary files used for playback."""
-        if self.temp_file:
-            temp_path = self.temp_file.name
-            self.temp_file.close()
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
-            self.temp_file = None
+    def stop_layers(self):
+        """Stop all layered playback."""
+        if self.layer_engine is not None:
+            self.layer_engine.stop()
+            self.layer_engine = None
+            self.mixer = None
 
 
 class AudioControlWidget(QWidget):
@@ -213,7 +303,8 @@ class AudioControlWidget(QWidget):
             "▶": self.audio_player.start_playback,
             "⏹": self.audio_player.stop_playback,
             "⏸": self.audio_player.pause,
-            "▶⏸": self.audio_player.resume
+            "▶⏸": self.audio_player.resume,
+            "⏭": self.audio_player.next_item
         }
         for label, func in actions.items():
             button = self.create_button(label, func)
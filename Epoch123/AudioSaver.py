@@ -0,0 +1,158 @@
+import os
+import uuid
+import shutil
+import logging
+
+import soundfile as sf
+from PySide6.QtCore import QObject, QRunnable, Signal
+
+from EditList import EditList, Source
+from BatchProcessor import file_row
+from Loudness import analyze_file
+from Fingerprint import fingerprint_file
+
+logger = logging.getLogger(__name__)
+
+# Formats offered when saving: label -> (format, subtype); None keeps the file's own
+SAVE_FORMATS = {
+    "Same as File": (None, None),
+    "WAV 16-bit": ('WAV', 'PCM_16'),
+    "WAV 24-bit": ('WAV', 'PCM_24'),
+    "WAV 32-bit Float": ('WAV', 'FLOAT'),
+    "FLAC 16-bit": ('FLAC', 'PCM_16'),
+    "FLAC 24-bit": ('FLAC', 'PCM_24'),
+    "OGG Vorbis": ('OGG', 'VORBIS'),
+}
+
+
+def save_target(path, file_format=None, subtype=None):
+    """
+    (path, format, subtype) a save of `path` should write: the file itself
+    in its own format, or a file with the chosen format's extension next to it.
+    """
+    if file_format is None:
+        try:
+            info = sf.info(path)
+            return path, info.format, subtype or info.subtype
+        except RuntimeError:
+            extension = os.path.splitext(path)[1][1:].upper()
+            if extension not in sf.available_formats():
+                raise ValueError(f"Choose a format to save {os.path.basename(path)} as.")
+            return path, extension, subtype
+    extension = '.' + file_format.lower()
+    return os.path.splitext(path)[0] + extension, file_format, subtype
+
+
+def _fsync_directory(directory):
+    """Make a rename in `directory` durable (where the platform allows opening directories)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data, samplerate, file_format, subtype=None, progress=None):
+    """
+    Write `data` (an EditList, rendered block by block, or an array) to a
+    temporary file next to `path`, flush it to disk and rename it over
+    `path`. Until the rename the original is untouched, and a crash or error
+    leaves it as it was. `progress(fraction)` is called after each block.
+    """
+    edit = (data if isinstance(data, EditList) else Source(data, samplerate)).at_rate(samplerate)
+    directory = os.path.dirname(os.path.abspath(path))
+    # Created like any new file (mode 0666 less the umask), unlike mkstemp's 0600;
+    # a file that is replaced keeps its own mode below
+    partial = os.path.join(directory, f".{os.path.basename(path)}.{uuid.uuid4().hex[:8]}.part")
+    os.close(os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+    try:
+        channels = 1 if edit.ndim == 1 else edit.shape[1]
+        kwargs = {'format': file_format}
+        if subtype:
+            kwargs['subtype'] = subtype
+        written = 0
+        with sf.SoundFile(partial, 'w', samplerate=edit.fs, channels=channels, **kwargs) as f:
+            for block in edit.blocks():
+                f.write(block)
+                written += len(block)
+                if progress:
+                    progress(written / max(len(edit), 1))
+        with open(partial, 'rb+') as f:
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, partial)
+        os.replace(partial, path)
+        _fsync_directory(directory)
+    except BaseException:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        raise
+
+
+class SaveJobSignals(QObject):
+    """
+    Signals for SaveJob (QRunnable cannot emit signals itself).
+      - progress(percent: int)
+      - finished(path: str)
+      - error(message: str)
+    """
+    progress = Signal(int)
+    finished = Signal(str)
+    error = Signal(str)
+
+
+class SaveJob(QRunnable):
+    """
+    Saves an edit list on a thread pool thread with atomic_write, then
+    brings what is known about the file up to date: its metadata row,
+    signal statistics and (if it had any) fingerprints in `metadata_db` and
+    its waveform in `peak_cache`.
+    The edit list is immutable, so editing can go on while it is saved.
+    """
+    def __init__(self, data, path, samplerate, file_format, subtype=None, metadata_db=None, peak_cache=None):
+        super().__init__()
+        self.data = data
+        self.path = path
+        self.samplerate = samplerate
+        self.file_format = file_format
+        self.subtype = subtype
+        self.metadata_db = metadata_db
+        self.peak_cache = peak_cache
+        self.signals = SaveJobSignals()
+
+    def run(self):
+        last = [-1]
+
+        def progress(fraction):
+            percent = int(fraction * 100)
+            if percent != last[0]:
+                last[0] = percent
+                self.signals.progress.emit(percent)
+
+        try:
+            atomic_write(self.path, self.data, self.samplerate, self.file_format, self.subtype, progress)
+        except Exception as e:
+            logger.error(f"Failed to save {self.path}: {e}")
+            self.signals.error.emit(str(e))
+            return
+        try:
+            if self.metadata_db is not None:
+                self.metadata_db.upsert_many([file_row(self.path)])
+                self.metadata_db.set_analysis_many([(self.path, analyze_file(self.path))])
+                # Only files already fingerprinted; the rest wait for 'Fingerprint Folder'
+                if self.metadata_db.is_fingerprinted(self.path):
+                    self.metadata_db.set_fingerprints_many([(self.path, *fingerprint_file(self.path))])
+            if self.peak_cache is not None:
+                self.peak_cache.invalidate(self.path)
+                self.peak_cache.get_or_compute(self.path)
+        except Exception as e:
+            # The file itself is saved; only the bookkeeping is behind
+            logger.error(f"Saved {self.path} but failed to update its metadata: {e}")
+        self.signals.finished.emit(self.path)
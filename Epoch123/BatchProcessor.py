@@ -0,0 +1,388 @@
+"""
+Batch processing of many sounds with a declarative effect chain.
+
+A chain is a JSON list of steps applied in order, for example:
+
+    [{"op": "filter", "type": "High Pass", "cutoff": 80, "order": 4},
+     {"op": "pitch", "semitones": -2},
+     {"op": "trim", "db": -40},
+     {"op": "gain", "db": -3},
+     {"op": "normalize", "lufs": -23},
+     {"op": "resample", "rate": 48000},
+     {"op": "format", "format": "FLAC", "subtype": "PCM_24"}]
+
+"trim" removes leading and trailing silence quieter than `db` below the
+peak. A "split" step (last, before "format") cuts each sound into one clip
+per sound instead, written to a folder named after it, and stores where the
+sounds are in the database's segments table. Its `threshold_db` is absolute
+(dBFS), so a chain that only splits reads every file once, block by block,
+and long field recordings never have to fit in memory.
+
+Files are spread over a process pool. Each worker reads its input and
+writes its output itself, so no audio crosses process boundaries; the
+parent only collects one metadata row per file, registers them in
+MetaDataDB in batched transactions and keeps a manifest in the output
+folder. Running the same chain into the same folder again skips the files
+the manifest lists as done, so an interrupted run resumes where it stopped.
+
+    python3 Epoch123/BatchProcessor.py chain.json --folder Epoch123/ESMD/animals --output out
+    python3 Epoch123/BatchProcessor.py chain.json --tag birds --output out --workers 8
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import soundfile as sf
+from PySide6.QtCore import QObject, QRunnable, Signal
+
+import EditList
+import PhaseVocoder
+from EditList import Source, Filter, PitchShift, TimeStretch, Gain
+from Silence import THRESHOLD_DB, MIN_SILENCE, PADDING, find_sounds, trim_silence, split_file, clip_path, writable_subtype
+from StreamingDSP import FILTER_TYPES
+from eutils import is_audio_file
+
+logger = logging.getLogger(__name__)
+
+# Manifest written to the output folder
+MANIFEST_NAME = 'batch_manifest.json'
+
+# Results registered in the database (and the manifest saved) together
+DB_BATCH = 64
+FLUSH_SECONDS = 5.0
+
+# Parameters of each step: (required, optional with defaults)
+STEPS = {
+    'filter': ({'type', 'cutoff'}, {'order': 4, 'zero_phase': True}),
+    'pitch': ({'semitones'}, {}),
+    'tempo': ({'percent'}, {}),
+    'trim': ({'db'}, {}),
+    'gain': ({'db'}, {}),
+    'normalize': ({'lufs'}, {}),
+    'resample': ({'rate'}, {}),
+    'split': (set(), {'threshold_db': THRESHOLD_DB, 'min_silence': MIN_SILENCE, 'padding': PADDING}),
+    'format': ({'format'}, {'subtype': None}),
+}
+
+
+def parse_chain(steps):
+    """Check a chain (a list of step dicts) and fill in defaults. Raises ValueError on mistakes."""
+    if not isinstance(steps, list):
+        raise ValueError("A chain must be a list of steps.")
+    chain = []
+    for number, step in enumerate(steps, 1):
+        op = step.get('op') if isinstance(step, dict) else None
+        if op not in STEPS:
+            raise ValueError(f"Step {number}: unknown op {op!r} (expected one of {', '.join(STEPS)})")
+        required, defaults = STEPS[op]
+        missing = required - step.keys()
+        if missing:
+            raise ValueError(f"Step {number} ({op}): missing {', '.join(sorted(missing))}")
+        unknown = step.keys() - required - defaults.keys() - {'op'}
+        if unknown:
+            raise ValueError(f"Step {number} ({op}): unknown parameter {', '.join(sorted(unknown))}")
+        step = {**defaults, **step}
+        if op == 'filter' and step['type'] not in FILTER_TYPES:
+            raise ValueError(f"Step {number}: unknown filter type {step['type']!r}")
+        if op == 'format' and step['format'].upper() not in sf.available_formats():
+            raise ValueError(f"Step {number}: unknown format {step['format']!r}")
+        chain.append(step)
+    ops = [step['op'] for step in chain if step['op'] != 'format']
+    if 'split' in ops and ops.index('split') != len(ops) - 1:
+        raise ValueError("A split step can only be the last step (before format).")
+    return chain
+
+
+def load_chain(path):
+    with open(path) as f:
+        return parse_chain(json.load(f))
+
+
+def output_format(chain):
+    """The (format, subtype) chosen by the chain's last format step, or None to keep each input's."""
+    formats = [step for step in chain if step['op'] == 'format']
+    return (formats[-1]['format'].upper(), formats[-1]['subtype']) if formats else None
+
+
+def output_path(path, root, output_dir, chain):
+    """Where the output of `path` goes: its place under `root`, mirrored in `output_dir`."""
+    relative = os.path.relpath(path, root)
+    chosen = output_format(chain)
+    extension = '.' + chosen[0].lower() if chosen else os.path.splitext(path)[1]
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + extension)
+
+
+def file_row(path):
+    """Metadata row (name, path, channels, rate, size in KB, duration) of a written file."""
+    info = sf.info(path)
+    size_kb = round(os.path.getsize(path) / 1024, 2)
+    return (os.path.basename(path), path, info.channels, info.samplerate, size_kb, round(info.duration, 2))
+
+
+def process_file(path, out_path, chain):
+    """
+    Apply `chain` to the sound at `path` and write the result to `out_path`
+    (in a worker process). Returns (metadata rows of the outputs, segments),
+    where segments are the (start, end, clip path) of the clips a split step
+    made, in seconds, or None.
+    """
+    info = sf.info(path)
+    file_format, subtype = output_format(chain) or (info.format, info.subtype)
+    split = next((step for step in chain if step['op'] == 'split'), None)
+    if split is not None:
+        split_options = {key: split[key] for key in ('threshold_db', 'min_silence', 'padding')}
+        clips_dir = os.path.splitext(out_path)[0]
+        if all(step['op'] in ('split', 'format') for step in chain):
+            # Nothing to render: scan and cut the file straight from disk
+            clips, fs = split_file(path, clips_dir, *(output_format(chain) or (None, None)), **split_options)
+            return [file_row(clip) for clip, _, _ in clips], [(a / fs, b / fs, clip) for clip, a, b in clips]
+
+    data, fs = sf.read(path, dtype='float32', always_2d=True)
+    edit = Source(data, fs)
+    for step in chain:
+        op = step['op']
+        if op == 'filter':
+            edit = edit.apply(Filter(step['type'], step['cutoff'], fs, step['order'], step['zero_phase']))
+        elif op == 'pitch':
+            edit = edit.apply(PitchShift(2 ** (step['semitones'] / 12)))
+        elif op == 'tempo':
+            edit = edit.apply(TimeStretch(step['percent'] / 100))
+        elif op == 'trim':
+            edit = trim_silence(edit, step['db'])
+        elif op == 'gain':
+            edit = edit.apply(Gain(10 ** (step['db'] / 20)))
+        elif op == 'normalize':
+            # Imported here: Loudness uses this module's helpers
+            from Loudness import measure
+            lufs = measure(edit.blocks(), fs, edit.shape[1])['lufs']
+            if lufs is not None:
+                edit = edit.apply(Gain(10 ** ((step['lufs'] - lufs) / 20)))
+        elif op == 'resample':
+            edit = edit.at_rate(step['rate'])
+            fs = edit.fs
+
+    if output_format(chain) is None:
+        subtype = writable_subtype(file_format, subtype, fs, edit.shape[1])
+    kwargs = {'format': file_format}
+    if subtype:
+        kwargs['subtype'] = subtype
+    if split is None:
+        _export(edit, out_path, fs, kwargs)
+        return [file_row(out_path)], None
+
+    segments = []
+    extension = os.path.splitext(out_path)[1]
+    sounds = find_sounds(edit.blocks(), fs, **split_options)
+    for number, (start, stop) in enumerate(sounds, 1):
+        clip = clip_path(path, clips_dir, number, extension)
+        _export(edit.crop(start, stop), clip, fs, kwargs)
+        segments.append((start / fs, stop / fs, clip))
+    return [file_row(clip) for _, _, clip in segments], segments
+
+
+def _export(edit, out_path, fs, kwargs):
+    """Write `edit` next to `out_path` and move it into place, so a crash never leaves half a file."""
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    partial = out_path + '.part'
+    edit.export(partial, fs, **kwargs)
+    os.replace(partial, out_path)
+
+
+def _init_worker():
+    """Each process handles one file at a time, so keep its own rendering single-threaded."""
+    EditList.RENDER_WORKERS = 1
+    PhaseVocoder.FFT_WORKERS = 1
+
+
+def collect_folder(folder):
+    """Audio files under `folder`, in name order."""
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files) if is_audio_file(name))
+    return paths
+
+
+class BatchProcessor:
+    """
+    Applies a chain to many files on a process pool, one file per task, with
+    all cores busy by default. Outputs are registered in `metadata_db` (if
+    given, with optional `tags`) DB_BATCH at a time, and the manifest is
+    saved at the same moments, so at most one batch is redone after a crash.
+    """
+    def __init__(self, chain, output_dir, workers=None, metadata_db=None, tags=()):
+        self.chain = parse_chain(chain)
+        self.output_dir = os.path.abspath(output_dir)
+        self.workers = workers or os.cpu_count() or 1
+        self.metadata_db = metadata_db
+        self.tags = tuple(tags)
+        self.manifest_path = os.path.join(self.output_dir, MANIFEST_NAME)
+        self.manifest = self.load_manifest()
+        self._rows = []
+        self._segments = []
+
+    def load_manifest(self):
+        """The saved manifest for this chain, or an empty one."""
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable manifest {self.manifest_path}: {e}")
+            manifest = None
+        if manifest is not None and manifest.get('chain') != self.chain:
+            logger.warning("The chain changed since the last run; processing every file again.")
+            manifest = None
+        return manifest or {'chain': self.chain, 'files': {}}
+
+    def is_done(self, path):
+        entry = self.manifest['files'].get(path)
+        if not entry or entry['status'] != 'done':
+            return False
+        return all(map(os.path.exists, entry.get('outputs', [entry.get('output', '')])))
+
+    def run(self, paths, root=None, progress=None, should_stop=None):
+        """
+        Process `paths` (outputs mirror their layout under `root`, by default
+        their common folder). `progress(done, total, path)` is called after
+        each file; returning True from `should_stop()` cancels the files not
+        started yet. Returns a summary dict.
+        """
+        paths = [os.path.abspath(path) for path in paths]
+        if root is None:
+            root = os.path.commonpath([os.path.dirname(path) for path in paths]) if paths else ''
+        todo = [path for path in paths if not self.is_done(path)]
+        summary = {'total': len(paths), 'skipped': len(paths) - len(todo), 'done': 0, 'failed': 0}
+        if not todo:
+            return summary
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        last_flush = time.monotonic()
+        context = multiprocessing.get_context('spawn')
+        pool = ProcessPoolExecutor(min(self.workers, len(todo)), mp_context=context, initializer=_init_worker)
+        try:
+            futures = {pool.submit(process_file, path, output_path(path, root, self.output_dir, self.chain),
+                                   self.chain): path for path in todo}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    rows, segments = future.result()
+                except Exception as e:
+                    logger.error(f"Batch processing failed for {path}: {e}")
+                    self.manifest['files'][path] = {'status': 'failed', 'error': str(e)}
+                    summary['failed'] += 1
+                else:
+                    self.manifest['files'][path] = {'status': 'done', 'outputs': [row[1] for row in rows]}
+                    self._rows.extend(rows)
+                    if segments is not None:
+                        self._segments.append((path, segments))
+                    summary['done'] += 1
+                if len(self._rows) >= DB_BATCH or time.monotonic() - last_flush > FLUSH_SECONDS:
+                    self.flush()
+                    last_flush = time.monotonic()
+                if progress:
+                    progress(summary['skipped'] + summary['done'] + summary['failed'], len(paths), path)
+                if should_stop and should_stop():
+                    break
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            self.flush()
+        return summary
+
+    def flush(self):
+        """Register the pending outputs (and segments) in the database, then save the manifest."""
+        if self.metadata_db is not None:
+            self.metadata_db.insert_many(self._rows, self.tags)
+            self.metadata_db.set_segments_many(self._segments)
+        self._rows = []
+        self._segments = []
+        partial = self.manifest_path + '.part'
+        with open(partial, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(partial, self.manifest_path)
+
+
+class BatchJobSignals(QObject):
+    """
+    Signals for BatchJob (QRunnable cannot emit signals itself).
+      - progress(done: int, total: int, path: str)
+      - finished(summary: dict)
+      - error(message: str)
+    """
+    progress = Signal(int, int, str)
+    finished = Signal(dict)
+    error = Signal(str)
+
+
+class BatchJob(QRunnable):
+    """
+    Runs a BatchProcessor (or anything with the same run(), like a
+    LoudnessAnalyzer) on a thread pool thread, for the GUI; cancel() stops
+    it after the current files.
+    """
+    def __init__(self, processor, paths, root=None):
+        super().__init__()
+        self.processor = processor
+        self.paths = paths
+        self.root = root
+        self.signals = BatchJobSignals()
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            summary = self.processor.run(self.paths, self.root, self.signals.progress.emit, lambda: self.cancelled)
+            self.signals.finished.emit(summary)
+        except Exception as e:
+            logger.error(f"Batch processing failed: {e}")
+            self.signals.error.emit(str(e))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply an effect chain to many sounds.")
+    parser.add_argument('chain', help="JSON file with the list of steps")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--folder', help="Process the audio files in this folder and its subfolders")
+    source.add_argument('--tag', help="Process the files with this tag in the metadata database")
+    parser.add_argument('--output', required=True, help="Folder the processed files are written to")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: one per core)")
+    parser.add_argument('--db', help="Metadata database (default: the archive's)")
+    parser.add_argument('--no-db', action='store_true', help="Do not register the outputs")
+    parser.add_argument('--label', action='append', default=[], help="Tag every output with this tag")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    try:
+        chain = load_chain(args.chain)
+    except (OSError, ValueError) as e:
+        parser.error(f"Invalid chain: {e}")
+
+    from MetaData import MetaDataDB
+    metadata_db = None if args.no_db and not args.tag else MetaDataDB(args.db)
+    if args.folder:
+        root = os.path.abspath(args.folder)
+        paths = collect_folder(root)
+    else:
+        root = None
+        paths = sorted(metadata_db.get_files_by_tag(args.tag))
+
+    processor = BatchProcessor(chain, args.output, args.workers, None if args.no_db else metadata_db, args.label)
+
+    def progress(done, total, path):
+        print(f"[{done}/{total}] {os.path.basename(path)}", flush=True)
+
+    summary = processor.run(paths, root, progress)
+    print(f"{summary['done']} processed, {summary['failed']} failed, {summary['skipped']} already done")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import numpy as np
+
+
+def freeze(array):
+    """Mark an array read-only so it can be shared between states (copy-on-write)."""
+    if isinstance(array, np.ndarray) and array.flags.writeable:
+        array.setflags(write=False)
+    return array
+
+
+class HistoryEntry:
+    """
+    One step of edit history, stored as the operation that restores it:
+      - 'state': replace the data with `data` (an immutable EditList)
+      - 'view':  only the view changes
+    `view` is the (xmin, xmax) range to show after restoring.
+    """
+    __slots__ = ('kind', 'view', 'data')
+
+    def __init__(self, kind, view, data=None):
+        self.kind = kind
+        self.view = view
+        self.data = data
+
+    def apply(self, data, current_view):
+        """
+        Apply this entry to `data`. Returns (new_data, new_view, inverse_entry),
+        where inverse_entry brings back `data` and `current_view`.
+        """
+        if self.kind == 'state':
+            return self.data, self.view, HistoryEntry('state', current_view, data)
+        return data, self.view, HistoryEntry('view', current_view)
+
+
+class EditHistory:
+    """
+    Undo/redo history of edit lists. Every state is an immutable EditList
+    over the same read-only source, so an entry costs a few small nodes, not
+    a copy of the audio; rendered samples live in EditList.render_cache,
+    whose size EPOCH123_RENDER_CACHE_MB caps. At most `max_entries` undo
+    steps are kept.
+    """
+    def __init__(self, max_entries=200):
+        self.max_entries = max_entries
+        self.undo_stack = []
+        self.redo_stack = []
+        self.original = None
+
+    # ---- recording ----
+
+    def reset(self, original=None):
+        """Forget all history, e.g. when a new file is loaded."""
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.original = original
+
+    def push_state(self, previous, view):
+        """Record an edit that replaced the whole edit list; `previous` is shared, not copied."""
+        self._push(HistoryEntry('state', view, previous))
+
+    def push_view(self, view):
+        """Record a change of the visible range only."""
+        self._push(HistoryEntry('view', view))
+
+    def _push(self, entry):
+        self.undo_stack.append(entry)
+        self.redo_stack.clear()
+        if len(self.undo_stack) > self.max_entries:
+            del self.undo_stack[0]
+
+    # ---- navigation ----
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self, data, view):
+        """Return (data, view) before the last edit, or None if there is nothing to undo."""
+        return self._step(self.undo_stack, self.redo_stack, data, view)
+
+    def redo(self, data, view):
+        """Return (data, view) after the last undone edit, or None."""
+        return self._step(self.redo_stack, self.undo_stack, data, view)
+
+    def _step(self, source, target, data, view):
+        if not source:
+            return None
+        entry = source.pop()
+        new_data, new_view, inverse = entry.apply(data, view)
+        target.append(inverse)
+        return new_data, new_view
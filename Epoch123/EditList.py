@@ -0,0 +1,667 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.signal as sig
+import soundfile as sf
+
+from EditHistory import freeze
+from WaveformRenderer import display_samples, stream_peak_levels
+from StreamingDSP import design_filter, settle_length
+from PhaseVocoder import pitch_shift, pitch_range, stretch_range, time_stretch
+from Resampling import rate_ratio, resample_range
+
+# Samples rendered per block when an edit list is streamed (export, playback, peaks)
+BLOCK_SIZE = 1 << 16
+
+# Fewest neighbouring samples rendered on each side of a range before filtering it;
+# filters whose impulse response is longer use its settle length instead
+FILTER_MARGIN = 8192
+
+# Worker threads rendering blocks of long ranges (scipy's filters release the GIL)
+RENDER_WORKERS = int(os.environ.get('EPOCH123_RENDER_WORKERS', min(os.cpu_count() or 1, 8)))
+
+# Memory budget for cached node renders, in MB
+CACHE_BUDGET_MB = float(os.environ.get('EPOCH123_RENDER_CACHE_MB', 512))
+
+_render_pool = None
+_pool_lock = threading.Lock()
+_in_worker = threading.local()
+
+
+def _run_in_worker(func, item):
+    _in_worker.active = True
+    try:
+        return func(item)
+    finally:
+        _in_worker.active = False
+
+
+def parallel_map(func, items):
+    """
+    Yield func(item) for each item, in order, computed on the render pool
+    with at most 2 * RENDER_WORKERS results in flight, so memory stays
+    bounded however many items there are. Calls made from a pool thread
+    (nested edit lists) run serially to avoid starving the pool.
+    """
+    global _render_pool
+    items = list(items)
+    if RENDER_WORKERS <= 1 or len(items) <= 1 or getattr(_in_worker, 'active', False):
+        for item in items:
+            yield func(item)
+        return
+    with _pool_lock:
+        if _render_pool is None:
+            _render_pool = ThreadPoolExecutor(RENDER_WORKERS, thread_name_prefix="EditListRender")
+    pending = deque()
+    for item in items:
+        pending.append(_render_pool.submit(_run_in_worker, func, item))
+        if len(pending) >= 2 * RENDER_WORKERS:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _digest(*parts):
+    """Short, stable hash of `parts` (reprs of numbers, strings and other digests)."""
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def _nbytes(value):
+    """Bytes held by the arrays in `value` (an array, or nested tuples/lists of them)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(item) for item in value)
+    return 0
+
+
+class RenderCache:
+    """
+    Least-recently-used store of rendered node outputs, keyed by the node's
+    content key (see EditList.key) and the block or product rendered.
+    Keys describe the whole computation that produced a value, so entries
+    never go stale: an edited chain just asks for different keys, and every
+    node upstream of the change is served from here.
+    """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = int(CACHE_BUDGET_MB * 2**20 if max_bytes is None else max_bytes)
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= _nbytes(old)
+            self.entries[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= _nbytes(evicted)
+        return value
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute())
+        return value
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.bytes = 0
+
+
+render_cache = RenderCache()
+
+
+# ---- effects ----
+
+class Effect:
+    """
+    The processing step of an effect node.
+    `margin` is the number of neighbouring samples needed on each side to
+    process a range; effects whose output is not aligned with their input
+    override render() instead.
+    """
+    margin = 0
+
+    @property
+    def key(self):
+        """Type and parameters (every non-array attribute), identifying what the effect computes."""
+        params = sorted((name, value) for name, value in vars(self).items() if not isinstance(value, np.ndarray))
+        return (type(self).__name__,) + tuple(params)
+
+    def describe(self):
+        """Short label for the effect, as listed in the SoundEditor."""
+        return type(self).__name__
+
+    def channels(self, shape):
+        """Trailing shape of the output for an input whose trailing shape is `shape`."""
+        return shape
+
+    def length(self, length):
+        """Number of output samples for an input of `length` samples."""
+        return length
+
+    def process(self, block):
+        raise NotImplementedError
+
+    def render(self, input, start, stop):
+        """Samples [start, stop) of the output for `input` (an EditList), processed with `margin` samples of context."""
+        low, high = max(0, start - self.margin), min(len(input), stop + self.margin)
+        return self.process(input.render(low, high))[start - low:stop - low]
+
+
+class Downmix(Effect):
+    """Mix all channels down to one."""
+    def channels(self, shape):
+        return ()
+
+    def process(self, block):
+        return display_samples(block)
+
+    def describe(self):
+        return "Downmix"
+
+
+class Filter(Effect):
+    """
+    Butterworth filter in second-order sections with the cutoff in Hz, the
+    full-quality counterpart of the StreamFilter used for live preview.
+    Zero-phase (sosfiltfilt) by default, or causal (sosfilt) like the preview.
+    All channels are filtered at once; ranges are filtered with enough
+    context on each side that chunks match filtering the whole signal.
+    """
+    def __init__(self, name, cutoff, fs, order=4, zero_phase=True, bandwidth=1.0):
+        self.name = name
+        self.cutoff = cutoff
+        self.fs = fs
+        self.order = order
+        self.zero_phase = zero_phase
+        self.bandwidth = bandwidth
+        self.sos = design_filter(name, cutoff, fs, order, bandwidth)
+        self.margin = max(FILTER_MARGIN, settle_length(self.sos))
+
+    def describe(self):
+        phase = "" if self.zero_phase else ", causal"
+        return f"{self.name} {self.cutoff:.0f} Hz (order {self.order}{phase})"
+
+    def process(self, block):
+        if not self.zero_phase:
+            if not len(block):
+                return block.astype(float)
+            zi = sig.sosfilt_zi(self.sos).reshape((len(self.sos), 2) + (1,) * (block.ndim - 1)) * block[0]
+            return sig.sosfilt(self.sos, block, axis=0, zi=zi)[0]
+        padlen = min(3 * (2 * len(self.sos) + 1), len(block) - 1)
+        if padlen < 0:
+            return block.astype(float)
+        return sig.sosfiltfilt(self.sos, block, axis=0, padlen=padlen)
+
+
+class Gain(Effect):
+    """Scale every sample by `gain`."""
+    def __init__(self, gain):
+        self.gain = gain
+
+    def process(self, block):
+        return block * self.gain
+
+    def describe(self):
+        return f"Gain {20 * np.log10(max(self.gain, 1e-10)):+.1f} dB"
+
+
+class Gate(Effect):
+    """Zero every sample whose magnitude is below `threshold`."""
+    def __init__(self, threshold):
+        self.threshold = threshold
+
+    def process(self, block):
+        return np.where(np.abs(block) < self.threshold, 0, block)
+
+    def describe(self):
+        return f"Trim below {self.threshold:.4f}"
+
+
+class PitchShift(Effect):
+    """Shift pitch by `factor` keeping the length (phase vocoder, see PhaseVocoder.py)."""
+    def __init__(self, factor):
+        self.factor = factor
+
+    def process(self, block):
+        return pitch_shift(block, self.factor)
+
+    def render(self, input, start, stop):
+        return pitch_range(input.render, len(input), self.factor, start, stop, input.shape[1:])
+
+    def describe(self):
+        return f"Pitch {12 * np.log2(self.factor):+.2f} semitones"
+
+
+class TimeStretch(Effect):
+    """Change the tempo by `rate` (2 plays twice as fast) keeping the pitch."""
+    def __init__(self, rate):
+        if rate <= 0:
+            raise ValueError("Tempo rate must be positive.")
+        self.rate = rate
+
+    def length(self, length):
+        return int(round(length / self.rate))
+
+    def process(self, block):
+        return time_stretch(block, 1 / self.rate)
+
+    def render(self, input, start, stop):
+        return stretch_range(input.render, len(input), 1 / self.rate, start, stop, input.shape[1:])
+
+    def describe(self):
+        return f"Tempo {self.rate * 100:.0f}%"
+
+
+# ---- edit lists ----
+
+class EditList:
+    """
+    Immutable, non-destructive description of an edited signal: segment
+    references and effect nodes over the original buffer.
+    Nothing is computed until a range is rendered, and every edit returns a
+    new EditList in constant time, so earlier versions stay valid and cost
+    nothing to keep for undo.
+    Supports len(), .shape, slicing (which renders that range) and np.asarray().
+    Every node has a content `key`; effect outputs and peak levels are
+    memoised in render_cache under it, so rebuilding a chain with one step
+    changed only recomputes the steps after it.
+    """
+    def __init__(self, fs, length, channels=()):
+        self.fs = fs
+        self.shape = (int(length),) + tuple(channels)
+        self._lock = threading.RLock()
+        self._mono = None
+        self._rates = {}
+        self._key = None
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def source(self):
+        """The original buffer every segment refers to."""
+        raise NotImplementedError
+
+    @property
+    def key(self):
+        """Hash of everything this edit list's samples depend on (computed once)."""
+        if self._key is None:
+            self._key = self._make_key()
+        return self._key
+
+    def _make_key(self):
+        raise NotImplementedError
+
+    # ---- graph ----
+
+    def nodes(self):
+        """The chain of nodes from the source up to this one."""
+        chain = [self]
+        while hasattr(chain[-1], 'input'):
+            chain.append(chain[-1].input)
+        return chain[::-1]
+
+    def rebuild(self, input):
+        """This node on top of another input."""
+        raise NotImplementedError
+
+    def replace_node(self, index, effect=None):
+        """
+        The chain with the effect of node `index` (in nodes() order) replaced
+        by `effect`, or that node removed when `effect` is None. Nodes before
+        it are kept as they are, so their cached output is reused.
+        """
+        chain = self.nodes()
+        node = chain[index]
+        if not isinstance(node, EffectNode):
+            raise ValueError("Only effect steps can be edited.")
+        current = node.input if effect is None else node.rebuild(node.input, effect)
+        for later in chain[index + 1:]:
+            current = later.rebuild(current)
+        return current
+
+    # ---- rendering ----
+
+    def render(self, start=0, stop=None):
+        """Return samples [start, stop) of the edited signal as an array."""
+        length = len(self)
+        stop = length if stop is None else min(int(stop), length)
+        start = min(max(int(start), 0), max(stop, 0))
+        return self._render(start, max(stop, start))
+
+    def _render(self, start, stop):
+        raise NotImplementedError
+
+    def _block(self, index):
+        """Aligned block `index` (BLOCK_SIZE frames) of a node that caches its output in blocks."""
+        raise NotImplementedError
+
+    def _render_blocks(self, start, stop):
+        """
+        Render [start, stop) from aligned blocks, rendered on the worker pool
+        (only a few are held at once besides the output) and reused from
+        render_cache next time.
+        """
+        indices = range(start // BLOCK_SIZE, (stop - 1) // BLOCK_SIZE + 1)
+        out = None
+        for index, block in zip(indices, parallel_map(self._block, indices)):
+            a, b = max(start, index * BLOCK_SIZE), min(stop, (index + 1) * BLOCK_SIZE)
+            if len(indices) == 1:
+                return block[a - index * BLOCK_SIZE:b - index * BLOCK_SIZE]
+            if out is None:
+                out = np.empty((stop - start,) + block.shape[1:], dtype=block.dtype)
+            out[a - start:b - start] = block[a - index * BLOCK_SIZE:b - index * BLOCK_SIZE]
+        return out
+
+    def blocks(self, blocksize=BLOCK_SIZE, start=0, stop=None):
+        """Yield the range [start, stop) as consecutive rendered blocks, rendered on the worker pool."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        ranges = [(a, min(a + blocksize, stop)) for a in range(start, stop, blocksize)]
+        yield from parallel_map(lambda r: self.render(*r), ranges)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                return self.render(start, stop)
+        elif isinstance(key, (int, np.integer)):
+            index = range(len(self))[key]
+            return self.render(index, index + 1)[0]
+        return np.asarray(self)[key]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.render()
+        return data if dtype is None else data.astype(dtype)
+
+    # ---- edits ----
+
+    def crop(self, start, stop):
+        """Keep only samples [start, stop)."""
+        return Segments(self, [(start, stop)])
+
+    def cut(self, start, stop):
+        """Remove samples [start, stop)."""
+        return Segments(self, [(0, start), (stop, len(self))])
+
+    def keep(self, ranges):
+        """Keep only the given (start, stop) ranges, played back to back."""
+        return Segments(self, ranges)
+
+    def apply(self, effect):
+        """Add an effect node on top of this edit list."""
+        return EffectNode(self, effect)
+
+    def reverse(self):
+        """This edit list played backwards."""
+        if isinstance(self, Reversed):
+            return self.input
+        return Reversed(self)
+
+    # ---- derived data ----
+
+    def mono(self):
+        """This edit list mixed down to one channel (cached)."""
+        if self.ndim == 1:
+            return self
+        with self._lock:
+            if self._mono is None:
+                self._mono = EffectNode(self, Downmix())
+            return self._mono
+
+    def at_rate(self, rate):
+        """
+        This edit list resampled to `rate` (itself if it is at that rate).
+        The node is kept per rate, and its blocks in render_cache, so each
+        conversion is only computed once.
+        """
+        rate = int(rate)
+        if rate == self.fs:
+            return self
+        with self._lock:
+            if rate not in self._rates:
+                self._rates[rate] = Resampled(self, rate)
+            return self._rates[rate]
+
+    def peak_levels(self):
+        """Min/max peak pyramid of the mono mix, built in one streaming pass (cached)."""
+        mono = self.mono()
+        if mono is not self:
+            return mono.peak_levels()
+        with self._lock:
+            return render_cache.get_or_compute((self.key, 'levels'), lambda: stream_peak_levels(self.blocks()))
+
+    def cached_peak_levels(self):
+        """peak_levels() if they are already computed, else None (never renders)."""
+        return render_cache.get((self.mono().key, 'levels'))
+
+    def peak(self):
+        """Largest absolute sample value of the mono mix."""
+        levels = self.peak_levels()
+        if levels:
+            _, mins, maxs = levels[-1]
+        else:
+            mins = maxs = self.mono().render()
+        if not len(mins):
+            return 0.0
+        return float(max(abs(mins.min()), abs(maxs.max())))
+
+    def export(self, file, samplerate=None, **kwargs):
+        """Write the edited signal to `file` block by block, resampled to `samplerate` if it is given."""
+        edit = self.at_rate(samplerate) if samplerate else self
+        channels = 1 if self.ndim == 1 else self.shape[1]
+        with sf.SoundFile(file, 'w', samplerate=edit.fs, channels=channels, **kwargs) as f:
+            for block in edit.blocks():
+                f.write(block)
+
+
+class Source(EditList):
+    """The unedited buffer of a loaded file (kept read-only)."""
+    def __init__(self, data, fs):
+        super().__init__(fs, len(data), data.shape[1:])
+        self.data = freeze(data)
+
+    @property
+    def source(self):
+        return self.data
+
+    def _make_key(self):
+        content = hashlib.blake2b(digest_size=16)
+        for start in range(0, len(self.data), BLOCK_SIZE):
+            content.update(np.ascontiguousarray(self.data[start:start + BLOCK_SIZE]).data)
+        return _digest('source', self.fs, self.shape, str(self.data.dtype), content.hexdigest())
+
+    def _render(self, start, stop):
+        return self.data[start:stop]
+
+
+class Segments(EditList):
+    """
+    A sequence of (start, stop) ranges of its input, played back to back.
+    Segments of segments are composed into ranges of the underlying input,
+    so the chain never gets deeper with repeated crops and cuts.
+    """
+    def __init__(self, input, ranges):
+        length = len(input)
+        ranges = [(min(max(int(a), 0), length), min(max(int(b), 0), length)) for a, b in ranges]
+        if isinstance(input, Segments):
+            ranges = input.map_ranges(ranges)
+            input = input.input
+
+        merged = []
+        for start, stop in ranges:
+            if stop <= start:
+                continue
+            if merged and merged[-1][1] == start:
+                merged[-1] = (merged[-1][0], stop)
+            else:
+                merged.append((start, stop))
+
+        self.input = input
+        self.ranges = tuple(merged)
+        self.offsets = np.cumsum([0] + [stop - start for start, stop in self.ranges])
+        super().__init__(input.fs, self.offsets[-1], input.shape[1:])
+
+    @property
+    def source(self):
+        return self.input.source
+
+    def _make_key(self):
+        return _digest('segments', self.input.key, self.ranges)
+
+    def rebuild(self, input):
+        return Segments(input, self.ranges)
+
+    def map_ranges(self, ranges):
+        """Translate ranges of this edit list into ranges of its input."""
+        mapped = []
+        for start, stop in ranges:
+            i = int(np.searchsorted(self.offsets, start, side='right')) - 1
+            while start < stop and i < len(self.ranges):
+                range_start, range_stop = self.ranges[i]
+                offset = range_start + start - int(self.offsets[i])
+                take = min(stop - start, range_stop - offset)
+                mapped.append((offset, offset + take))
+                start += take
+                i += 1
+        return mapped
+
+    def _render(self, start, stop):
+        pieces = [self.input.render(a, b) for a, b in self.map_ranges([(start, stop)])]
+        if not pieces:
+            return self.input.render(0, 0)
+        return pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+
+
+class EffectNode(EditList):
+    """
+    An effect applied to the whole of its input. Its output is memoised in
+    render_cache in BLOCK_SIZE-aligned blocks, each rendered from just the
+    input it depends on, so playback, drawing and export share them and
+    no block needs the whole signal.
+    """
+    def __init__(self, input, effect):
+        super().__init__(input.fs, effect.length(len(input)), effect.channels(input.shape[1:]))
+        self.input = input
+        self.effect = effect
+
+    @property
+    def source(self):
+        return self.input.source
+
+    def _make_key(self):
+        return _digest('effect', self.input.key, self.effect.key)
+
+    def rebuild(self, input, effect=None):
+        return EffectNode(input, effect or self.effect)
+
+    def _render(self, start, stop):
+        if stop <= start:
+            return self.effect.render(self.input, start, stop)
+        return self._render_blocks(start, stop)
+
+    def _block(self, index):
+        """Aligned block `index` of the output, from the cache or rendered by the effect."""
+        start = index * BLOCK_SIZE
+        stop = min(start + BLOCK_SIZE, len(self))
+        return render_cache.get_or_compute(
+            (self.key, index), lambda: freeze(self.effect.render(self.input, start, stop)))
+
+
+class Reversed(EditList):
+    """Its input played backwards; each range is rendered forwards and flipped (a view)."""
+    def __init__(self, input):
+        super().__init__(input.fs, len(input), input.shape[1:])
+        self.input = input
+
+    @property
+    def source(self):
+        return self.input.source
+
+    def _make_key(self):
+        return _digest('reversed', self.input.key)
+
+    def rebuild(self, input):
+        return Reversed(input)
+
+    def _render(self, start, stop):
+        length = len(self)
+        return self.input.render(length - stop, length - start)[::-1]
+
+
+class Resampled(EditList):
+    """
+    Its input converted to another sample rate with polyphase filtering
+    (resample_poly), rendered lazily in aligned blocks that are cached like
+    effect outputs. Any range equals that range of the whole signal
+    resampled at once, so playback can seek anywhere.
+    """
+    def __init__(self, input, rate):
+        self.up, self.down = rate_ratio(input.fs, rate)
+        super().__init__(int(rate), -(-len(input) * self.up // self.down), input.shape[1:])
+        self.input = input
+
+    @property
+    def source(self):
+        return self.input.source
+
+    def _make_key(self):
+        return _digest('resampled', self.input.key, self.fs)
+
+    def rebuild(self, input):
+        return input.at_rate(self.fs)
+
+    def _render(self, start, stop):
+        if stop <= start:
+            return np.zeros((0,) + self.shape[1:], dtype=np.float32)
+        return self._render_blocks(start, stop)
+
+    def _block(self, index):
+        start = index * BLOCK_SIZE
+        stop = min(start + BLOCK_SIZE, len(self))
+        return render_cache.get_or_compute((self.key, index), lambda: freeze(
+            resample_range(self.input.render, len(self.input), self.up, self.down, start, stop)))
+
+
+def resampled(data, fs, rate):
+    """`data` (an array or an EditList at rate `fs`) as an edit list at `rate`."""
+    if not isinstance(data, EditList):
+        data = Source(data, fs)
+    return data.at_rate(rate)
+
+
+def write_audio(file, data, samplerate, **kwargs):
+    """Write an array or an EditList to `file` (an EditList is rendered block by block)."""
+    if isinstance(data, EditList):
+        data.export(file, samplerate, **kwargs)
+    else:
+        sf.write(file, data, samplerate, **kwargs)
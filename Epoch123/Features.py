@@ -0,0 +1,448 @@
+"""
+Acoustic features of sound files and "find similar sounds": a summary
+vector per file (MFCC, chroma and spectral statistics, via librosa) kept in
+a memory-mapped store keyed by file_id, and a nearest-neighbour index over
+it, exact for small libraries and inverted-file (clustered) for large ones.
+
+    python3 Epoch123/Features.py --folder Epoch123/ESMD --workers 8
+    python3 Epoch123/Features.py --similar-to Epoch123/ESMD/bird.wav
+"""
+import os
+import sys
+import time
+import hashlib
+import logging
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import soundfile as sf
+from PySide6.QtCore import QObject, QRunnable, Signal
+
+from eutils import get_main_sound_dir_path
+from Resampling import rate_ratio, resample
+from BatchProcessor import file_row, collect_folder
+
+logger = logging.getLogger(__name__)
+
+# Analysis rate, STFT and the part of each file analysed
+SAMPLE_RATE = 22050
+N_FFT = 2048
+HOP_LENGTH = 512
+MAX_SECONDS = 30.0
+
+# Mean and standard deviation of: MFCCs, chroma, then centroid, bandwidth,
+# roll-off, flatness, zero-crossing rate and RMS
+N_MFCC = 20
+N_CHROMA = 12
+N_SPECTRAL = 6
+FEATURE_DIM = 2 * (N_MFCC + N_CHROMA + N_SPECTRAL)
+
+# Rows the store grows by at a time
+GROW_ROWS = 4096
+
+# Results written together
+DB_BATCH = 64
+
+# Libraries larger than this are searched through clusters instead of exhaustively
+EXACT_LIMIT = int(os.environ.get('EPOCH123_KNN_EXACT_LIMIT', 200000))
+# Clusters searched per query in the approximate index, and k-means rounds building it
+PROBES = 8
+KMEANS_ITERATIONS = 10
+
+
+def extract_features(path, max_seconds=MAX_SECONDS):
+    """The FEATURE_DIM summary vector of the first `max_seconds` of the file at `path` (mixed to mono)."""
+    import librosa
+
+    with sf.SoundFile(path) as f:
+        fs = f.samplerate
+        data = f.read(min(f.frames, int(max_seconds * fs)), dtype='float32', always_2d=True).mean(axis=1)
+    if fs != SAMPLE_RATE:
+        data = resample(data, *rate_ratio(fs, SAMPLE_RATE))
+    if len(data) < N_FFT:
+        data = np.pad(data, (0, N_FFT - len(data)))
+
+    magnitude = np.abs(librosa.stft(data, n_fft=N_FFT, hop_length=HOP_LENGTH))
+    power = magnitude ** 2
+    mel = librosa.feature.melspectrogram(S=power, sr=SAMPLE_RATE)
+    nyquist = SAMPLE_RATE / 2
+    frames = np.vstack([
+        librosa.feature.mfcc(S=librosa.power_to_db(mel), n_mfcc=N_MFCC),
+        librosa.feature.chroma_stft(S=power, sr=SAMPLE_RATE, n_chroma=N_CHROMA),
+        librosa.feature.spectral_centroid(S=magnitude, sr=SAMPLE_RATE) / nyquist,
+        librosa.feature.spectral_bandwidth(S=magnitude, sr=SAMPLE_RATE) / nyquist,
+        librosa.feature.spectral_rolloff(S=magnitude, sr=SAMPLE_RATE) / nyquist,
+        librosa.feature.spectral_flatness(S=magnitude),
+        librosa.feature.zero_crossing_rate(data, frame_length=N_FFT, hop_length=HOP_LENGTH),
+        librosa.feature.rms(S=magnitude, frame_length=N_FFT),
+    ])
+    vector = np.concatenate([frames.mean(axis=1), frames.std(axis=1)])
+    return np.nan_to_num(vector).astype(np.float32)
+
+
+def file_stamp(path):
+    """
+    Non-zero 64-bit hash of a file's path, size and modification time,
+    stored next to its vector so rows of renamed, replaced or rewritten
+    files are ignored. 0 if the file is gone.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    key = f"{path}\0{st.st_size}\0{st.st_mtime_ns}".encode('utf-8', 'surrogateescape')
+    stamp = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little', signed=True)
+    return stamp or 1
+
+
+def feature_dir(db_path):
+    """
+    The directory of the feature store belonging to the metadata database at
+    `db_path`: cache/features next to it, or cache/features-<name> for a
+    database not named metadata.db, since row numbers are its file ids.
+    """
+    directory, name = os.path.split(os.path.abspath(db_path))
+    stem = os.path.splitext(name)[0]
+    return os.path.join(directory, 'cache', 'features' if stem == 'metadata' else f'features-{stem}')
+
+
+class FeatureStore:
+    """
+    Feature vectors on disk, one float32 row per file_id in a memory-mapped
+    matrix (vectors.f32), with the stamp of the file each row was computed
+    for in stamps.i64 (0 = empty). Reads touch only the pages they need, and
+    the whole matrix is read as one array for the nearest-neighbour index.
+    Safe to use from worker threads.
+    """
+    def __init__(self, directory=None, dim=FEATURE_DIM):
+        self.directory = directory or os.path.join(get_main_sound_dir_path('Epoch123/DB'), 'cache', 'features')
+        self.dim = dim
+        self.vectors_path = os.path.join(self.directory, 'vectors.f32')
+        self.stamps_path = os.path.join(self.directory, 'stamps.i64')
+        self._lock = threading.Lock()
+        self._rows = None
+        self._vectors = None
+        self._stamps = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _map(self):
+        """(Re)map the files if another process or a put grew them."""
+        rows = os.path.getsize(self.stamps_path) // 8 if os.path.exists(self.stamps_path) else 0
+        if rows == self._rows:
+            return
+        if rows:
+            self._stamps = np.memmap(self.stamps_path, dtype=np.int64, mode='r+', shape=(rows,))
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(rows, self.dim))
+        else:
+            self._stamps = np.zeros(0, dtype=np.int64)
+            self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self._rows = rows
+
+    def _grow(self, rows):
+        rows = -(-rows // GROW_ROWS) * GROW_ROWS
+        self._vectors = self._stamps = None
+        for path, row_bytes in ((self.vectors_path, 4 * self.dim), (self.stamps_path, 8)):
+            with open(path, 'ab') as f:
+                f.truncate(rows * row_bytes)
+        self._rows = None
+        self._map()
+
+    def version(self):
+        """Changes whenever vectors are stored, by this process or another."""
+        try:
+            st = os.stat(self.stamps_path)
+        except FileNotFoundError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def put_many(self, items):
+        """Store (file_id, file_path, vector) items and flush them to disk."""
+        items = list(items)
+        if not items:
+            return
+        with self._lock:
+            self._map()
+            needed = max(file_id for file_id, _, _ in items) + 1
+            if needed > self._rows:
+                self._grow(needed)
+            for file_id, path, vector in items:
+                self._vectors[file_id] = vector
+                self._stamps[file_id] = file_stamp(path)
+            self._vectors.flush()
+            self._stamps.flush()
+
+    def get(self, file_id, path):
+        """The vector stored for file_id, or None if there is none for the file as it is now."""
+        stamp = file_stamp(path)
+        with self._lock:
+            self._map()
+            if file_id is None or file_id >= self._rows or not stamp or self._stamps[file_id] != stamp:
+                return None
+            return np.array(self._vectors[file_id])
+
+    def valid(self, files):
+        """
+        (file_ids, vectors) of the (file_id, file_path) pairs in `files` that
+        have a vector for the file as it is now, as an int64 array and a float32 matrix.
+        """
+        ids = np.array([file_id for file_id, _ in files], dtype=np.int64)
+        stamps = np.array([file_stamp(path) for _, path in files], dtype=np.int64)
+        with self._lock:
+            self._map()
+            inside = (ids < self._rows) & (stamps != 0)
+            ids, stamps = ids[inside], stamps[inside]
+            ids = ids[self._stamps[ids] == stamps]
+            return ids, np.array(self._vectors[ids])
+
+
+def unit_rows(matrix):
+    """`matrix` with every non-zero row scaled to unit length, as float32."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (matrix / norms).astype(np.float32)
+
+
+def nearest_centroids(matrix, centroids, chunk=65536):
+    """Index of the most similar centroid for every row of `matrix`."""
+    return np.concatenate([np.argmax(matrix[start:start + chunk] @ centroids.T, axis=1)
+                           for start in range(0, len(matrix), chunk)])
+
+
+class SimilarityIndex:
+    """
+    Nearest neighbours by cosine similarity of standardised feature vectors.
+    The vectors are z-scored per dimension and normalised once, so a query
+    is one matrix-vector product over the library. Above EXACT_LIMIT files
+    they are also clustered (k-means on a sample, about sqrt(n) clusters)
+    and a query only scores the PROBES clusters closest to it.
+    """
+    def __init__(self, file_ids, vectors, exact_limit=EXACT_LIMIT):
+        self.file_ids = np.asarray(file_ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.mean = vectors.mean(axis=0) if len(vectors) else np.zeros(vectors.shape[1], dtype=np.float32)
+        self.scale = vectors.std(axis=0) if len(vectors) else np.ones(vectors.shape[1], dtype=np.float32)
+        self.scale[self.scale == 0] = 1
+        self.matrix = self.normalize(vectors)
+        self.centroids = None
+        if len(self.file_ids) > exact_limit:
+            self._cluster()
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def normalize(self, vectors):
+        """Standardised unit-length rows of `vectors` (one vector or a matrix)."""
+        return unit_rows((np.atleast_2d(vectors) - self.mean) / self.scale)
+
+    def _cluster(self):
+        """Spherical k-means (dot products, renormalised means) on a sample, then every row to its cluster."""
+        count = int(np.sqrt(len(self.matrix)))
+        rng = np.random.default_rng(0)
+        sample = self.matrix[rng.choice(len(self.matrix), min(len(self.matrix), 64 * count), replace=False)]
+        centroids = sample[rng.choice(len(sample), count, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = nearest_centroids(sample, centroids)
+            order = np.argsort(assignment, kind='stable')
+            starts = np.searchsorted(assignment[order], np.arange(count))
+            filled = np.bincount(assignment, minlength=count) > 0
+            sums = np.add.reduceat(sample[order], starts[filled], axis=0)
+            centroids = centroids.copy()
+            centroids[filled] = unit_rows(sums)
+        self.centroids = centroids
+        assignment = nearest_centroids(self.matrix, centroids)
+        # Rows sorted by cluster, and where each cluster starts
+        self.order = np.argsort(assignment, kind='stable')
+        self.offsets = np.searchsorted(assignment[self.order], np.arange(count + 1))
+
+    def query(self, vector, k=20, exclude=None):
+        """[(file_id, similarity)] of the `k` vectors most similar to `vector`, best first."""
+        unit = self.normalize(vector)[0]
+        if self.centroids is None:
+            rows = np.arange(len(self.matrix))
+            scores = self.matrix @ unit
+        else:
+            probes = np.argsort(self.centroids @ unit)[::-1][:PROBES]
+            rows = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probes])
+            scores = self.matrix[rows] @ unit
+        if exclude is not None:
+            scores = np.where(self.file_ids[rows] == exclude, -np.inf, scores)
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(self.file_ids[rows[i]]), float(scores[i])) for i in best if np.isfinite(scores[i])]
+
+
+def build_index(store, metadata_db):
+    """A SimilarityIndex of every file in `metadata_db` with a vector in `store`."""
+    file_ids, vectors = store.valid(metadata_db.get_file_ids())
+    return SimilarityIndex(file_ids, vectors)
+
+
+def find_similar(path, store, metadata_db, index=None, k=20):
+    """
+    [(file_path, similarity)] of the `k` files most like the one at `path`,
+    best first. The file's vector is extracted (and stored) if needed.
+    """
+    path = os.path.abspath(path)
+    file_id = metadata_db.get_file_id(path)
+    if file_id is None:
+        metadata_db.insert_many([file_row(path)])
+        file_id = metadata_db.get_file_id(path)
+    vector = store.get(file_id, path)
+    if vector is None:
+        vector = extract_features(path)
+        store.put_many([(file_id, path, vector)])
+    index = index if index is not None else build_index(store, metadata_db)
+    results = index.query(vector, k, exclude=file_id)
+    paths = metadata_db.get_file_paths(file_id for file_id, _ in results)
+    return [(paths[file_id], similarity) for file_id, similarity in results if file_id in paths]
+
+
+class SimilarJobSignals(QObject):
+    """
+    Signals for SimilarJob (QRunnable cannot emit signals itself).
+      - finished(path: str, results: list, index: SimilarityIndex) -> results as from find_similar()
+      - error(message: str)
+    """
+    finished = Signal(str, list, object)
+    error = Signal(str)
+
+
+class SimilarJob(QRunnable):
+    """
+    Runs find_similar() on the thread pool, for the GUI. `index` is reused
+    if given, otherwise built and handed back with the results for the next query.
+    """
+    def __init__(self, path, store, metadata_db, index=None, k=20):
+        super().__init__()
+        self.path = path
+        self.store = store
+        self.metadata_db = metadata_db
+        self.index = index
+        self.k = k
+        self.signals = SimilarJobSignals()
+
+    def run(self):
+        try:
+            if self.index is None:
+                self.index = build_index(self.store, self.metadata_db)
+            results = find_similar(self.path, self.store, self.metadata_db, self.index, self.k)
+        except ImportError as e:
+            self.signals.error.emit(f"Finding similar sounds needs librosa: {e}")
+            return
+        except Exception as e:
+            logger.error(f"Error finding sounds similar to '{self.path}': {e}")
+            self.signals.error.emit(f"Error finding similar sounds: {e}")
+            return
+        self.signals.finished.emit(self.path, results, self.index)
+
+
+def _extract(path):
+    """Worker task: the file's metadata row (to register it if needed) and its feature vector."""
+    return file_row(path), extract_features(path)
+
+
+class FeatureExtractor:
+    """
+    Extracts the feature vectors of many files on a process pool (one file
+    per task) and stores them, DB_BATCH files at a time. run() has the
+    signature BatchJob expects, so the GUI runs it in the background.
+    """
+    def __init__(self, metadata_db, store, workers=None, skip_done=True):
+        self.metadata_db = metadata_db
+        self.store = store
+        self.workers = workers or os.cpu_count() or 1
+        self.skip_done = skip_done
+
+    def run(self, paths, root=None, progress=None, should_stop=None):
+        """Extract `paths` (`root` is unused); `progress` and `should_stop` as in BatchProcessor.run."""
+        paths = [os.path.abspath(path) for path in paths]
+        done = set()
+        if self.skip_done:
+            known = self.metadata_db.get_file_ids()
+            file_ids, _ = self.store.valid(known)
+            stored = set(file_ids.tolist())
+            done = {path for file_id, path in known if file_id in stored}
+        todo = [path for path in paths if path not in done]
+        summary = {'total': len(paths), 'skipped': len(paths) - len(todo), 'done': 0, 'failed': 0}
+        if not todo:
+            return summary
+
+        rows, results = [], []
+        context = multiprocessing.get_context('spawn')
+        pool = ProcessPoolExecutor(min(self.workers, len(todo)), mp_context=context)
+        try:
+            futures = {pool.submit(_extract, path): path for path in todo}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    row, vector = future.result()
+                    rows.append(row)
+                    results.append((path, vector))
+                    summary['done'] += 1
+                except Exception as e:
+                    logger.error(f"Feature extraction failed for {path}: {e}")
+                    summary['failed'] += 1
+                if len(results) >= DB_BATCH:
+                    self.save(rows, results)
+                    rows, results = [], []
+                if progress:
+                    progress(summary['skipped'] + summary['done'] + summary['failed'], len(paths), path)
+                if should_stop and should_stop():
+                    break
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            self.save(rows, results)
+        return summary
+
+    def save(self, rows, results):
+        """Register files that are not in the database yet, then store their vectors under their file_id."""
+        if not results:
+            return
+        self.metadata_db.insert_many(rows)
+        self.store.put_many((self.metadata_db.get_file_id(path), path, vector) for path, vector in results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract acoustic features of sounds and find similar sounds.")
+    parser.add_argument('--folder', help="Extract the audio files in this folder (default: every file in the database)")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: one per core)")
+    parser.add_argument('--db', help="Metadata database (default: the archive's)")
+    parser.add_argument('--again', action='store_true', help="Extract files that were extracted before too")
+    parser.add_argument('--similar-to', metavar='FILE', help="Only list the sounds most similar to this one")
+    parser.add_argument('--count', type=int, default=20, help="Similar sounds listed (default: 20)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from MetaData import MetaDataDB
+    metadata_db = MetaDataDB(args.db)
+    store = FeatureStore(feature_dir(metadata_db.db_path))
+    if args.similar_to:
+        start = time.monotonic()
+        for path, similarity in find_similar(args.similar_to, store, metadata_db, k=args.count):
+            print(f"{similarity:6.3f}  {path}")
+        print(f"in {time.monotonic() - start:.2f} s")
+        return 0
+
+    if args.folder:
+        paths = collect_folder(args.folder)
+    else:
+        paths = metadata_db.get_all_files()
+
+    def progress(done, total, path):
+        print(f"[{done}/{total}] {os.path.basename(path)}", flush=True)
+
+    start = time.monotonic()
+    summary = FeatureExtractor(metadata_db, store, args.workers, not args.again).run(paths, progress=progress)
+    print(f"{summary['done']} extracted, {summary['failed']} failed, {summary['skipped']} already extracted "
+          f"in {time.monotonic() - start:.1f} s")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+import os
+import logging
+
+from PySide6.QtCore import QObject, QRunnable, QFileSystemWatcher, Signal
+
+from eutils import is_audio_file
+
+logger = logging.getLogger(__name__)
+
+# Directories watched for changes at most (each costs an inotify watch or a handle)
+MAX_WATCHED_DIRS = 4096
+
+
+def trigrams(text):
+    """The set of three-character substrings of `text`."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class FileIndex:
+    """
+    In-memory index of file names for searching without touching the disk.
+    Every lower-cased name is broken into trigrams with a posting set of
+    file ids each; a query intersects the postings of its trigrams (rarest
+    first) and checks the few candidates left. `version` changes with every
+    update, so callers can tell whether earlier results are still complete.
+    """
+    def __init__(self, paths=()):
+        self.paths = []         # id -> path (None once removed)
+        self.names = []         # id -> lower-cased file name
+        self.ids = {}           # path -> id
+        self.postings = {}      # trigram -> set of ids
+        self.by_dir = {}        # directory -> set of ids
+        self.version = 0
+        for path in paths:
+            self.add(path)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, path):
+        return path in self.ids
+
+    def add(self, path):
+        """Index `path` (ignored if it already is)."""
+        if path in self.ids:
+            return
+        index = len(self.paths)
+        name = os.path.basename(path).lower()
+        self.paths.append(path)
+        self.names.append(name)
+        self.ids[path] = index
+        for gram in trigrams(name):
+            self.postings.setdefault(gram, set()).add(index)
+        self.by_dir.setdefault(os.path.dirname(path), set()).add(index)
+        self.version += 1
+
+    def remove(self, path):
+        """Forget `path`, or every file under it if it is a directory."""
+        if path in self.ids:
+            doomed = [path]
+        else:
+            prefix = path.rstrip(os.sep) + os.sep
+            doomed = [p for p in self.ids if p.startswith(prefix)]
+        for doomed_path in doomed:
+            index = self.ids.pop(doomed_path)
+            for gram in trigrams(self.names[index]):
+                postings = self.postings.get(gram)
+                if postings is not None:
+                    postings.discard(index)
+                    if not postings:
+                        del self.postings[gram]
+            siblings = self.by_dir.get(os.path.dirname(doomed_path))
+            if siblings is not None:
+                siblings.discard(index)
+                if not siblings:
+                    del self.by_dir[os.path.dirname(doomed_path)]
+            self.paths[index] = None
+            self.names[index] = None
+        if doomed:
+            self.version += 1
+
+    def files_in(self, directory):
+        """Indexed paths directly inside `directory`."""
+        return {self.paths[index] for index in self.by_dir.get(directory, ())}
+
+    def directories(self):
+        return list(self.by_dir)
+
+    def search(self, query, within=None):
+        """
+        Ids of the files whose names contain every whitespace-separated term
+        of `query` (case-insensitive). `within` (ids from a query that this
+        one extends) limits the files checked to those earlier matches.
+        """
+        terms = query.lower().split()
+        if not terms:
+            return set()
+        if within is not None:
+            candidates = within
+        else:
+            grams = set().union(*(trigrams(term) for term in terms))
+            if grams:
+                postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+                candidates = postings[0].intersection(*postings[1:])
+            else:
+                # Terms shorter than a trigram: check every name
+                candidates = range(len(self.names))
+        names = self.names
+        return {index for index in candidates
+                if names[index] is not None and all(term in names[index] for term in terms)}
+
+    def path(self, index):
+        return self.paths[index]
+
+
+class IndexJobSignals(QObject):
+    """
+    Signals for IndexJob (QRunnable cannot emit signals itself).
+      - ready(index: FileIndex)
+    """
+    ready = Signal(object)
+
+
+class IndexJob(QRunnable):
+    """Builds a FileIndex of the audio files registered in the metadata database, on the thread pool."""
+    def __init__(self, metadata_db, root_path):
+        super().__init__()
+        self.metadata_db = metadata_db
+        self.root_path = root_path
+        self.signals = IndexJobSignals()
+
+    def run(self):
+        prefix = self.root_path.rstrip(os.sep) + os.sep
+        try:
+            paths = [path for path in self.metadata_db.get_all_files() if path.startswith(prefix)]
+        except Exception as e:
+            logger.error(f"Failed to read the file list for the search index: {e}")
+            paths = []
+        self.signals.ready.emit(FileIndex(paths))
+
+
+class IndexWatcher(QObject):
+    """
+    Keeps a FileIndex in sync with the disk: watches the root and the
+    indexed directories (at most MAX_WATCHED_DIRS) and, when one changes,
+    lists just that directory and applies the difference. Folders that
+    appear are indexed and watched, folders that disappear are forgotten.
+    Signals:
+      - changed() -> the index was updated
+    """
+    changed = Signal()
+
+    def __init__(self, index, root_path, parent=None):
+        super().__init__(parent)
+        self.index = index
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.on_directory_changed)
+        self.watch([root_path] + index.directories())
+
+    def watch(self, directories):
+        watched = set(self.watcher.directories())
+        room = max(MAX_WATCHED_DIRS - len(watched), 0)
+        new = [d for d in directories if d not in watched and os.path.isdir(d)][:room]
+        if new:
+            self.watcher.addPaths(new)
+
+    def forget(self, path):
+        """Drop `path` and everything under it from the index and the watch list."""
+        self.index.remove(path)
+        prefix = path.rstrip(os.sep) + os.sep
+        gone = [d for d in self.watcher.directories() if d == path or d.startswith(prefix)]
+        if gone:
+            self.watcher.removePaths(gone)
+
+    def refresh(self, path):
+        """Re-read a file or folder the application has just created, moved or deleted."""
+        before = self.index.version
+        if os.path.isdir(path):
+            self.forget(path)
+            self.watch([path])
+            self.sync_directory(path)
+        elif os.path.exists(path):
+            if is_audio_file(path):
+                self.index.add(path)
+        else:
+            self.forget(path)
+        if self.index.version != before:
+            self.changed.emit()
+
+    def on_directory_changed(self, directory):
+        before = self.index.version
+        self.sync_directory(directory)
+        if self.index.version != before:
+            self.changed.emit()
+
+    def sync_directory(self, directory):
+        """Bring the index up to date with the current contents of `directory`."""
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            # The directory itself is gone
+            self.forget(directory)
+            return
+        files = set()
+        subdirectories = set()
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.add(entry.path)
+            elif is_audio_file(entry.path):
+                files.add(entry.path)
+        indexed = self.index.files_in(directory)
+        for path in indexed - files:
+            self.index.remove(path)
+        for path in files - indexed:
+            self.index.add(path)
+
+        # Folders moved away or deleted, found through the indexed directories below this one
+        prefix = directory.rstrip(os.sep) + os.sep
+        known = {prefix + d[len(prefix):].split(os.sep)[0]
+                 for d in self.index.directories() + self.watcher.directories() if d.startswith(prefix)}
+        for gone in known - subdirectories:
+            self.forget(gone)
+        # Folders created or moved in since the index was built
+        for subdirectory in subdirectories - known:
+            self.watch([subdirectory])
+            self.sync_directory(subdirectory)
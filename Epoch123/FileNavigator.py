@@ -2,20 +2,31 @@ import os
 import logging
 import shutil
 import tempfile
-from functools import lru_cache
 from pathlib import Path
 
-from PySide6.QtCore import Qt
-from PySide6.QtGui import QAction
+from collections import OrderedDict
+
+import soundfile as sf
+
+from PySide6.QtCore import Qt, QLineF, QRect, QThreadPool, QTimer, QSortFilterProxyModel
+from PySide6.QtGui import QAction, QActionGroup, QColor, QPainter, QPen, QPixmap
 from PySide6.QtWidgets import (
     QFrame, QVBoxLayout, QLineEdit, QLabel, QFileSystemModel,
-    QTreeView, QHBoxLayout, QMenu, QMessageBox, QWidget, QFileDialog
+    QTreeView, QHBoxLayout, QMenu, QMessageBox, QWidget, QFileDialog,
+    QStyledItemDelegate, QStyleOptionViewItem, QAbstractItemView
 )
 
-from eutils import get_main_sound_dir_path, show_error_message
+from eutils import get_main_sound_dir_path, show_error_message, is_audio_file
+from PeakCache import PeakLoader
 from PlotWidget import PlotWidget
 from AudioManager import AudioProcessor, AudioControlWidget
 from MetaData import MetaDataWidget
+from PlaybackQueue import PlaybackQueue
+from BatchProcessor import BatchProcessor, BatchJob, collect_folder, load_chain
+from Loudness import LoudnessAnalyzer
+from FileIndex import IndexJob, IndexWatcher
+from Features import FeatureStore, FeatureExtractor, SimilarJob, feature_dir
+from Fingerprint import Fingerprinter, DuplicatesJob
 from GUIElements import Button
 from pydub import AudioSegment
 
@@ -32,6 +43,43 @@ class CustomFileSystemModel(QFileSystemModel):
         return flags
 
 
+class SearchFilterModel(QSortFilterProxyModel):
+    """
+    Sits between the file system model and the tree. While a search is
+    active only the matching files and the folders leading to them are
+    shown; both are precomputed path sets, so filtering a row is a set
+    lookup and changing the search filters the loaded rows again in place,
+    without resetting the model or listing any directory.
+    """
+    def __init__(self, root_path, parent=None):
+        super().__init__(parent)
+        self.root_prefix = root_path.rstrip(os.sep) + os.sep
+        self.matches = None     # None = no search, show everything
+        self.ancestors = set()
+
+    def set_matches(self, paths):
+        """Show only `paths` (files under the root) and their folders; None shows everything."""
+        if paths is None:
+            if self.matches is None:
+                return
+            self.matches, self.ancestors = None, set()
+        else:
+            ancestors = set()
+            for directory in {os.path.dirname(path) for path in paths}:
+                while directory.startswith(self.root_prefix) and directory not in ancestors:
+                    ancestors.add(directory)
+                    directory = os.path.dirname(directory)
+            self.matches, self.ancestors = set(paths), ancestors
+        self.invalidateRowsFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.matches is None:
+            return True
+        path = self.sourceModel().filePath(self.sourceModel().index(source_row, 0, source_parent))
+        # Everything above the root stays, or the root itself would be hidden
+        return path in self.matches or path in self.ancestors or not path.startswith(self.root_prefix)
+
+
 class CustomTreeView(QTreeView):
     """
     A QTreeView subclass with custom styling and improved editing behavior.
@@ -69,6 +117,90 @@ class CustomTreeView(QTreeView):
         return editor
 
 
+class WaveformThumbnailDelegate(QStyledItemDelegate):
+    """
+    Draws a small waveform thumbnail to the right of each audio file name.
+    Thumbnails come from cached peak data only; missing peaks are requested
+    from a PeakLoader and the view is repainted once they arrive.
+    """
+    THUMB_WIDTH = 80
+    THUMB_COLOR = QColor('#B19CD9')
+    MAX_PIXMAPS = 5000
+
+    def __init__(self, peak_cache, view):
+        super().__init__(view)
+        self.view = view
+        self.peak_cache = peak_cache
+        self.loader = PeakLoader(peak_cache, self)
+        self.loader.peaks_ready.connect(self.on_peaks_ready)
+        self.pixmaps = OrderedDict()
+
+    def paint(self, painter, option, index):
+        file_path = index.data(QFileSystemModel.FilePathRole)
+        if not file_path or not is_audio_file(file_path):
+            super().paint(painter, option, index)
+            return
+
+        rect = option.rect
+        text_option = QStyleOptionViewItem(option)
+        text_option.rect = rect.adjusted(0, 0, -(self.THUMB_WIDTH + 8), 0)
+        super().paint(painter, text_option, index)
+
+        thumb_rect = QRect(rect.right() - self.THUMB_WIDTH - 4, rect.top() + 3,
+                           self.THUMB_WIDTH, max(rect.height() - 6, 1))
+        pixmap = self.thumbnail(file_path, thumb_rect.width(), thumb_rect.height())
+        if pixmap is not None:
+            painter.drawPixmap(thumb_rect, pixmap)
+
+    def thumbnail(self, file_path, width, height):
+        """Return a cached thumbnail pixmap, or None (and request peaks) if not ready."""
+        key = (file_path, width, height)
+        if key in self.pixmaps:
+            self.pixmaps.move_to_end(key)
+            return self.pixmaps[key]
+
+        peaks = self.peak_cache.peek(file_path)
+        if peaks is None:
+            self.loader.request(file_path)
+            return None
+
+        pixmap = QPixmap(width, height)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        painter.setPen(QPen(self.THUMB_COLOR, 0))
+        half = height / 2
+        columns = peaks.shape[1]
+        lines = [
+            QLineF(x * width / columns, half - hi * half, x * width / columns, half - lo * half)
+            for x, (lo, hi) in enumerate(zip(peaks[0].tolist(), peaks[1].tolist()))
+        ]
+        painter.drawLines(lines)
+        painter.end()
+
+        self.pixmaps[key] = pixmap
+        if len(self.pixmaps) > self.MAX_PIXMAPS:
+            self.pixmaps.popitem(last=False)
+        return pixmap
+
+    def forget(self, path):
+        """
+        Drop the thumbnails of `path` (or of every file under it, if it is a
+        folder) so they are rebuilt from fresh peaks. Returns the file paths
+        whose thumbnails were dropped.
+        """
+        prefix = path.rstrip(os.sep) + os.sep
+        keys = [k for k in self.pixmaps if k[0] == path or k[0].startswith(prefix)]
+        for key in keys:
+            del self.pixmaps[key]
+        self.loader.failed.discard(path)
+        if keys:
+            self.view.viewport().update()
+        return {key[0] for key in keys}
+
+    def on_peaks_ready(self, file_paths):
+        self.view.viewport().update()
+
+
 class FileNavigator(QFrame):
     """
     FileNavigator is responsible for:
@@ -85,6 +217,11 @@ class FileNavigator(QFrame):
         "background-color: #151515; color: white; padding: 2px; "
         "border: 1px solid #151515; border-radius: 5px; font-size: 14px"
     )
+    # Quiet time after the last keystroke before searching, and matches revealed in the tree at most
+    SEARCH_DELAY_MS = 150
+    MAX_REVEALED = 50
+    # Sounds listed by 'Find Similar Sounds'
+    SIMILAR_COUNT = 20
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -101,9 +238,35 @@ class FileNavigator(QFrame):
         self.audio_cache = {}
         self.audio_workers = {}
 
+        # Playback queue and the options new queues are created with
+        self.queue = None
+        self.queue_options = {'shuffle': False, 'repeat': 'off', 'crossfade': 0.0}
+
+        # Running batch job, if any
+        self.batch_job = None
+
+        # File name index (built in the background) and the last search, which the next one may narrow
+        self.file_index = None
+        self.index_watcher = None
+        self.last_query = ""
+        self.last_matches = None
+        self.last_version = None
+
+        # Acoustic feature vectors and the nearest-neighbour index over them (built on first use)
+        self.feature_store = FeatureStore(feature_dir(self.parent.metaDataDB.db_path))
+        self.similarity_index = None
+        self.similarity_version = None
+        # The running 'Find Similar Sounds' or 'Find Duplicates' job
+        self.lookup_job = None
+
         # File system model
         self.model = CustomFileSystemModel(self)
         self.model.setReadOnly(False)
+        self.model.fileRenamed.connect(self.on_file_renamed)
+
+        # Search results filter, between the model and the tree
+        self.proxy = SearchFilterModel(self.root_path, self)
+        self.proxy.setSourceModel(self.model)
 
         # Core UI elements (plot, controls, metadata)
         self.plot_widget = PlotWidget(audio_player=self.parent.audio_player)
@@ -113,6 +276,11 @@ class FileNavigator(QFrame):
         # Build the FileNavigator UI
         self.setup_ui()
 
+        index_job = IndexJob(self.parent.metaDataDB, self.root_path)
+        index_job.signals.ready.connect(self.on_index_ready)
+        self.index_job = index_job
+        QThreadPool.globalInstance().start(index_job)
+
     def setup_ui(self):
         """
         Create the overall layout:
@@ -130,7 +298,11 @@ class FileNavigator(QFrame):
         self.search_bar.setMinimumWidth(self.MIN_WIDTH)
         self.search_bar.setMaximumWidth(self.MAX_WIDTH)
         self.search_bar.setStyleSheet(self.SEARCH_STYLESHEET)
-        self.search_bar.textChanged.connect(self.filter_files)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(self.filter_files)
+        self.search_bar.textChanged.connect(lambda _: self.search_timer.start())
         self.file_nav_layout.addWidget(self.search_bar)
 
         # Upload button
@@ -148,10 +320,15 @@ class FileNavigator(QFrame):
         self.file_tree = CustomTreeView()
         self.file_tree.setMinimumWidth(self.MIN_WIDTH)
         self.file_tree.setMaximumWidth(self.MAX_WIDTH)
-        self.file_tree.setModel(self.model)
+        self.file_tree.setModel(self.proxy)
         self.model.setRootPath(self.root_path)
-        self.file_tree.setRootIndex(self.model.index(self.root_path))
+        self.file_tree.setRootIndex(self.view_index(self.root_path))
         self.file_tree.setHeaderHidden(True)
+        self.file_tree.setSelectionMode(QAbstractItemView.ExtendedSelection)
+
+        # Waveform thumbnails next to audio files
+        self.thumbnail_delegate = WaveformThumbnailDelegate(self.parent.peak_cache, self.file_tree)
+        self.file_tree.setItemDelegateForColumn(0, self.thumbnail_delegate)
 
         # Hide columns other than the name column
         for col in range(1, 4):
@@ -199,35 +376,163 @@ class FileNavigator(QFrame):
         self.layout().addWidget(info_widget)
         return info_widget
 
-    def filter_files(self, keyword: str):
+    def on_index_ready(self, file_index):
+        """Start searching (and keeping) the file name index once it is built."""
+        self.file_index = file_index
+        self.index_job = None
+        self.index_watcher = IndexWatcher(file_index, self.root_path, self)
+        self.index_watcher.changed.connect(self.on_index_changed)
+        logging.info(f"Indexed {len(file_index)} file names for search")
+        if self.search_bar.text().strip():
+            self.filter_files()
+
+    def on_index_changed(self):
+        """Files came or went: run the current search again, if any."""
+        if self.search_bar.text().strip():
+            self.search_timer.start()
+
+    def refresh_index(self, *paths):
+        """Bring the file name index up to date with paths this widget has just changed."""
+        if self.index_watcher is not None:
+            for path in paths:
+                self.index_watcher.refresh(path)
+
+    def filter_files(self):
         """
-        Simple approach: reset the model root to the main path, then expand
-        any file that contains 'keyword' in its name.
-
-        If keyword is empty, it simply resets and doesn't expand anything.
+        Show only the files whose names contain every word of the search
+        text (and the folders leading to them). Names are looked up in the
+        in-memory index; while the text only grows, just the previous
+        matches are checked again. The folders of the first MAX_REVEALED
+        matches (alphabetically) are expanded.
         """
-        keyword = keyword.strip().lower()
-
-        # 1) Clear and re-apply root path
-        self.model.setRootPath("")
-        self.model.setRootPath(self.root_path)
-        self.file_tree.setRootIndex(self.model.index(self.root_path))
-
-        # Hide columns again
-        for col in range(1, 4):
-            self.file_tree.setColumnHidden(col, True)
-
+        keyword = self.search_bar.text().strip().lower()
+        if self.file_index is None:
+            return  # Searched again once the index is ready
         if not keyword:
+            self.last_query, self.last_matches = "", None
+            self.proxy.set_matches(None)
             return  # No search term => no filter
 
-        # 2) Walk the directory and expand matches
-        for root, _, files in os.walk(self.root_path):
-            for f in files:
-                if keyword in f.lower():
-                    index = self.model.index(os.path.join(root, f))
-                    if index.isValid():
-                        self.file_tree.expand(index.parent())
-                        self.file_tree.setCurrentIndex(index)
+        within = None
+        if (self.last_matches is not None and self.last_query in keyword
+                and self.last_version == self.file_index.version):
+            within = self.last_matches
+        matches = self.file_index.search(keyword, within)
+        self.last_query, self.last_matches, self.last_version = keyword, matches, self.file_index.version
+
+        self.show_matches(sorted(self.file_index.path(i) for i in matches))
+
+    def show_matches(self, paths):
+        """Show only `paths` in the tree and expand the folders of the first MAX_REVEALED of them."""
+        self.proxy.set_matches(paths)
+        root_index = self.view_index(self.root_path)
+        first = None
+        for path in paths[:self.MAX_REVEALED]:
+            index = self.view_index(path)
+            if not index.isValid():
+                continue
+            parent = index.parent()
+            while parent.isValid() and parent != root_index:
+                self.file_tree.expand(parent)
+                parent = parent.parent()
+            first = first or index
+        if first is not None:
+            self.file_tree.setCurrentIndex(first)
+            self.file_tree.scrollTo(first)
+
+    def show_all_files(self):
+        """Drop the search or similarity filter."""
+        self.search_bar.clear()
+        self.last_query, self.last_matches = "", None
+        self.proxy.set_matches(None)
+
+    def find_similar(self, file_path):
+        """Show the SIMILAR_COUNT sounds most like `file_path` in the tree, once found in the background."""
+        version = self.feature_store.version()
+        index = self.similarity_index if version == self.similarity_version else None
+        job = SimilarJob(file_path, self.feature_store, self.parent.metaDataDB, index, self.SIMILAR_COUNT)
+        job.signals.finished.connect(
+            lambda path, results, index: self.on_similar_found(job, version, path, results, index))
+        job.signals.error.connect(lambda message: self.on_lookup_error(job, message))
+        self.start_lookup(job, f"Finding sounds like {os.path.basename(file_path)}...")
+
+    def on_similar_found(self, job, version, file_path, results, index):
+        if job is not self.lookup_job:
+            return  # Superseded by a later lookup
+        self.lookup_job = None
+        self.similarity_index = index
+        self.similarity_version = version
+        if not results:
+            self.file_title.setText("")
+            QMessageBox.information(self, "Find Similar Sounds",
+                                    "No sounds to compare with yet. Right-click a folder and choose 'Extract Features'.")
+            return
+        for path, similarity in results:
+            logging.info(f"{similarity:6.3f}  {path}")
+        self.show_results([path for path, _ in results], f"{len(results)} sounds like {os.path.basename(file_path)}")
+
+    def find_duplicates(self, file_path):
+        """
+        Show the fingerprinted files that hold the same sound as `file_path`,
+        at any rate, level or trim, once found in the background.
+        """
+        job = DuplicatesJob(file_path, self.parent.metaDataDB)
+        job.signals.finished.connect(lambda path, results: self.on_duplicates_found(job, path, results))
+        job.signals.error.connect(lambda message: self.on_lookup_error(job, message))
+        self.start_lookup(job, f"Finding duplicates of {os.path.basename(file_path)}...")
+
+    def on_duplicates_found(self, job, file_path, results):
+        if job is not self.lookup_job:
+            return
+        self.lookup_job = None
+        if not results:
+            self.file_title.setText("")
+            QMessageBox.information(self, "Find Duplicates",
+                                    "No duplicates among the fingerprinted files. Right-click a folder and "
+                                    "choose 'Fingerprint Folder' to fingerprint more.")
+            return
+        for path, offset, score in results:
+            logging.info(f"{score:6.1%}  {offset:+8.2f} s  {path}")
+        self.show_results([file_path] + [path for path, _, _ in results],
+                          f"{len(results)} duplicates of {os.path.basename(file_path)}")
+
+    def start_lookup(self, job, title):
+        """Run a similar-sounds or duplicates lookup on the thread pool; only the latest one's results are shown."""
+        self.lookup_job = job
+        self.file_title.setText(title)
+        QThreadPool.globalInstance().start(job)
+
+    def on_lookup_error(self, job, message):
+        if job is not self.lookup_job:
+            return
+        self.lookup_job = None
+        self.file_title.setText("")
+        show_error_message(self, message)
+
+    def show_results(self, paths, title):
+        """Show only `paths` in the tree, with `title` above the file info."""
+        # Keep the search bar from replacing the results once its text is cleared
+        self.search_bar.blockSignals(True)
+        self.search_bar.clear()
+        self.search_bar.blockSignals(False)
+        self.show_matches(paths)
+        self.file_title.setText(title)
+
+    def extract_features(self, paths):
+        """Extract the acoustic feature vectors of `paths` in the background, for 'Find Similar Sounds'."""
+        self.start_batch_job(BatchJob(FeatureExtractor(self.parent.metaDataDB, self.feature_store), paths))
+
+    def fingerprint(self, paths):
+        """Fingerprint `paths` in the background, for 'Find Duplicates'."""
+        self.start_batch_job(BatchJob(Fingerprinter(self.parent.metaDataDB), paths))
+
+    def view_index(self, path):
+        """Index of `path` in the tree (invalid if it is filtered out)."""
+        return self.proxy.mapFromSource(self.model.index(path))
+
+    def file_path(self, index):
+        """Path of the item at a tree index."""
+        return self.model.filePath(self.proxy.mapToSource(index))
 
     def upload_file(self):
         """Allow user to select files from disk and copy them to the main directory."""
@@ -258,6 +563,7 @@ class FileNavigator(QFrame):
                 )
             except Exception as e:
                 logging.error(f"Failed to upload {src_path}: {e}")
+            self.refresh_index(dest_path)
 
         # Refresh file tree to show new additions
         self.refresh_view()
@@ -265,7 +571,7 @@ class FileNavigator(QFrame):
     def refresh_view(self):
         """Re-set the root path to refresh the file tree view."""
         self.model.setRootPath(self.root_path)
-        self.file_tree.setRootIndex(self.model.index(self.root_path))
+        self.file_tree.setRootIndex(self.view_index(self.root_path))
 
     def edit_buttons(self) -> QHBoxLayout:
         """
@@ -278,18 +584,17 @@ class FileNavigator(QFrame):
 
         edit_btn = Button("Edit File", self.go_to_sound_editor)
         delete_btn = Button("Delete File", lambda: self.delete_file(
-            self.model.filePath(self.file_tree.currentIndex())
+            self.file_path(self.file_tree.currentIndex())
         ))
 
         layout.addWidget(edit_btn)
         layout.addWidget(delete_btn)
         return layout
 
-    @lru_cache(maxsize=50)
     def load_audio(self, file_path: str):
         """
-        Synchronous loading of audio data via AudioProcessor. 
-        Caches results so repeated requests are fast.
+        Synchronous loading of audio data via AudioProcessor.
+        Results are kept in audio_cache so repeated requests are fast.
         """
         processor = AudioProcessor(file_path)
         processor.data_loaded.connect(
@@ -310,7 +615,7 @@ class FileNavigator(QFrame):
 
         fs = int(fs)
         self.parent.audio_player.set_audio(audio_segment, data, fs, file_path)
-        self.plot_widget.update_plot(data, fs, audio_segment)
+        self.plot_widget.load_data(data, fs, audio_segment)
         self.metadata_widget.update_metadata(file_path)
 
         # Show the plot & metadata (in case they were hidden)
@@ -321,7 +626,7 @@ class FileNavigator(QFrame):
         """
         Helper to update the plot and metadata widgets with fresh data.
         """
-        self.plot_widget.update_plot(data, fs, audio_segment)
+        self.plot_widget.load_data(data, fs, audio_segment)
         self.metadata_widget.update_metadata(file_path)
         self.plot_widget.show()
         self.metadata_widget.show()
@@ -332,7 +637,7 @@ class FileNavigator(QFrame):
           - If it's a folder, toggle expand/collapse
           - If it's a file, stop current playback, load & show the file data
         """
-        file_path = self.model.filePath(index)
+        file_path = self.file_path(index)
         path_obj = Path(file_path)
 
         # Expand/collapse if directory
@@ -381,6 +686,11 @@ class FileNavigator(QFrame):
           - Rename
           - Delete
           - Create Folder
+          - Play as Layer / Find Similar Sounds / Find Duplicates (audio files) / Stop Layers
+          - Play Folder / Selection / Tag as Queue, and queue options
+          - Batch Process Folder / Analyze Loudness / Extract Features / Fingerprint Folder (folders)
+          - Cancel Batch
+          - Show All Files (while filtered)
           - Undo Delete (if not valid index)
         """
         index = self.file_tree.indexAt(position)
@@ -388,14 +698,159 @@ class FileNavigator(QFrame):
 
         if index.isValid():
             context_menu.addAction(self.create_action('Rename', lambda: self.rename_file(index)))
-            context_menu.addAction(self.create_action('Delete', lambda: self.delete_file(self.model.filePath(index))))
+            context_menu.addAction(self.create_action('Delete', lambda: self.delete_file(self.file_path(index))))
             context_menu.addAction(self.create_action('Create Folder', lambda: self.create_folder(index)))
+            file_path = self.file_path(index)
+            if is_audio_file(file_path):
+                context_menu.addAction(self.create_action('Play as Layer', lambda: self.play_as_layer(file_path)))
+                context_menu.addAction(self.create_action('Find Similar Sounds', lambda: self.find_similar(file_path)))
+                context_menu.addAction(self.create_action('Find Duplicates', lambda: self.find_duplicates(file_path)))
+            elif os.path.isdir(file_path):
+                context_menu.addAction(self.create_action(
+                    'Play Folder as Queue', lambda: self.play_queue(PlaybackQueue.from_folder(file_path, **self.queue_options))))
+                if self.batch_job is None:
+                    context_menu.addAction(self.create_action('Batch Process Folder...', lambda: self.batch_process(file_path)))
+                    context_menu.addAction(self.create_action(
+                        'Analyze Loudness', lambda: self.analyze_loudness(collect_folder(file_path))))
+                    context_menu.addAction(self.create_action(
+                        'Extract Features', lambda: self.extract_features(collect_folder(file_path))))
+                    context_menu.addAction(self.create_action(
+                        'Fingerprint Folder', lambda: self.fingerprint(collect_folder(file_path))))
+            selected = self.selected_audio_files()
+            if len(selected) > 1:
+                context_menu.addAction(self.create_action(
+                    'Play Selection as Queue', lambda: self.play_queue(PlaybackQueue(selected, **self.queue_options))))
         else:
             context_menu.addAction(self.create_action('Undo Delete', self.undo_delete))
             context_menu.addAction(self.create_action('Create Folder', self.create_folder))
+        if self.proxy.matches is not None:
+            context_menu.addAction(self.create_action('Show All Files', self.show_all_files))
+        self.add_queue_menu(context_menu)
+        if self.parent.audio_player.mixer is not None:
+            context_menu.addAction(self.create_action('Stop Layers', self.parent.audio_player.stop_layers))
+        if self.batch_job is not None:
+            context_menu.addAction(self.create_action('Cancel Batch', self.batch_job.cancel))
 
         context_menu.exec_(self.file_tree.viewport().mapToGlobal(position))
 
+    def play_as_layer(self, file_path):
+        """Play a file on top of the current playback and any other layers."""
+        try:
+            if file_path in self.audio_cache:
+                data, fs, _ = self.audio_cache[file_path]
+            else:
+                data, fs = sf.read(file_path, always_2d=True)
+            self.parent.audio_player.layer(data, int(fs))
+        except Exception as e:
+            show_error_message(self, f"Error playing layer: {e}")
+            logging.error(f"Error playing '{file_path}' as a layer: {e}")
+
+    def selected_audio_files(self):
+        """Paths of the audio files selected in the tree, in name order."""
+        paths = (self.file_path(index) for index in self.file_tree.selectionModel().selectedRows(0))
+        return sorted(path for path in paths if is_audio_file(path))
+
+    def add_queue_menu(self, context_menu):
+        """Add 'Play Tag as Queue' and the queue options (shuffle, repeat, crossfade)."""
+        tags = self.parent.metaDataDB.get_tags()
+        if tags:
+            tag_menu = context_menu.addMenu('Play Tag as Queue')
+            for tag in sorted(tags):
+                tag_menu.addAction(self.create_action(
+                    tag, lambda checked=False, tag=tag: self.play_queue(
+                        PlaybackQueue.from_tag(self.parent.metaDataDB, tag, **self.queue_options))))
+
+        options = context_menu.addMenu('Queue Options')
+        shuffle = self.create_action('Shuffle', self.set_queue_shuffle)
+        shuffle.setCheckable(True)
+        shuffle.setChecked(self.queue_options['shuffle'])
+        options.addAction(shuffle)
+        for title, key, choices in (('Repeat', 'repeat', (('Off', 'off'), ('All', 'all'), ('One', 'one'))),
+                                    ('Crossfade', 'crossfade', (('Off', 0.0), ('1 s', 1.0), ('3 s', 3.0)))):
+            submenu = options.addMenu(title)
+            group = QActionGroup(submenu)
+            for label, value in choices:
+                action = self.create_action(label, lambda checked=False, key=key, value=value: self.set_queue_option(key, value))
+                action.setCheckable(True)
+                action.setChecked(self.queue_options[key] == value)
+                group.addAction(action)
+                submenu.addAction(action)
+        if self.parent.audio_player.queue is not None:
+            context_menu.addAction(self.create_action('Stop Queue', self.parent.audio_player.stop_playback))
+
+    def set_queue_shuffle(self, shuffle):
+        self.queue_options['shuffle'] = shuffle
+        if self.queue is not None:
+            self.queue.set_shuffle(shuffle)
+
+    def set_queue_option(self, key, value):
+        """Change a queue option for new queues and the one playing."""
+        self.queue_options[key] = value
+        if self.queue is not None:
+            if key == 'repeat':
+                self.queue.set_repeat(value)
+            elif key == 'crossfade':
+                self.queue.set_crossfade(value)
+
+    def play_queue(self, queue):
+        """Audition `queue` back to back, showing each item's name as it starts."""
+        if not len(queue):
+            show_error_message(self, "No audio files to queue.")
+            return
+        if self.queue is not None:
+            self.queue.close()
+        self.queue = queue
+        queue.item_changed.connect(lambda path: self.file_title.setText(os.path.basename(path)))
+        self.parent.audio_player.play_queue(queue)
+
+    def batch_process(self, folder):
+        """Apply an effect chain (a JSON file, see BatchProcessor.py) to every sound in `folder`."""
+        chain_path, _ = QFileDialog.getOpenFileName(self, "Choose Effect Chain", "", "Effect chains (*.json)")
+        if not chain_path:
+            return
+        output_dir = QFileDialog.getExistingDirectory(self, "Choose Output Folder")
+        if not output_dir:
+            return
+        try:
+            processor = BatchProcessor(load_chain(chain_path), output_dir, metadata_db=self.parent.metaDataDB)
+        except (OSError, ValueError) as e:
+            show_error_message(self, f"Invalid effect chain: {e}")
+            return
+        self.start_batch_job(BatchJob(processor, collect_folder(folder), folder))
+
+    def analyze_loudness(self, paths):
+        """Measure loudness, peak, RMS, DC offset and clipping of `paths` in the background and store them."""
+        self.start_batch_job(BatchJob(LoudnessAnalyzer(self.parent.metaDataDB), paths))
+
+    def start_batch_job(self, job):
+        """Run a batch job on the thread pool, showing its progress in the title."""
+        self.batch_job = job
+        job.signals.progress.connect(
+            lambda done, total, path: self.file_title.setText(f"Batch {done}/{total}: {os.path.basename(path)}"))
+        job.signals.finished.connect(self.on_batch_finished)
+        job.signals.error.connect(self.on_batch_error)
+        QThreadPool.globalInstance().start(job)
+
+    def on_batch_finished(self, summary):
+        job, self.batch_job = self.batch_job, None
+        if job is not None:
+            for path in job.paths:
+                self.thumbnail_delegate.forget(path)
+            # Outputs may have overwritten files already shown in the tree
+            output_dir = getattr(job.processor, 'output_dir', None)
+            if output_dir:
+                for path in self.thumbnail_delegate.forget(output_dir):
+                    self.parent.peak_cache.invalidate(path)
+                self.forget_audio(output_dir)
+                self.refresh_index(output_dir)
+        QMessageBox.information(
+            self, "Batch Processing",
+            f"{summary['done']} files processed, {summary['failed']} failed, {summary['skipped']} already done.")
+
+    def on_batch_error(self, message):
+        self.batch_job = None
+        show_error_message(self, f"Batch processing failed: {message}")
+
     def create_action(self, name, func):
         """
         Helper to create a QAction with a given label and callback.
@@ -429,6 +884,7 @@ class FileNavigator(QFrame):
                 shutil.move(file_path, temp_file_path)
                 self.audio_cache.pop(file_path, None)
                 self.audio_workers.pop(file_path, None)
+                self.parent.peak_cache.invalidate(file_path)
                 self.parent.metaDataDB.delete_file(file_path)
             elif path_obj.is_dir():
                 # For directories, remove all files from cache/DB
@@ -437,11 +893,14 @@ class FileNavigator(QFrame):
                         abs_file_path = str(Path(root) / f)
                         self.audio_cache.pop(abs_file_path, None)
                         self.audio_workers.pop(abs_file_path, None)
+                        self.parent.peak_cache.invalidate(abs_file_path)
                         self.parent.metaDataDB.delete_file(abs_file_path)
                 shutil.move(file_path, temp_file_path)
 
             # Keep track for undo
             self.deleted_files[temp_file_path] = file_path
+            self.thumbnail_delegate.forget(file_path)
+            self.refresh_index(file_path)
             self.refresh_view()
 
         except Exception as e:
@@ -461,6 +920,8 @@ class FileNavigator(QFrame):
                 show_error_message(self, f"Error undoing delete: {e}")
                 logging.error(f"Error undoing delete: {e}")
 
+            self.thumbnail_delegate.forget(original_path)
+            self.refresh_index(original_path)
             self.refresh_view()
 
     def rename_file(self, index):
@@ -470,6 +931,27 @@ class FileNavigator(QFrame):
         if index.isValid():
             self.file_tree.edit(index, QTreeView.EditKeyPressed, None)
 
+    def on_file_renamed(self, directory, old_name, new_name):
+        """Follow a rename made in the tree in the database and the search index."""
+        old_path = os.path.join(directory, old_name)
+        new_path = os.path.join(directory, new_name)
+        if os.path.isfile(new_path):
+            self.parent.metaDataDB.rename_file(old_path, new_path)
+        self.thumbnail_delegate.forget(old_path)
+        self.refresh_index(old_path, new_path)
+
+    def on_file_saved(self, path):
+        """The sound editor rewrote (or wrote) `path`: reload its audio when next selected, redraw its thumbnail and index it."""
+        self.forget_audio(path)
+        self.thumbnail_delegate.forget(path)
+        self.refresh_index(path)
+
+    def forget_audio(self, path):
+        """Drop the loaded audio of `path` (or of every file under it), so it is read again from disk."""
+        prefix = path.rstrip(os.sep) + os.sep
+        for cached in [p for p in self.audio_cache if p == path or p.startswith(prefix)]:
+            del self.audio_cache[cached]
+
     def create_folder(self, index=None):
         """
         Create a new folder named 'New Folder' under the selected directory
@@ -480,10 +962,14 @@ class FileNavigator(QFrame):
 
         try:
             folder_path.mkdir()
+            # The new folder matches no search, so show everything again
+            if self.search_bar.text():
+                self.search_bar.clear()
+                self.filter_files()
             self.refresh_view()
 
             # Automatically start rename on the new folder
-            new_index = self.model.index(str(folder_path))
+            new_index = self.view_index(str(folder_path))
             self.file_tree.setCurrentIndex(new_index)
             self.file_tree.edit(new_index, QTreeView.EditKeyPressed, None)
         except FileExistsError:
@@ -509,7 +995,7 @@ class FileNavigator(QFrame):
         or the root path if invalid.
         """
         if index and index.isValid():
-            file_path = Path(self.model.filePath(index))
+            file_path = Path(self.file_path(index))
             return str(file_path.parent) if file_path.is_file() else str(file_path)
         return self.root_path
 
@@ -536,11 +1022,10 @@ class FileNavigator(QFrame):
             self.parent.audio_player.stop_playback()
 
             fs = int(fs)
-            # Update the SoundEditor plot
-            self.parent.sound_editor.plot_widget.data = data
-            self.parent.sound_editor.plot_widget.clear_selection()
-            self.parent.sound_editor.plot_widget.update_plot(data, fs, audio_segment)
+            # Update the SoundEditor plot; loading it hands the editor its edit list
             self.parent.sound_editor.set_audio_data(data, current_path, fs, audio_segment)
+            self.parent.sound_editor.plot_widget.load_data(data, fs, audio_segment)
+            self.parent.sound_editor.plot_widget.clear_selection()
 
         except RuntimeError as e:
             QMessageBox.critical(self, "Error", f"Error loading file for editing: {e}")
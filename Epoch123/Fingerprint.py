@@ -0,0 +1,394 @@
+"""
+Acoustic fingerprints for finding the same sound saved at another rate,
+bitrate, level or trim. Each file is reduced to landmarks: pairs of
+spectral peaks hashed as (frequency, frequency, time difference) with the
+time of the first peak. The hashes are stored in an inverted index in the
+metadata database; two files are near duplicates when many of their
+hashes agree at one constant time offset.
+
+    python3 Epoch123/Fingerprint.py --folder Epoch123/ESMD --workers 8
+    python3 Epoch123/Fingerprint.py --duplicates
+    python3 Epoch123/Fingerprint.py --duplicates-of Epoch123/ESMD/bird.wav
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import multiprocessing
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import soundfile as sf
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.ndimage import maximum_filter
+from PySide6.QtCore import QObject, QRunnable, Signal
+
+from Resampling import rate_ratio, resample, resample_range
+from BatchProcessor import file_row, collect_folder
+
+logger = logging.getLogger(__name__)
+
+# Analysis rate and STFT: 93 ms frames every 23 ms, 512 bins up to 5.5 kHz
+SAMPLE_RATE = 11025
+N_FFT = 1024
+HOP_LENGTH = 256
+
+# Peaks: local maxima over this many frames x bins, within DYNAMIC_RANGE dB
+# of the loudest and above MIN_LEVEL (dB of the unscaled spectrum, where a
+# full-scale sine reaches 48), at most PEAKS_PER_SECOND of the strongest per second
+PEAK_NEIGHBOURHOOD = (15, 31)
+DYNAMIC_RANGE = 60.0
+MIN_LEVEL = -20.0
+PEAKS_PER_SECOND = 20
+
+# STFT frames analysed at a time (about 24 s)
+STFT_CHUNK = 1024
+
+# Landmarks: each peak is paired with the first FAN_OUT peaks at most
+# MAX_DT frames later and MAX_DF bins away, found among the next PAIR_SEARCH peaks
+FAN_OUT = 5
+MAX_DT = 63
+MAX_DF = 127
+PAIR_SEARCH = 30
+
+# Near duplicates share at least MIN_MATCHES hashes at one offset, and at
+# least MIN_SCORE of the hashes of the shorter file
+MIN_MATCHES = 12
+MIN_SCORE = 0.05
+
+# Results written to the database together
+DB_BATCH = 32
+
+
+def spectral_peaks(data):
+    """(frames, bins) of the spectral peaks of a mono signal at SAMPLE_RATE, in time order."""
+    return stream_peaks(lambda a, b: data[a:b], len(data))
+
+
+def _levels(samples):
+    """Level in dB of every STFT frame of `samples` (frames, N_FFT // 2)."""
+    frames = sliding_window_view(samples, N_FFT)[::HOP_LENGTH]
+    window = np.hanning(N_FFT).astype(np.float32)
+    magnitude = np.abs(np.fft.rfft(frames * window, axis=1))[:, :N_FFT // 2]
+    return (20 * np.log10(magnitude + 1e-10)).astype(np.float32)
+
+
+def stream_peaks(read, length):
+    """
+    spectral_peaks() of the mono signal `read(a, b)` (`length` samples at
+    SAMPLE_RATE), STFT_CHUNK frames at a time: each chunk is analysed with
+    half a PEAK_NEIGHBOURHOOD of frames on either side, so its local maxima
+    are those of the whole spectrogram. Only the candidate peaks (a few
+    dozen per second) are kept until the loudest level, and with it the
+    floor, is known.
+    """
+    if length < N_FFT:
+        samples = np.zeros(N_FFT, dtype=np.float32)
+        samples[:length] = read(0, length)
+        read, length = (lambda a, b: samples[a:b]), N_FFT
+    count = (length - N_FFT) // HOP_LENGTH + 1
+    context = PEAK_NEIGHBOURHOOD[0] // 2
+    loudest = -np.inf
+    times, bins, strength = [], [], []
+    for first in range(0, count, STFT_CHUNK):
+        last = min(first + STFT_CHUNK, count)
+        low, high = max(first - context, 0), min(last + context, count)
+        level = _levels(np.asarray(read(low * HOP_LENGTH, (high - 1) * HOP_LENGTH + N_FFT), dtype=np.float32))
+        inner = level[first - low:last - low]
+        loudest = max(loudest, float(inner.max()))
+        peaks = (inner == maximum_filter(level, size=PEAK_NEIGHBOURHOOD)[first - low:last - low]) & (inner > MIN_LEVEL)
+        chunk_times, chunk_bins = np.nonzero(peaks)
+        times.append(chunk_times + first)
+        bins.append(chunk_bins)
+        strength.append(inner[chunk_times, chunk_bins])
+    times, bins, strength = np.concatenate(times), np.concatenate(bins), np.concatenate(strength)
+
+    loud = strength > max(loudest - DYNAMIC_RANGE, MIN_LEVEL)
+    times, bins, strength = times[loud], bins[loud], strength[loud]
+
+    # Keep the strongest peaks of every second
+    per_second = SAMPLE_RATE / HOP_LENGTH
+    second = (times / per_second).astype(np.int64)
+    order = np.lexsort((-strength, second))
+    first = np.searchsorted(second[order], second[order])
+    keep = order[np.arange(len(order)) - first < PEAKS_PER_SECOND]
+    keep = keep[np.lexsort((bins[keep], times[keep]))]
+    return times[keep], bins[keep]
+
+
+def landmarks(times, bins):
+    """(hashes, offsets): a 24-bit hash of every peak pair and the frame of its first peak."""
+    anchors, targets, ranks = [], [], []
+    for step in range(1, min(PAIR_SEARCH, len(times) - 1) + 1):
+        first = np.arange(len(times) - step)
+        second = first + step
+        dt = times[second] - times[first]
+        df = bins[second] - bins[first]
+        ok = (dt >= 1) & (dt <= MAX_DT) & (np.abs(df) <= MAX_DF)
+        anchors.append(first[ok])
+        targets.append(second[ok])
+        ranks.append(np.full(np.count_nonzero(ok), step))
+    if not anchors:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    anchors, targets, ranks = np.concatenate(anchors), np.concatenate(targets), np.concatenate(ranks)
+
+    # The first FAN_OUT targets of every anchor
+    order = np.lexsort((ranks, anchors))
+    anchors, targets = anchors[order], targets[order]
+    position = np.arange(len(anchors)) - np.searchsorted(anchors, anchors)
+    anchors, targets = anchors[position < FAN_OUT], targets[position < FAN_OUT]
+
+    hashes = (bins[anchors].astype(np.int64) << 15) | (bins[targets].astype(np.int64) << 6) \
+        | (times[targets] - times[anchors]).astype(np.int64)
+    return hashes, times[anchors].astype(np.int64)
+
+
+def fingerprint(data, fs):
+    """(hashes, offsets) of a signal (frames or frames x channels) at rate `fs`."""
+    data = np.asarray(data, dtype=np.float32)
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+    if fs != SAMPLE_RATE:
+        data = resample(data, *rate_ratio(fs, SAMPLE_RATE))
+    return landmarks(*spectral_peaks(data))
+
+
+def fingerprint_file(path):
+    """
+    (hashes, offsets) of the sound file at `path`, the same as fingerprint()
+    of its contents. The file is read, mixed down and resampled a range at a
+    time as the analysis needs it, so memory does not depend on its length.
+    """
+    with sf.SoundFile(path) as f:
+        def read(a, b):
+            f.seek(a)
+            return f.read(b - a, dtype='float32', always_2d=True).mean(axis=1)
+
+        length = f.frames
+        if f.samplerate != SAMPLE_RATE:
+            up, down = rate_ratio(f.samplerate, SAMPLE_RATE)
+            source, source_length = read, length
+            length = -(-source_length * up // down)
+            read = lambda a, b: resample_range(source, source_length, up, down, a, b)
+        return landmarks(*stream_peaks(read, length))
+
+
+def frames_to_seconds(frames):
+    return frames * HOP_LENGTH / SAMPLE_RATE
+
+
+def duplicates_of(path, metadata_db, fingerprints=None):
+    """
+    [(file_path, offset, score)] of the near duplicates of the file at
+    `path`, best first: where it starts in each of them, in seconds, and the
+    share of the shorter file's hashes that agree. Its stored fingerprints
+    are used if there are any, otherwise `fingerprints` or fresh ones.
+    """
+    path = os.path.abspath(path)
+    if fingerprints is None:
+        stored = metadata_db.get_fingerprints(path)
+        if stored:
+            fingerprints = np.array(stored, dtype=np.int64).T
+        else:
+            fingerprints = fingerprint_file(path)
+    hashes, offsets = fingerprints
+    if not len(hashes):
+        return []
+
+    counts = defaultdict(dict)
+    sizes = {}
+    for other, delta, matches, size in metadata_db.match_fingerprints(hashes, offsets, min_matches=2):
+        if other != path:
+            counts[other][delta] = matches
+            sizes[other] = size
+
+    duplicates = []
+    for other, by_delta in counts.items():
+        # Trims that are not a whole hop apart split matches over neighbouring offsets
+        delta, matches = max(((d, sum(by_delta.get(d + e, 0) for e in (-1, 0, 1))) for d in by_delta),
+                             key=lambda item: item[1])
+        score = matches / max(min(len(hashes), sizes[other]), 1)
+        if matches >= MIN_MATCHES and score >= MIN_SCORE:
+            duplicates.append((other, frames_to_seconds(delta), min(score, 1.0)))
+    return sorted(duplicates, key=lambda item: -item[2])
+
+
+def duplicate_clusters(metadata_db, progress=None):
+    """
+    Groups of near-duplicate files among everything fingerprinted, largest
+    group first. Each group is a list of (file_path, offset) starting with
+    the longest file; offset is where each file starts relative to it, in
+    seconds. `progress(done, total, path)` is called after every file.
+    """
+    paths = metadata_db.get_fingerprinted_files()
+    neighbours = defaultdict(dict)
+    for number, path in enumerate(paths, 1):
+        for other, offset, _ in duplicates_of(path, metadata_db):
+            # `path` starts `offset` seconds into `other`
+            neighbours[path][other] = -offset
+            neighbours[other].setdefault(path, offset)
+        if progress:
+            progress(number, len(paths), path)
+
+    clusters = []
+    seen = set()
+    for start in neighbours:
+        if start in seen:
+            continue
+        positions = {start: 0.0}
+        queue = deque([start])
+        while queue:
+            path = queue.popleft()
+            for other, offset in neighbours[path].items():
+                if other not in positions:
+                    positions[other] = positions[path] + offset
+                    queue.append(other)
+        seen.update(positions)
+        lengths = {path: _frames(path) for path in positions}
+        root = max(positions, key=lambda path: lengths[path])
+        members = sorted(positions, key=lambda path: (path != root, path))
+        clusters.append([(path, round(positions[path] - positions[root], 3)) for path in members])
+    return sorted(clusters, key=len, reverse=True)
+
+
+class DuplicatesJobSignals(QObject):
+    """
+    Signals for DuplicatesJob (QRunnable cannot emit signals itself).
+      - finished(path: str, results: list) -> results as from duplicates_of()
+      - error(message: str)
+    """
+    finished = Signal(str, list)
+    error = Signal(str)
+
+
+class DuplicatesJob(QRunnable):
+    """Runs duplicates_of() on the thread pool, for the GUI."""
+    def __init__(self, path, metadata_db):
+        super().__init__()
+        self.path = path
+        self.metadata_db = metadata_db
+        self.signals = DuplicatesJobSignals()
+
+    def run(self):
+        try:
+            results = duplicates_of(self.path, self.metadata_db)
+        except Exception as e:
+            logger.error(f"Error finding duplicates of '{self.path}': {e}")
+            self.signals.error.emit(f"Error finding duplicates: {e}")
+            return
+        self.signals.finished.emit(self.path, results)
+
+
+def _frames(path):
+    try:
+        return sf.info(path).frames
+    except RuntimeError:
+        return 0
+
+
+def _fingerprint(path):
+    """Worker task: the file's metadata row (to register it if needed) and its fingerprints."""
+    return file_row(path), fingerprint_file(path)
+
+
+class Fingerprinter:
+    """
+    Fingerprints many files on a process pool (one file per task, every
+    core busy by default) and stores the hashes in `metadata_db`, DB_BATCH
+    files per transaction. run() has the signature BatchJob expects, so the
+    GUI runs it in the background the same way as a batch of effects.
+    """
+    def __init__(self, metadata_db, workers=None, skip_done=True):
+        self.metadata_db = metadata_db
+        self.workers = workers or os.cpu_count() or 1
+        self.skip_done = skip_done
+
+    def run(self, paths, root=None, progress=None, should_stop=None):
+        """Fingerprint `paths` (`root` is unused); `progress` and `should_stop` as in BatchProcessor.run."""
+        paths = [os.path.abspath(path) for path in paths]
+        done = set(self.metadata_db.get_fingerprinted_files()) if self.skip_done else set()
+        todo = [path for path in paths if path not in done]
+        summary = {'total': len(paths), 'skipped': len(paths) - len(todo), 'done': 0, 'failed': 0}
+        if not todo:
+            return summary
+
+        rows, results = [], []
+        context = multiprocessing.get_context('spawn')
+        pool = ProcessPoolExecutor(min(self.workers, len(todo)), mp_context=context)
+        try:
+            futures = {pool.submit(_fingerprint, path): path for path in todo}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    row, (hashes, offsets) = future.result()
+                    rows.append(row)
+                    results.append((path, hashes, offsets))
+                    summary['done'] += 1
+                except Exception as e:
+                    logger.error(f"Fingerprinting failed for {path}: {e}")
+                    summary['failed'] += 1
+                if len(results) >= DB_BATCH:
+                    self.store(rows, results)
+                    rows, results = [], []
+                if progress:
+                    progress(summary['skipped'] + summary['done'] + summary['failed'], len(paths), path)
+                if should_stop and should_stop():
+                    break
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            self.store(rows, results)
+        return summary
+
+    def store(self, rows, results):
+        """Register files that are not in the database yet, then store their fingerprints."""
+        self.metadata_db.insert_many(rows)
+        self.metadata_db.set_fingerprints_many(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fingerprint sounds and find near duplicates.")
+    parser.add_argument('--folder', help="Fingerprint the audio files in this folder (default: every file in the database)")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: one per core)")
+    parser.add_argument('--db', help="Metadata database (default: the archive's)")
+    parser.add_argument('--again', action='store_true', help="Fingerprint files that were fingerprinted before too")
+    parser.add_argument('--duplicates', action='store_true', help="Only list the groups of near duplicates")
+    parser.add_argument('--duplicates-of', metavar='FILE', help="Only list the near duplicates of this file")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from MetaData import MetaDataDB
+    metadata_db = MetaDataDB(args.db)
+    if args.duplicates_of:
+        for path, offset, score in duplicates_of(args.duplicates_of, metadata_db):
+            print(f"{score:6.1%}  {offset:+8.2f} s  {path}")
+        return 0
+    if args.duplicates:
+        reclaimable = 0
+        for cluster in duplicate_clusters(metadata_db):
+            for number, (path, offset) in enumerate(cluster):
+                print(f"{'  ' if number else ''}{offset:+8.2f} s  {path}")
+                if number and os.path.exists(path):
+                    reclaimable += os.path.getsize(path)
+            print()
+        print(f"{reclaimable / 2 ** 20:.1f} MB in files that duplicate a longer one")
+        return 0
+
+    if args.folder:
+        paths = collect_folder(args.folder)
+    else:
+        paths = metadata_db.get_all_files()
+
+    def progress(done, total, path):
+        print(f"[{done}/{total}] {os.path.basename(path)}", flush=True)
+
+    start = time.monotonic()
+    summary = Fingerprinter(metadata_db, args.workers, not args.again).run(paths, progress=progress)
+    print(f"{summary['done']} fingerprinted, {summary['failed']} failed, {summary['skipped']} already fingerprinted "
+          f"in {time.monotonic() - start:.1f} s")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
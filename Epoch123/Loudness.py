@@ -0,0 +1,294 @@
+"""
+Loudness and signal statistics of sound files: sample peak, RMS,
+integrated loudness (ITU-R BS.1770 / EBU R128, in LUFS), DC offset and
+clipped samples, measured in one pass over each file and stored as
+indexed columns of MetaDataDB's audio_files table.
+
+    python3 Epoch123/Loudness.py --folder Epoch123/ESMD --workers 8
+    python3 Epoch123/Loudness.py --quieter-than -30
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import scipy.signal as sig
+import soundfile as sf
+
+from BatchProcessor import file_row, collect_folder
+
+logger = logging.getLogger(__name__)
+
+# Gating of BS.1770: 400 ms blocks every 100 ms, absolute and relative gates in LUFS / LU
+GATE_STEP = 0.1
+GATE_BLOCK_STEPS = 4
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+# Samples count as clipped when at least CLIP_RUN in a row sit at the format's
+# full scale; a clean full-scale tone only touches it once per peak
+CLIP_RUN = 3
+
+# Bits of the integer subtypes; every other subtype (float, lossy) has a full scale of 1.0
+PCM_BITS = {'PCM_S8': 8, 'PCM_U8': 8, 'PCM_16': 16, 'PCM_24': 24, 'PCM_32': 32}
+
+# Frames read from disk at a time
+READ_BLOCK = 1 << 16
+
+# Results written to the database together
+DB_BATCH = 64
+
+# Statistics measured, as stored in audio_files
+COLUMNS = ('peak_db', 'rms_db', 'lufs', 'dc_offset', 'clipped')
+
+
+def k_weighting(fs):
+    """The K-weighting pre-filter of BS.1770 (high shelf, then high pass) at rate `fs`, as SOS."""
+    # High shelf modelling the head, in the parametrisation that reproduces the 48 kHz coefficients
+    K = np.tan(np.pi * 1681.974450955533 / fs)
+    Q = 0.7071752369554196
+    Vh = 10 ** (3.999843853973347 / 20)
+    Vb = Vh ** 0.4996667741545416
+    a0 = 1 + K / Q + K * K
+    shelf = [(Vh + Vb * K / Q + K * K) / a0, 2 * (K * K - Vh) / a0, (Vh - Vb * K / Q + K * K) / a0,
+             1, 2 * (K * K - 1) / a0, (1 - K / Q + K * K) / a0]
+    # RLB high pass
+    K = np.tan(np.pi * 38.13547087602444 / fs)
+    Q = 0.5003270373238773
+    a0 = 1 + K / Q + K * K
+    high_pass = [1, -2, 1, 1, 2 * (K * K - 1) / a0, (1 - K / Q + K * K) / a0]
+    return np.array([shelf, high_pass])
+
+
+def full_scale(subtype):
+    """The largest positive sample of `subtype` as read in floating point: (2**(bits-1) - 1) / 2**(bits-1) for PCM."""
+    bits = PCM_BITS.get(subtype)
+    return 1.0 - 2.0 ** (1 - bits) if bits else 1.0
+
+
+def clipped_runs(at_full_scale, carried):
+    """
+    Count the samples of one channel's block that belong to runs of at least
+    CLIP_RUN full-scale samples. `carried` is the length of the run the
+    previous block ended with; returns (count, run length at the block's end).
+    """
+    edges = np.diff(np.concatenate(([False], at_full_scale, [False])).astype(np.int8))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    if not len(starts):
+        return 0, 0
+    lengths = ends - starts
+    before = np.zeros(len(lengths), dtype=np.int64)
+    if starts[0] == 0:
+        before[0] = carried
+    total = before + lengths
+    # A run crossing blocks is counted in parts: its samples so far minus those counted before
+    count = np.where(total >= CLIP_RUN, total, 0) - np.where(before >= CLIP_RUN, before, 0)
+    carry = int(total[-1]) if ends[-1] == len(at_full_scale) else 0
+    return int(count.sum()), carry
+
+
+def channel_weights(channels):
+    """BS.1770 channel weights: surround channels of a 5.1 layout count 1.41, the LFE not at all."""
+    if channels == 6:
+        return np.array([1.0, 1.0, 1.0, 0.0, 1.41, 1.41])
+    return np.ones(channels)
+
+
+class LoudnessMeter:
+    """
+    Streaming measurement of one signal. Feed (frames, channels) blocks to
+    process() and read the statistics from result(). Only the K-weighting
+    filter state, one partial 100 ms step and the mean square of each step
+    (ten numbers per channel and second) are kept, so files of any length
+    are measured in one pass. `full_scale` is the level clipped samples sit
+    at (see full_scale()).
+    """
+    def __init__(self, fs, channels, full_scale=1.0):
+        self.fs = fs
+        self.channels = channels
+        self.full_scale = full_scale
+        self.sos = k_weighting(fs)
+        self.zi = np.zeros((len(self.sos), 2, channels))
+        self.step = max(1, int(round(GATE_STEP * fs)))
+        self.weights = channel_weights(channels)
+
+        self.frames = 0
+        self.peak = 0.0
+        self.sum_squares = 0.0
+        self.sums = np.zeros(channels)
+        self.clipped = 0
+        self._runs = [0] * channels
+        self._partial = np.zeros((0, channels))
+        self._steps = []
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64).reshape(len(block), self.channels)
+        if not len(block):
+            return
+        magnitude = np.abs(block)
+        self.frames += len(block)
+        self.peak = max(self.peak, float(magnitude.max()))
+        self.sum_squares += float(np.square(block).sum())
+        self.sums += block.sum(axis=0)
+        at_full_scale = magnitude >= self.full_scale
+        for channel in range(self.channels):
+            count, self._runs[channel] = clipped_runs(at_full_scale[:, channel], self._runs[channel])
+            self.clipped += count
+
+        weighted, self.zi = sig.sosfilt(self.sos, block, axis=0, zi=self.zi)
+        weighted = np.concatenate((self._partial, weighted))
+        count = len(weighted) // self.step
+        steps = np.square(weighted[:count * self.step]).reshape(count, self.step, self.channels).mean(axis=1)
+        self._steps.append(steps)
+        self._partial = weighted[count * self.step:]
+
+    def integrated_loudness(self):
+        """Gated loudness of everything fed so far, in LUFS (-inf if it is too short or silent)."""
+        steps = np.concatenate(self._steps) if self._steps else np.zeros((0, self.channels))
+        if len(steps) < GATE_BLOCK_STEPS:
+            return -np.inf
+        # Mean square of each 400 ms block (4 consecutive steps), per channel
+        blocks = np.lib.stride_tricks.sliding_window_view(steps, GATE_BLOCK_STEPS, axis=0).mean(axis=-1)
+        power = blocks @ self.weights
+        with np.errstate(divide='ignore'):
+            loudness = -0.691 + 10 * np.log10(power)
+        gated = loudness > ABSOLUTE_GATE
+        if not gated.any():
+            return -np.inf
+        relative = -0.691 + 10 * np.log10(power[gated].mean()) + RELATIVE_GATE
+        gated &= loudness > relative
+        return float(-0.691 + 10 * np.log10(power[gated].mean()))
+
+    def result(self):
+        """The statistics, keyed as the audio_files columns; levels are in dBFS, clipped is a sample count."""
+        with np.errstate(divide='ignore'):
+            peak_db = 20 * np.log10(self.peak)
+            rms = np.sqrt(self.sum_squares / max(self.frames * self.channels, 1))
+            rms_db = 20 * np.log10(rms)
+        means = self.sums / max(self.frames, 1)
+        return {
+            'peak_db': _finite(peak_db),
+            'rms_db': _finite(rms_db),
+            'lufs': _finite(self.integrated_loudness()),
+            'dc_offset': float(means[np.argmax(np.abs(means))]) if self.channels else 0.0,
+            'clipped': self.clipped,
+        }
+
+
+def _finite(level):
+    """A level rounded for storage; silence (-inf) is stored as NULL."""
+    return round(float(level), 2) if np.isfinite(level) else None
+
+
+def measure(blocks, fs, channels, full_scale=1.0):
+    """Statistics of an iterable of (frames, channels) blocks."""
+    meter = LoudnessMeter(fs, channels, full_scale)
+    for block in blocks:
+        meter.process(block)
+    return meter.result()
+
+
+def analyze_file(path, blocksize=READ_BLOCK):
+    """Statistics of the sound file at `path`, read once, block by block."""
+    with sf.SoundFile(path) as f:
+        return measure(f.blocks(blocksize, dtype='float32', always_2d=True), f.samplerate, f.channels,
+                       full_scale(f.subtype))
+
+
+def _analyze(path):
+    """Worker task: the file's metadata row (to register it if needed) and its statistics."""
+    return file_row(path), analyze_file(path)
+
+
+class LoudnessAnalyzer:
+    """
+    Measures many files on a process pool (one file per task, every core
+    busy by default) and stores the results in `metadata_db`, DB_BATCH
+    files per transaction. run() has the signature BatchJob expects, so the
+    GUI runs it in the background the same way as a batch of effects.
+    """
+    def __init__(self, metadata_db, workers=None, skip_analyzed=True):
+        self.metadata_db = metadata_db
+        self.workers = workers or os.cpu_count() or 1
+        self.skip_analyzed = skip_analyzed
+
+    def run(self, paths, root=None, progress=None, should_stop=None):
+        """Measure `paths` (`root` is unused); `progress` and `should_stop` as in BatchProcessor.run."""
+        paths = [os.path.abspath(path) for path in paths]
+        done = set(self.metadata_db.get_analyzed_files()) if self.skip_analyzed else set()
+        todo = [path for path in paths if path not in done]
+        summary = {'total': len(paths), 'skipped': len(paths) - len(todo), 'done': 0, 'failed': 0}
+        if not todo:
+            return summary
+
+        rows, results = [], []
+        context = multiprocessing.get_context('spawn')
+        pool = ProcessPoolExecutor(min(self.workers, len(todo)), mp_context=context)
+        try:
+            futures = {pool.submit(_analyze, path): path for path in todo}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    row, stats = future.result()
+                    rows.append(row)
+                    results.append((path, stats))
+                    summary['done'] += 1
+                except Exception as e:
+                    logger.error(f"Loudness analysis failed for {path}: {e}")
+                    summary['failed'] += 1
+                if len(results) >= DB_BATCH:
+                    self.store(rows, results)
+                    rows, results = [], []
+                if progress:
+                    progress(summary['skipped'] + summary['done'] + summary['failed'], len(paths), path)
+                if should_stop and should_stop():
+                    break
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            self.store(rows, results)
+        return summary
+
+    def store(self, rows, results):
+        """Register files that are not in the database yet, then store their statistics."""
+        self.metadata_db.insert_many(rows)
+        self.metadata_db.set_analysis_many(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the loudness of sounds and store it in the metadata database.")
+    parser.add_argument('--folder', help="Measure the audio files in this folder (default: every file in the database)")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: one per core)")
+    parser.add_argument('--db', help="Metadata database (default: the archive's)")
+    parser.add_argument('--again', action='store_true', help="Measure files that were measured before too")
+    parser.add_argument('--quieter-than', type=float, metavar='LUFS', help="Only list the files quieter than this")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from MetaData import MetaDataDB
+    metadata_db = MetaDataDB(args.db)
+    if args.quieter_than is not None:
+        for path, lufs in metadata_db.get_files_by_loudness(max_lufs=args.quieter_than):
+            print(f"{lufs:7.1f} LUFS  {path}")
+        return 0
+
+    if args.folder:
+        paths = collect_folder(args.folder)
+    else:
+        paths = metadata_db.get_all_files()
+
+    def progress(done, total, path):
+        print(f"[{done}/{total}] {os.path.basename(path)}", flush=True)
+
+    start = time.monotonic()
+    summary = LoudnessAnalyzer(metadata_db, args.workers, not args.again).run(paths, progress=progress)
+    print(f"{summary['done']} measured, {summary['failed']} failed, {summary['skipped']} already measured "
+          f"in {time.monotonic() - start:.1f} s")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,22 @@
 import sqlite3
 import os
+import time
 import logging
 from contextlib import contextmanager
 from PySide6.QtWidgets import QMessageBox, QTableWidget, QTableWidgetItem, QVBoxLayout, QHeaderView
 from PySide6.QtCore import Qt
 from eutils import get_main_sound_dir_path
 
+# Signal statistics stored in audio_files (see Loudness.py); added to older databases on start
+ANALYSIS_COLUMNS = {
+    'peak_db': 'REAL',
+    'rms_db': 'REAL',
+    'lufs': 'REAL',
+    'dc_offset': 'REAL',
+    'clipped': 'INTEGER',
+    'analyzed_at': 'REAL',
+}
+
 # Configure logging
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s %(levelname)s: %(message)s')
 
@@ -15,8 +26,8 @@ class MetaDataDB:
     Manages audio file metadata in a SQLite database. 
     Provides CRUD operations on metadata and tags.
     """
-    def __init__(self):
-        self.db_path = os.path.join(get_main_sound_dir_path('Epoch123/DB'), 'metadata.db')
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(get_main_sound_dir_path('Epoch123/DB'), 'metadata.db')
         self.initialize_db()
 
     def initialize_db(self):
@@ -56,6 +67,44 @@ class MetaDataDB:
                         FOREIGN KEY (tag_id) REFERENCES tags (tag_id)
                     )
                 ''')
+                # Create segments table (sounds found in a file, in seconds)
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS segments (
+                        segment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        file_path TEXT NOT NULL,
+                        start REAL NOT NULL,
+                        end REAL NOT NULL,
+                        clip_path TEXT
+                    )
+                ''')
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_segments_file ON segments (file_path)")
+                # Create fingerprints table (landmark hashes of each file, see Fingerprint.py),
+                # clustered by hash for lookups
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS fingerprints (
+                        hash INTEGER NOT NULL,
+                        file_id INTEGER NOT NULL,
+                        offset INTEGER NOT NULL,
+                        PRIMARY KEY (hash, file_id, offset)
+                    ) WITHOUT ROWID
+                ''')
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_fingerprints_file ON fingerprints (file_id)")
+                # Create fingerprinted_files table (number of hashes of each fingerprinted file)
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS fingerprinted_files (
+                        file_id INTEGER PRIMARY KEY,
+                        hashes INTEGER NOT NULL,
+                        fingerprinted_at REAL NOT NULL
+                    )
+                ''')
+                # Add the analysis columns to databases created before they existed
+                existing = {row[1] for row in cursor.execute("PRAGMA table_info(audio_files)")}
+                for column, column_type in ANALYSIS_COLUMNS.items():
+                    if column not in existing:
+                        cursor.execute(f"ALTER TABLE audio_files ADD COLUMN {column} {column_type}")
+                for column in ('peak_db', 'rms_db', 'lufs'):
+                    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_audio_files_{column} ON audio_files ({column})")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_audio_files_path ON audio_files (file_path)")
                 conn.commit()
         except sqlite3.Error as e:
             QMessageBox.critical(None, "Database Initialization Error", f"Database initialization error: {e}")
@@ -111,6 +160,138 @@ class MetaDataDB:
                 QMessageBox.critical(None, "Failed to Insert Metadata", f"Failed to insert metadata for {file_name}: {e}")
                 logging.error(f"Failed to insert metadata for {file_name}: {e}")
 
+    def insert_many(self, rows, tags=()):
+        """
+        Insert many (file_name, file_path, num_channels, sample_rate, file_size, duration)
+        rows in one transaction, skipping files already present, and give them all `tags`.
+        Returns the number of rows inserted.
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+        insert = '''
+            INSERT INTO audio_files
+            (file_name, file_path, num_channels, sample_rate, file_size, duration)
+            SELECT ?, ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (SELECT 1 FROM audio_files WHERE file_path = ?)
+        '''
+        tag_file = '''
+            INSERT OR IGNORE INTO file_tags (file_id, tag_id)
+            SELECT (SELECT file_id FROM audio_files WHERE file_path = ?),
+                   (SELECT tag_id FROM tags WHERE tag_name = ?)
+        '''
+        try:
+            with self.db_connection() as conn:
+                with conn:
+                    before = conn.total_changes
+                    conn.executemany(insert, [tuple(row) + (row[1],) for row in rows])
+                    inserted = conn.total_changes - before
+                    for tag in tags:
+                        conn.execute("INSERT OR IGNORE INTO tags (tag_name) VALUES (?)", (tag,))
+                        conn.executemany(tag_file, [(row[1], tag) for row in rows])
+            return inserted
+        except sqlite3.Error as e:
+            logging.error(f"Failed to insert metadata for {len(rows)} files: {e}")
+            raise
+
+    def upsert_many(self, rows):
+        """
+        Insert or update many (file_name, file_path, num_channels, sample_rate,
+        file_size, duration) rows in one transaction, e.g. after files were rewritten.
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        update = '''
+            UPDATE audio_files
+            SET file_name = ?, num_channels = ?, sample_rate = ?, file_size = ?, duration = ?
+            WHERE file_path = ?
+        '''
+        try:
+            self.insert_many(rows)
+            with self.db_connection() as conn:
+                with conn:
+                    conn.executemany(update, [(row[0],) + tuple(row[2:6]) + (row[1],) for row in rows])
+        except sqlite3.Error as e:
+            logging.error(f"Failed to update metadata for {len(rows)} files: {e}")
+            raise
+
+    def set_segments(self, file_path, segments):
+        """Replace the segments stored for a file with (start, end[, clip_path]) tuples in seconds."""
+        self.set_segments_many([(file_path, segments)])
+
+    def set_segments_many(self, items):
+        """Replace the segments of many files, given as (file_path, segments) pairs, in one transaction."""
+        items = list(items)
+        if not items:
+            return
+        try:
+            with self.db_connection() as conn:
+                with conn:
+                    conn.executemany("DELETE FROM segments WHERE file_path = ?", [(path,) for path, _ in items])
+                    conn.executemany(
+                        "INSERT INTO segments (file_path, start, end, clip_path) VALUES (?, ?, ?, ?)",
+                        [(path, segment[0], segment[1], segment[2] if len(segment) > 2 else None)
+                         for path, segments in items for segment in segments]
+                    )
+        except sqlite3.Error as e:
+            logging.error(f"Failed to store segments for {len(items)} files: {e}")
+            raise
+
+    def get_segments(self, file_path):
+        """Return the (start, end, clip_path) segments stored for a file, in order."""
+        query = "SELECT start, end, clip_path FROM segments WHERE file_path = ? ORDER BY start"
+        return self.execute_query(query, (file_path,))
+
+    def set_analysis_many(self, results):
+        """
+        Store the signal statistics of many files, given as (file_path, stats)
+        pairs with stats keyed like ANALYSIS_COLUMNS, in one transaction.
+        """
+        results = list(results)
+        if not results:
+            return
+        query = '''
+            UPDATE audio_files
+            SET peak_db = ?, rms_db = ?, lufs = ?, dc_offset = ?, clipped = ?, analyzed_at = ?
+            WHERE file_path = ?
+        '''
+        now = time.time()
+        try:
+            with self.db_connection() as conn:
+                with conn:
+                    conn.executemany(query, [
+                        (stats['peak_db'], stats['rms_db'], stats['lufs'], stats['dc_offset'],
+                         stats['clipped'], now, path)
+                        for path, stats in results
+                    ])
+        except sqlite3.Error as e:
+            logging.error(f"Failed to store the analysis of {len(results)} files: {e}")
+            raise
+
+    def get_analyzed_files(self):
+        """Return the file_path's whose statistics have been measured."""
+        result = self.execute_query("SELECT file_path FROM audio_files WHERE analyzed_at IS NOT NULL")
+        return [r[0] for r in result]
+
+    def get_files_by_loudness(self, min_lufs=None, max_lufs=None):
+        """Return (file_path, lufs) of the files with an integrated loudness in [min_lufs, max_lufs), quietest first."""
+        query = "SELECT file_path, lufs FROM audio_files WHERE lufs IS NOT NULL"
+        params = []
+        if min_lufs is not None:
+            query += " AND lufs >= ?"
+            params.append(min_lufs)
+        if max_lufs is not None:
+            query += " AND lufs < ?"
+            params.append(max_lufs)
+        return self.execute_query(query + " ORDER BY lufs", tuple(params))
+
+    def get_analysis(self, file_path):
+        """Return the stored statistics of a file as a dict (values are None until it is analysed)."""
+        columns = list(ANALYSIS_COLUMNS)
+        result = self.execute_query(f"SELECT {', '.join(columns)} FROM audio_files WHERE file_path = ?", (file_path,))
+        return dict(zip(columns, result[0])) if result else None
+
     def write_metadata(self, file_path, num_channels=None, sample_rate=None,
                        file_size=None, duration=None, description=None, tags=None):
         """
@@ -176,6 +357,100 @@ class MetaDataDB:
         result = self.execute_query(query, (file_path,))
         return result[0][0] if result else None
 
+    def set_fingerprints_many(self, items):
+        """
+        Replace the fingerprints of many files, given as (file_path, hashes,
+        offsets) with offsets in analysis frames, in one transaction.
+        """
+        items = list(items)
+        if not items:
+            return
+        now = time.time()
+        try:
+            with self.db_connection() as conn:
+                with conn:
+                    for path, hashes, offsets in items:
+                        row = conn.execute("SELECT file_id FROM audio_files WHERE file_path = ?", (path,)).fetchone()
+                        if row is None:
+                            continue
+                        file_id = row[0]
+                        conn.execute("DELETE FROM fingerprints WHERE file_id = ?", (file_id,))
+                        conn.executemany(
+                            "INSERT OR IGNORE INTO fingerprints (hash, file_id, offset) VALUES (?, ?, ?)",
+                            ((int(h), file_id, int(o)) for h, o in zip(hashes, offsets))
+                        )
+                        conn.execute(
+                            "INSERT OR REPLACE INTO fingerprinted_files (file_id, hashes, fingerprinted_at) "
+                            "VALUES (?, ?, ?)",
+                            (file_id, len(hashes), now)
+                        )
+        except sqlite3.Error as e:
+            logging.error(f"Failed to store the fingerprints of {len(items)} files: {e}")
+            raise
+
+    def get_fingerprinted_files(self):
+        """Return the file_path's that have been fingerprinted."""
+        query = '''
+            SELECT a.file_path FROM fingerprinted_files f
+            JOIN audio_files a ON a.file_id = f.file_id
+        '''
+        return [r[0] for r in self.execute_query(query)]
+
+    def is_fingerprinted(self, file_path):
+        """Whether a file has been fingerprinted (even if it yielded no hashes)."""
+        query = '''
+            SELECT 1 FROM fingerprinted_files f
+            JOIN audio_files a ON a.file_id = f.file_id
+            WHERE a.file_path = ? LIMIT 1
+        '''
+        return bool(self.execute_query(query, (file_path,)))
+
+    def get_fingerprints(self, file_path):
+        """Return the (hash, offset) fingerprints stored for a file."""
+        query = '''
+            SELECT f.hash, f.offset FROM fingerprints f
+            JOIN audio_files a ON a.file_id = f.file_id
+            WHERE a.file_path = ?
+        '''
+        return self.execute_query(query, (file_path,))
+
+    def match_fingerprints(self, hashes, offsets, min_matches=1):
+        """
+        Look (hash, offset) fingerprints up in the index. Returns (file_path,
+        delta, matches, hashes) for every file and offset difference (its
+        offset minus the query's) with at least `min_matches` equal hashes;
+        `hashes` is that file's own number of fingerprints.
+        """
+        query = '''
+            SELECT a.file_path, f.offset - q.offset AS delta, COUNT(*) AS matches, ff.hashes
+            FROM query_fingerprints q
+            JOIN fingerprints f ON f.hash = q.hash
+            JOIN fingerprinted_files ff ON ff.file_id = f.file_id
+            JOIN audio_files a ON a.file_id = f.file_id
+            GROUP BY f.file_id, delta
+            HAVING matches >= ?
+        '''
+        with self.db_connection() as conn:
+            conn.execute("CREATE TEMP TABLE query_fingerprints (hash INTEGER, offset INTEGER)")
+            conn.executemany("INSERT INTO query_fingerprints VALUES (?, ?)",
+                             ((int(h), int(o)) for h, o in zip(hashes, offsets)))
+            return conn.execute(query, (min_matches,)).fetchall()
+
+    def get_file_ids(self):
+        """Return (file_id, file_path) of every file in audio_files."""
+        return self.execute_query("SELECT file_id, file_path FROM audio_files")
+
+    def get_file_paths(self, file_ids):
+        """Return {file_id: file_path} for the given file_ids (missing ids are left out)."""
+        file_ids = [int(file_id) for file_id in file_ids]
+        paths = {}
+        # SQLite limits the number of parameters of one statement
+        for start in range(0, len(file_ids), 500):
+            chunk = file_ids[start:start + 500]
+            query = f"SELECT file_id, file_path FROM audio_files WHERE file_id IN ({', '.join('?' * len(chunk))})"
+            paths.update(self.execute_query(query, tuple(chunk)))
+        return paths
+
     def rename_file(self, old_path, new_path):
         """
         Update the database to reflect a rename from old_path to new_path.
@@ -190,15 +465,27 @@ class MetaDataDB:
             (new_path, os.path.basename(new_path), old_path),
             commit=True
         )
+        self.execute_query("UPDATE segments SET file_path = ? WHERE file_path = ?", (new_path, old_path), commit=True)
 
     def delete_file(self, file_path):
         """Remove file metadata from the database by file_path."""
+        file_id = self.get_file_id(file_path)
+        if file_id is not None:
+            self.execute_query("DELETE FROM fingerprints WHERE file_id = ?", (file_id,), commit=True)
+            self.execute_query("DELETE FROM fingerprinted_files WHERE file_id = ?", (file_id,), commit=True)
         query = "DELETE FROM audio_files WHERE file_path = ?"
         self.execute_query(query, (file_path,), commit=True)
+        self.execute_query("DELETE FROM segments WHERE file_path = ?", (file_path,), commit=True)
 
     def get_metadata(self, file_path):
-        """Return the entire row of metadata for the file_path."""
-        query = "SELECT * FROM audio_files WHERE file_path = ?"
+        """
+        Return the (file_id, file_name, file_path, num_channels, sample_rate,
+        file_size, duration, description) row of metadata for the file_path.
+        """
+        query = '''
+            SELECT file_id, file_name, file_path, num_channels, sample_rate, file_size, duration, description
+            FROM audio_files WHERE file_path = ?
+        '''
         result = self.execute_query(query, (file_path,))
         return result[0] if result else None
 
@@ -277,8 +564,8 @@ class MetaDataDB:
 
 class MetaDataWidget(QTableWidget):
     """
-    A QTableWidget that displays a file's metadata in 4 rows x 4 columns,
-    effectively 8 key-value pairs.
+    A QTableWidget that displays a file's metadata in 6 rows x 4 columns,
+    effectively 12 key-value pairs.
     """
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -289,7 +576,7 @@ class MetaDataWidget(QTableWidget):
 
     def setup_table(self):
         """Set up the table's initial appearance and constraints."""
-        self.setRowCount(4)
+        self.setRowCount(6)
         self.setColumnCount(4)
         self.setShowGrid(True)
         self.setStyleSheet("""
@@ -316,6 +603,8 @@ class MetaDataWidget(QTableWidget):
             if metadata:
                 file_id, file_name, file_path_, num_channels, sample_rate, file_size, duration, description = metadata
                 tags = ', '.join(self.metadatadb.get_tags_for_file(file_path_))
+                analysis = self.metadatadb.get_analysis(file_path_) or {}
+                level = lambda value, unit: "" if value is None else f"{value:.1f} {unit}"
 
                 data = [
                     ("File Name", file_name),
@@ -325,11 +614,16 @@ class MetaDataWidget(QTableWidget):
                     ("File Size", f"{file_size} KB"),
                     ("Duration", f"{duration} seconds"),
                     ("Description", str(description) if description else ""),
-                    ("Tags", tags)
+                    ("Tags", tags),
+                    ("Loudness", level(analysis.get('lufs'), "LUFS")),
+                    ("Peak", level(analysis.get('peak_db'), "dBFS")),
+                    ("RMS", level(analysis.get('rms_db'), "dBFS")),
+                    ("DC Offset / Clipped", "" if analysis.get('analyzed_at') is None
+                     else f"{analysis['dc_offset']:.4f} / {analysis['clipped']}"),
                 ]
 
-                # Fill the 4x4
-                for i in range(4):
+                # Fill the 6x4
+                for i in range(6):
                     for j in range(2):
                         key = data[i*2 + j][0]
                         val = data[i*2 + j][1]
@@ -0,0 +1,193 @@
+import sys
+import threading
+
+import numpy as np
+
+from EditList import resampled
+
+# Length reported by a live mixer, which keeps playing until it is stopped
+LIVE_LENGTH = sys.maxsize // 2
+
+
+def pan_matrix(source_channels, output_channels, gain=1.0, pan=0.0):
+    """
+    Routing matrix (source_channels x output_channels) applying gain and pan.
+    Mono sources use a constant-power pan law; multichannel sources are
+    balanced, so pan 0 leaves them untouched.
+    """
+    matrix = np.zeros((source_channels, output_channels), dtype=np.float32)
+    if output_channels == 1:
+        matrix[:, 0] = gain / source_channels
+        return matrix
+    if source_channels == 1:
+        angle = (pan + 1) * np.pi / 4
+        matrix[0, 0], matrix[0, 1] = np.cos(angle), np.sin(angle)
+        matrix *= gain * np.sqrt(2)
+        return matrix
+    for channel in range(source_channels):
+        matrix[channel, channel % output_channels] = 1.0
+    matrix[:, 0] *= min(1.0, 1.0 - pan)
+    matrix[:, 1] *= min(1.0, 1.0 + pan)
+    return matrix * gain
+
+
+class Voice:
+    """
+    One layer of a Mixer: `data` (an array or an EditList) at rate `fs`,
+    starting at mixer frame `offset`, played once, `loop` times, or forever
+    (loop=True). Gain and pan may be changed while playing; the change is
+    ramped over one block to avoid clicks. `fade_in` and `fade_out` are
+    linear fades at its start and end, in mixer frames. Data at another
+    rate is converted once, with polyphase filtering (see EditList.at_rate).
+    """
+    def __init__(self, data, fs, mixer_fs, gain=1.0, pan=0.0, offset=0, loop=False, fade_in=0, fade_out=0):
+        if fs != mixer_fs:
+            data = resampled(data, fs, mixer_fs)
+        self.data = data
+        self.fs = fs
+        self.gain = gain
+        self.pan = pan
+        self.offset = int(offset)
+        self.loop = loop
+        self.channels = 1 if data.ndim == 1 else data.shape[1]
+        # Length of one pass at the mixer's rate
+        self.pass_length = len(data)
+        if loop is True:
+            self.end = LIVE_LENGTH
+        else:
+            self.end = self.offset + self.pass_length * max(int(loop), 1)
+        self.fade_in = min(int(fade_in), self.end - self.offset)
+        self.fade_out = min(int(fade_out), self.end - self.offset)
+        self._applied = None
+
+    def matrix(self, output_channels):
+        return pan_matrix(self.channels, output_channels, self.gain, self.pan)
+
+    def envelope(self, first, count):
+        """Fade gains for `count` frames starting `first` frames into the voice, or None."""
+        length = self.end - self.offset
+        in_fade = self.fade_in and first < self.fade_in
+        out_fade = self.fade_out and first + count > length - self.fade_out
+        if not (in_fade or out_fade):
+            return None
+        positions = first + np.arange(count, dtype=np.float32)
+        gains = np.ones(count, dtype=np.float32)
+        if in_fade:
+            gains *= np.minimum(positions / self.fade_in, 1)
+        if out_fade:
+            gains *= np.clip((length - positions) / self.fade_out, 0, 1)
+        return gains[:, np.newaxis]
+
+    def frames(self, first, count):
+        """
+        Samples for `count` mixer frames starting `first` frames into the voice,
+        shaped (count, channels).
+        """
+        length = len(self.data)
+        pieces = []
+        while count > 0:
+            position = first % length if self.loop else first
+            take = min(count, length - position)
+            pieces.append(self.data[position:position + take].reshape(take, -1))
+            first += take
+            count -= take
+        return pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+
+
+class Mixer:
+    """
+    Sums any number of voices block by block, for playback through an
+    AudioEngine (it slices like an array: mixer[start:stop] renders that range).
+    Each voice is gained, panned and routed with one matrix product, and
+    voices at other sample rates are resampled as they are added.
+    The voice list is replaced, never modified, so voices can be added from
+    the UI thread while the engine renders from its decoder thread.
+    """
+    def __init__(self, fs=44100, channels=2, gain=1.0, live=False):
+        self.fs = int(fs)
+        self.channels = channels
+        self.gain = gain
+        self.live = live
+        self.voices = ()
+        # First frame the engine has not rendered yet; new live voices start here
+        self.rendered_until = 0
+        self._lock = threading.Lock()
+
+    def add(self, data, fs, gain=1.0, pan=0.0, offset=None, loop=False, fade_in=0, fade_out=0):
+        """
+        Add a voice and return it. Without an offset it starts at the next
+        rendered block; a live mixer never starts a voice before that block.
+        """
+        if len(data) == 0:
+            raise ValueError("Cannot add an empty voice.")
+        with self._lock:
+            if offset is None:
+                offset = self.rendered_until
+            elif self.live:
+                offset = max(offset, self.rendered_until)
+            voice = Voice(data, fs, self.fs, gain, pan, offset, loop, fade_in, fade_out)
+            self.voices = self.voices + (voice,)
+        return voice
+
+    def remove(self, voice):
+        with self._lock:
+            self.voices = tuple(v for v in self.voices if v is not voice)
+
+    def clear(self):
+        with self._lock:
+            self.voices = ()
+
+    # ---- array-like interface used by AudioEngine ----
+
+    def __len__(self):
+        if self.live:
+            return LIVE_LENGTH
+        return max((voice.end for voice in self.voices), default=0)
+
+    @property
+    def shape(self):
+        return (len(self), self.channels)
+
+    @property
+    def ndim(self):
+        return 2
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("Mixer only supports contiguous slices")
+        start, stop, _ = key.indices(len(self))
+        return self.render(start, stop)
+
+    def render(self, start, stop):
+        """Mix frames [start, stop) of all voices."""
+        count = max(stop - start, 0)
+        out = np.zeros((count, self.channels), dtype=np.float32)
+        with self._lock:
+            voices = self.voices
+            self.rendered_until = max(self.rendered_until, stop)
+        for voice in voices:
+            first, last = max(start, voice.offset), min(stop, voice.end)
+            if last <= first:
+                continue
+            block = voice.frames(first - voice.offset, last - first)
+            envelope = voice.envelope(first - voice.offset, last - first)
+            if envelope is not None:
+                block = block * envelope
+            matrix = voice.matrix(self.channels)
+            target = out[first - start:last - start]
+            if voice._applied is None or np.array_equal(voice._applied, matrix):
+                target += block @ matrix
+            else:
+                # Ramp from the previous gain/pan to the new one over this block
+                ramp = np.linspace(0, 1, len(block), dtype=np.float32)[:, np.newaxis]
+                target += (block @ voice._applied) * (1 - ramp) + (block @ matrix) * ramp
+            voice._applied = matrix
+
+        if self.gain != 1.0:
+            out *= self.gain
+        # Forget voices that have finished playing
+        finished = [voice for voice in voices if voice.end <= start]
+        if finished:
+            with self._lock:
+                self.voices = tuple(v for v in self.voices if v not in finished)
+        return out
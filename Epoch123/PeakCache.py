@@ -0,0 +1,193 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import soundfile as sf
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, QTimer, Signal
+
+from eutils import get_main_sound_dir_path
+
+logger = logging.getLogger(__name__)
+
+# Number of min/max columns stored per file
+PEAK_BINS = 128
+
+
+def compute_peaks(file_path, bins=PEAK_BINS):
+    """
+    Stream through an audio file once and return a (2, bins) float32 array
+    holding the min (row 0) and max (row 1) of each bin, mixed down to mono.
+    """
+    frames = sf.info(file_path).frames
+    peaks = np.zeros((2, bins), dtype=np.float32)
+    if frames == 0:
+        return peaks
+
+    blocksize = max(1, -(-frames // bins))
+    for i, block in enumerate(sf.blocks(file_path, blocksize=blocksize, always_2d=True, dtype='float32')):
+        if i >= bins:
+            break
+        mono = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+        peaks[0, i], peaks[1, i] = mono.min(), mono.max()
+    return peaks
+
+
+class PeakCache:
+    """
+    Two-level (memory LRU + on-disk .npz) cache of per-file peak envelopes.
+    Disk entries remember the file's mtime and size and are ignored once the
+    file changes. Safe to use from worker threads.
+    """
+    def __init__(self, cache_dir=None, bins=PEAK_BINS, max_entries=20000):
+        self.cache_dir = cache_dir or os.path.join(get_main_sound_dir_path('Epoch123/DB'), 'cache', 'peaks')
+        self.bins = bins
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def disk_path(self, file_path):
+        """Return the cache file used for file_path."""
+        digest = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.npz")
+
+    @staticmethod
+    def file_signature(file_path):
+        st = os.stat(file_path)
+        return st.st_mtime_ns, st.st_size
+
+    def peek(self, file_path):
+        """Return peaks only if they are already in memory (never touches the disk)."""
+        with self._lock:
+            return self._memory.get(file_path)
+
+    def get(self, file_path):
+        """Return cached peaks for file_path, or None if they are missing or stale."""
+        with self._lock:
+            if file_path in self._memory:
+                self._memory.move_to_end(file_path)
+                return self._memory[file_path]
+        try:
+            with np.load(self.disk_path(file_path)) as stored:
+                if tuple(stored['signature']) != self.file_signature(file_path):
+                    return None
+                peaks = stored['peaks']
+        except (OSError, KeyError, ValueError):
+            return None
+        self._remember(file_path, peaks)
+        return peaks
+
+    def put(self, file_path, peaks):
+        """Store peaks in memory and on disk."""
+        self._remember(file_path, peaks)
+        try:
+            np.savez(self.disk_path(file_path), peaks=peaks,
+                     signature=np.array(self.file_signature(file_path), dtype=np.int64))
+        except OSError as e:
+            logger.error(f"Failed to write peak cache for {file_path}: {e}")
+
+    def get_or_compute(self, file_path):
+        """Return cached peaks, computing and storing them on a miss."""
+        peaks = self.get(file_path)
+        if peaks is None:
+            peaks = compute_peaks(file_path, self.bins)
+            self.put(file_path, peaks)
+        return peaks
+
+    def invalidate(self, file_path):
+        """Forget any peaks stored for file_path (e.g. after it was edited or deleted)."""
+        with self._lock:
+            self._memory.pop(file_path, None)
+        try:
+            os.remove(self.disk_path(file_path))
+        except FileNotFoundError:
+            pass
+
+    def _remember(self, file_path, peaks):
+        with self._lock:
+            self._memory[file_path] = peaks
+            self._memory.move_to_end(file_path)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+
+class PeakJobSignals(QObject):
+    """
+    Signals for PeakJob (QRunnable cannot emit signals itself).
+      - finished(done: list, failed: list) -> file paths whose peaks are cached / could not be read
+    """
+    finished = Signal(list, list)
+
+
+class PeakJob(QRunnable):
+    """Computes peaks for a batch of files on the global QThreadPool."""
+    def __init__(self, peak_cache, file_paths, signals):
+        super().__init__()
+        self.peak_cache = peak_cache
+        self.file_paths = file_paths
+        self.signals = signals
+
+    def run(self):
+        done, failed = [], []
+        for file_path in self.file_paths:
+            try:
+                self.peak_cache.get_or_compute(file_path)
+                done.append(file_path)
+            except Exception as e:
+                failed.append(file_path)
+                logger.error(f"Failed to compute peaks for {file_path}: {e}")
+        self.signals.finished.emit(done, failed)
+
+
+class PeakLoader(QObject):
+    """
+    Collects peak requests made while painting and hands them to the thread
+    pool in batches. Files that fail to decode are not retried.
+    Signals:
+      - peaks_ready(file_paths: list) -> peaks for these files are now cached
+    """
+    peaks_ready = Signal(list)
+    BATCH_SIZE = 32
+    FLUSH_DELAY_MS = 30
+
+    def __init__(self, peak_cache, parent=None):
+        super().__init__(parent)
+        self.peak_cache = peak_cache
+        self.queued = set()
+        self.in_flight = set()
+        self.failed = set()
+
+        self.signals = PeakJobSignals()
+        self.signals.finished.connect(self.on_batch_finished)
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(self.FLUSH_DELAY_MS)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def request(self, file_path):
+        """Queue file_path for background peak computation."""
+        if file_path in self.queued or file_path in self.in_flight or file_path in self.failed:
+            return
+        self.queued.add(file_path)
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self):
+        """Start one job per batch of queued files."""
+        batch = sorted(self.queued)
+        self.queued.clear()
+        self.in_flight.update(batch)
+        for start in range(0, len(batch), self.BATCH_SIZE):
+            job = PeakJob(self.peak_cache, batch[start:start + self.BATCH_SIZE], self.signals)
+            QThreadPool.globalInstance().start(job)
+
+    def on_batch_finished(self, done, failed):
+        self.in_flight.difference_update(done)
+        self.in_flight.difference_update(failed)
+        self.failed.update(failed)
+        if done:
+            self.peaks_ready.emit(done)
@@ -0,0 +1,228 @@
+from fractions import Fraction
+
+import numpy as np
+import scipy.fft as sfft
+import scipy.signal as sig
+from numpy.lib.stride_tricks import sliding_window_view
+
+from Resampling import resample, resample_range
+
+# Frame length and synthesis hop of the phase vocoder (75% overlap)
+N_FFT = 2048
+HOP = N_FFT // 4
+
+# Input samples handed to the vocoder at a time for a whole signal
+CHUNK = 1 << 17
+
+# Synthesis phases restart from the analysis phases every RESET_FRAMES
+# frames (65536 output samples), so any range of the output can be rendered
+# on its own from the reset before it and equals the whole signal's
+RESET_FRAMES = 128
+
+# Threads used by the FFTs (-1: one per core)
+FFT_WORKERS = -1
+
+# Largest denominator used to turn a pitch factor into a resampling ratio
+MAX_DENOMINATOR = 64
+
+
+def _wrap(phase):
+    """Wrap phases to [-pi, pi)."""
+    return (phase + np.pi) % (2 * np.pi) - np.pi
+
+
+class PhaseVocoder:
+    """
+    Streaming phase vocoder: stretches audio in time by `stretch` (output
+    length / input length) without changing its pitch.
+    Feed (frames, channels) blocks to process(), keep what it returns, and
+    call flush() at the end. Each call analyses, phase-advances and
+    overlap-adds all complete frames at once (batched FFTs on every core),
+    so memory depends on the block size, not on the signal length.
+    """
+    def __init__(self, stretch, channels=1, n_fft=N_FFT, hop=HOP, reset_frames=RESET_FRAMES):
+        if stretch <= 0:
+            raise ValueError("Stretch factor must be positive.")
+        if n_fft % hop:
+            raise ValueError("The FFT size must be a multiple of the hop.")
+        self.stretch = stretch
+        self.channels = channels
+        self.n_fft = n_fft
+        self.hop = hop
+        self.reset_frames = reset_frames
+        self.analysis_hop = hop / stretch
+        self.window = sig.get_window('hann', n_fft)
+        self.norm = (self.window ** 2).sum() / hop
+        self.omega = 2 * np.pi * np.arange(n_fft // 2 + 1) / n_fft
+
+        # Buffered input, starting with a frame of silence so the first samples are fully overlapped
+        self._input = np.zeros((n_fft, channels), dtype=np.float32)
+        self._input_start = 0
+        self._frame = 0
+        # Analysis position and phases of the last frame, and the synthesis phases given to it
+        self._last = None
+        self._phase = None
+        self._tail = np.zeros((n_fft - hop, channels))
+        # Output that corresponds to the leading silence
+        self._skip = int(round(n_fft / 2 * (1 - stretch) + n_fft * stretch))
+        self._fed = 0
+        self._emitted = 0
+
+    def process(self, block):
+        """Add input samples; returns the output samples completed so far."""
+        block = np.asarray(block, dtype=np.float32).reshape(len(block), self.channels)
+        self._fed += len(block)
+        self._input = np.concatenate((self._input, block))
+        return self._emit(self._run())
+
+    def flush(self):
+        """Process the remaining input; returns the last output samples."""
+        self._input = np.concatenate((self._input, np.zeros((self.n_fft, self.channels), dtype=np.float32)))
+        out = np.concatenate((self._run(), self._tail))
+        self._tail = np.zeros_like(self._tail)
+        out = self._emit(out)
+        missing = int(round(self._fed * self.stretch)) - self._emitted
+        if missing > 0:
+            out = np.concatenate((out, np.zeros((missing, self.channels), dtype=np.float32)))
+            self._emitted += missing
+        return out
+
+    def _emit(self, out):
+        """Drop the output of the leading silence and anything past the stretched length."""
+        if self._skip:
+            skipped = min(self._skip, len(out))
+            out = out[skipped:]
+            self._skip -= skipped
+        remaining = int(round(self._fed * self.stretch)) - self._emitted
+        out = out[:max(remaining, 0)]
+        self._emitted += len(out)
+        return out.astype(np.float32)
+
+    def _run(self):
+        """Analyse, phase-advance and overlap-add every frame that lies fully inside the input."""
+        n, hop = self.n_fft, self.hop
+        end = self._input_start + len(self._input)
+        frames = np.arange(self._frame, int((end - n) / self.analysis_hop) + 2)
+        positions = np.round(frames * self.analysis_hop).astype(np.int64)
+        positions = positions[positions + n <= end]
+        count = len(positions)
+        if not count:
+            return np.zeros((0, self.channels))
+
+        windows = sliding_window_view(self._input, n, axis=0)[positions - self._input_start]
+        spectra = sfft.rfft(windows * self.window, axis=-1, workers=FFT_WORKERS)
+        magnitudes = np.abs(spectra)
+        phases = np.angle(spectra)
+
+        # Phase advance per frame from each bin's instantaneous frequency
+        if self._last is None:
+            previous_position, previous_phases = positions[0], phases[0]
+        else:
+            previous_position, previous_phases = self._last
+        steps = np.diff(positions, prepend=previous_position)[:, np.newaxis, np.newaxis]
+        previous = np.concatenate((previous_phases[np.newaxis], phases[:-1]))
+        deviation = _wrap(phases - previous - self.omega * steps)
+        scale = np.divide(hop, steps, out=np.zeros(steps.shape), where=steps > 0)
+        advance = self.omega * hop + deviation * scale
+        synthesis = np.empty_like(phases)
+        resets = np.flatnonzero(frames[:count] % self.reset_frames == 0)
+        bounds = np.union1d(resets, [0, count])
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            if first in resets or self._phase is None:
+                # Reset frame: start again from its own analysis phases
+                synthesis[first] = phases[first]
+                synthesis[first + 1:last] = phases[first] + np.cumsum(advance[first + 1:last], axis=0)
+            else:
+                synthesis[first:last] = self._phase + np.cumsum(advance[first:last], axis=0)
+        self._phase = _wrap(synthesis[-1])
+        self._last = (positions[-1], phases[-1])
+
+        grains = sfft.irfft(magnitudes * np.exp(1j * synthesis), n=n, axis=-1, workers=FFT_WORKERS)
+        grains = (grains * (self.window / self.norm)).transpose(0, 2, 1)
+
+        # Overlap-add: grain t starts t * hop after the first, so each hop-long
+        # slice of the grains lands on a contiguous range of the output
+        out = np.zeros((count * hop + n - hop, self.channels))
+        for j in range(n // hop):
+            out[j * hop:j * hop + count * hop] += grains[:, j * hop:(j + 1) * hop].reshape(count * hop, self.channels)
+        out[:n - hop] += self._tail
+        self._tail = out[count * hop:]
+
+        self._frame += count
+        consumed = int(np.round(self._frame * self.analysis_hop)) - self._input_start
+        if consumed > 0:
+            self._input = self._input[consumed:]
+            self._input_start += consumed
+        return out[:count * hop]
+
+
+def time_stretch(data, stretch, chunk=CHUNK):
+    """Stretch `data` (frames, or frames x channels) to `stretch` times its length, keeping its pitch."""
+    data = np.asarray(data)
+    channels = 1 if data.ndim == 1 else data.shape[1]
+    vocoder = PhaseVocoder(stretch, channels)
+    out = np.empty((int(round(len(data) * stretch)), channels), dtype=np.float32)
+    filled = 0
+    for start in range(0, len(data), chunk):
+        block = vocoder.process(data[start:start + chunk])
+        out[filled:filled + len(block)] = block
+        filled += len(block)
+    block = vocoder.flush()
+    out[filled:filled + len(block)] = block
+    return out[:, 0] if data.ndim == 1 else out
+
+
+def stretch_range(read, length, stretch, start, stop, shape=()):
+    """
+    Samples [start, stop) of time_stretch() applied to the signal `read(a, b)`
+    (`length` samples with trailing shape `shape`). Only the input from the
+    phase reset before the range is analysed, so the cost depends on the
+    range, not on the length of the signal.
+    """
+    channels = shape[0] if shape else 1
+    vocoder = PhaseVocoder(stretch, channels)
+    n, hop = vocoder.n_fft, vocoder.hop
+    stop = max(min(stop, int(round(length * stretch))), start)
+    out = np.zeros((stop - start, channels), dtype=np.float32)
+    if stop > start:
+        # Output positions counted from the first grain (the input is preceded by a frame of silence)
+        first, last = start + vocoder._skip, stop + vocoder._skip
+        needed = max(0, (first - n + hop) // hop)             # earlier grains end before `first`
+        frame = needed // vocoder.reset_frames * vocoder.reset_frames
+        low = int(round(frame * vocoder.analysis_hop))
+        high = min(int(round((last - 1) // hop * vocoder.analysis_hop)) + n, length + 2 * n)
+        padded = np.zeros((high - low, channels), dtype=np.float32)
+        a, b = max(low - n, 0), min(high - n, length)
+        if b > a:
+            padded[a + n - low:b + n - low] = np.asarray(read(a, b), dtype=np.float32).reshape(b - a, channels)
+        vocoder._input, vocoder._input_start, vocoder._frame = padded, low, frame
+        raw = np.concatenate((vocoder._run(), vocoder._tail))
+        offset = frame * hop
+        piece = raw[first - offset:last - offset]
+        out[:len(piece)] = piece
+    return out if shape else out[:, 0]
+
+
+def pitch_range(read, length, factor, start, stop, shape=()):
+    """Samples [start, stop) of pitch_shift() applied to the signal `read(a, b)`, as stretch_range()."""
+    ratio = Fraction(factor).limit_denominator(MAX_DENOMINATOR)
+    stretch = float(ratio)
+    stop = max(min(stop, length), start)
+    out = resample_range(lambda a, b: stretch_range(read, length, stretch, a, b, shape),
+                         int(round(length * stretch)), ratio.denominator, ratio.numerator, start, stop)
+    if len(out) < stop - start:
+        out = np.concatenate((out, np.zeros((stop - start - len(out),) + shape, dtype=out.dtype)))
+    return out
+
+
+def pitch_shift(data, factor, chunk=CHUNK):
+    """
+    Shift the pitch of `data` by `factor` keeping its length: stretch it by
+    the factor with the phase vocoder, then resample it back.
+    """
+    ratio = Fraction(factor).limit_denominator(MAX_DENOMINATOR)
+    stretched = time_stretch(data, float(ratio), chunk)
+    out = resample(stretched, ratio.denominator, ratio.numerator, chunk)
+    if len(out) >= len(data):
+        return out[:len(data)]
+    return np.concatenate((out, np.zeros((len(data) - len(out),) + out.shape[1:], dtype=out.dtype)))
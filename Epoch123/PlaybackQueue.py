@@ -0,0 +1,221 @@
+import os
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import soundfile as sf
+from PySide6.QtCore import QObject, Signal
+
+from EditList import BLOCK_SIZE
+from eutils import is_audio_file
+
+logger = logging.getLogger(__name__)
+
+# Items decoded and scheduled ahead of the one being heard
+LOOKAHEAD = 2
+
+REPEAT_MODES = ('off', 'all', 'one')
+
+
+class PlaybackQueue(QObject):
+    """
+    A list of sound files auditioned back to back with no gap between them.
+    Upcoming items are decoded on a worker thread and scheduled as voices of
+    a live Mixer, each starting where the previous one ends (less the
+    crossfade), so moving on to the next item never waits for a decode.
+    Positions passed in are frames of that mixer.
+    Signals:
+      - item_changed(str)  -> Path of the item now being heard
+      - finished()         -> Emitted once the last item has been heard
+    """
+    item_changed = Signal(str)
+    finished = Signal()
+
+    def __init__(self, paths, shuffle=False, repeat='off', crossfade=0.0, parent=None):
+        super().__init__(parent)
+        if repeat not in REPEAT_MODES:
+            raise ValueError(f"Unknown repeat mode: {repeat}")
+        self.paths = [str(path) for path in paths if is_audio_file(path)]
+        self.shuffle = shuffle
+        self.repeat = repeat
+        self.crossfade = crossfade
+        self.order = self._new_order()
+        self.mixer = None
+
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="PlaybackQueueDecoder")
+        self._pending = None
+        self._failed = set()
+        self._reset()
+
+    @classmethod
+    def from_folder(cls, folder, **kwargs):
+        """Queue of the audio files in `folder` and its subfolders, in name order."""
+        paths = []
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            paths.extend(os.path.join(root, name) for name in sorted(files))
+        return cls(paths, **kwargs)
+
+    @classmethod
+    def from_tag(cls, metadata_db, tag_name, **kwargs):
+        """Queue of the files tagged `tag_name` in the metadata database."""
+        return cls(sorted(metadata_db.get_files_by_tag(tag_name)), **kwargs)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _reset(self):
+        self._next = 0              # index into order of the next item to schedule
+        self._last_path = None
+        self._exhausted = False
+        self._next_offset = 0       # mixer frame where the next item should start
+        self._scheduled = []        # (offset, end, path) of items not heard to the end yet
+        self._current = None
+
+    def _new_order(self):
+        order = list(range(len(self.paths)))
+        if self.shuffle:
+            random.shuffle(order)
+        return order
+
+    # ---- modes ----
+
+    def set_shuffle(self, shuffle):
+        """Shuffle (or restore the order of) the items not scheduled yet."""
+        with self._lock:
+            self.shuffle = shuffle
+            rest = self.order[self._next:]
+            if shuffle:
+                random.shuffle(rest)
+            else:
+                rest.sort()
+            self.order[self._next:] = rest
+
+    def set_repeat(self, repeat):
+        """'off', 'all' (start over after the last item) or 'one' (repeat the current item)."""
+        if repeat not in REPEAT_MODES:
+            raise ValueError(f"Unknown repeat mode: {repeat}")
+        with self._lock:
+            self.repeat = repeat
+            self._exhausted = False
+
+    def set_crossfade(self, seconds):
+        """Crossfade length for items scheduled from now on."""
+        self.crossfade = max(0.0, float(seconds))
+
+    # ---- scheduling ----
+
+    def start(self, mixer):
+        """Start scheduling items into `mixer` from the top of the queue."""
+        self.stop()
+        with self._lock:
+            self.mixer = mixer
+            self.order = self._new_order()
+            self._reset()
+        self._request_next()
+
+    def stop(self):
+        """Stop scheduling; items already decoding are dropped."""
+        with self._lock:
+            self.mixer = None
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+
+    def close(self):
+        """Stop and shut down the decode worker."""
+        self.stop()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _take_next(self):
+        """Path of the next item to schedule, following the repeat and shuffle modes."""
+        if self.repeat == 'one' and self._last_path is not None and self._last_path not in self._failed:
+            return self._last_path
+        for _ in range(2 * len(self.order) + 1):
+            if self._next >= len(self.order):
+                if self.repeat != 'all' or len(self._failed) >= len(self.paths):
+                    return None
+                self.order = self._new_order()
+                self._next = 0
+            path = self.paths[self.order[self._next]]
+            self._next += 1
+            if path not in self._failed:
+                self._last_path = path
+                return path
+        return None
+
+    def _request_next(self):
+        """Start decoding the next item on the worker, unless the queue has run out."""
+        with self._lock:
+            if self.mixer is None or self._exhausted:
+                return
+            path = self._take_next()
+            if path is None:
+                self._exhausted = True
+                return
+            mixer = self.mixer
+        self._pending = self._executor.submit(self._load, path, mixer)
+
+    def _load(self, path, mixer):
+        """Decode `path` and schedule it right after the previous item (worker thread)."""
+        try:
+            data, fs = sf.read(path, dtype='float32', always_2d=True)
+        except Exception as e:
+            logger.error(f"Skipping '{path}' in the playback queue: {e}")
+            self._failed.add(path)
+            return
+        if not len(data):
+            return
+        with self._lock:
+            if self.mixer is not mixer:
+                return
+            length = int(len(data) * mixer.fs / fs)
+            fade = min(int(self.crossfade * mixer.fs), length // 2)
+            voice = mixer.add(data, fs, offset=self._next_offset,
+                              fade_in=fade if self._scheduled else 0, fade_out=fade)
+            self._scheduled.append((voice.offset, voice.end, path))
+            self._next_offset = voice.end - fade
+        # Convert (and cache) the start now if it needs resampling, rather than on the audio thread
+        voice.frames(0, min(voice.pass_length, BLOCK_SIZE))
+
+    # ---- progress (UI thread) ----
+
+    def tick(self, position):
+        """
+        Follow playback at mixer frame `position`: keep LOOKAHEAD items
+        scheduled ahead, emit item_changed, and return False once the whole
+        queue has been heard.
+        """
+        with self._lock:
+            scheduled = [item for item in self._scheduled if item[1] > position]
+            self._scheduled = scheduled
+            exhausted = self._exhausted
+        started = [item for item in scheduled if item[0] <= position]
+        if started and started[-1] is not self._current:
+            self._current = started[-1]
+            self.item_changed.emit(self._current[2])
+
+        idle = self._pending is None or self._pending.done()
+        if idle and not exhausted and len(scheduled) - len(started) < LOOKAHEAD:
+            self._request_next()
+        elif idle and exhausted and not scheduled:
+            self.stop()
+            self.finished.emit()
+            return False
+        return True
+
+    def item_ms(self, position):
+        """Playback position within the current item, in ms."""
+        if self._current is None or self.mixer is None:
+            return 0
+        return int(max(position - self._current[0], 0) * 1000 / self.mixer.fs)
+
+    def next_start(self, position):
+        """Mixer frame where the item after the current one starts, or None if it is not scheduled yet."""
+        with self._lock:
+            for offset, _, _ in self._scheduled:
+                if offset > position:
+                    return offset
+        return None
@@ -1,145 +1,121 @@
-import numpy as np
 from PySide6.QtWidgets import QWidget, QMenu, QVBoxLayout, QFileDialog
 from PySide6.QtGui import QAction
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-import matplotlib.pyplot as plt
-from matplotlib.widgets import SpanSelector
-import soundfile as sf
+from PySide6.QtCore import Signal
 import logging
 import os
 
+from WaveformRenderer import create_renderer
+from EditHistory import EditHistory
+from EditList import EditList, Source
+from Spectrogram import SpectrogramRenderer
+
+# Waveform backend used when none is passed explicitly ('qt' or 'matplotlib')
+PLOT_BACKEND = os.environ.get('EPOCH123_PLOT_BACKEND', 'qt')
+
+
 class PlotWidget(QWidget):
     """
-    Displays the waveform of the current audio data using matplotlib.
-    Allows selection of a region with SpanSelector, which can be used
-    for playback, zoom, crop, etc.
+    Displays the waveform of the current audio data through a pluggable
+    renderer (see WaveformRenderer). Allows selection of a region, which
+    can be used for playback, zoom, crop, etc.
+    The data is an EditList over the loaded buffer, so crops and effects are
+    recorded rather than applied, and only the ranges that are drawn, played
+    or exported get rendered.
+    Signals:
+      - data_changed(data: EditList) -> emitted whenever the shown data changes (edits, undo, redo)
     """
-    def __init__(self, audio_player=None, parent=None):
+    data_changed = Signal(object)
+    def __init__(self, audio_player=None, parent=None, backend=None):
         super().__init__(parent)
-        self.figure, self.ax = plt.subplots()
-        self.canvas = FigureCanvas(self.figure)
-        self.line = None
-        self.position_line = None
-        self.selection_rect = None
+        self.backend = backend or PLOT_BACKEND
+        self.view_mode = 'waveform'
+        self.renderer = create_renderer(self.backend, self)
         self.selected_region = None
-        self.span_selector = None
+        self._context_x = None
 
         self.data = None
         self.fs = None
         self.audio = None
 
-        # Undo/redo stacks
-        self.undo_stack = []
-        self.redo_stack = []
+        # Undo/redo history of edit lists (they share the loaded buffer)
+        self.history = EditHistory()
 
         self.audio_player = audio_player
         if self.audio_player:
-            self.audio_player.update_position.connect(self.update_position_line)
+            self.audio_player.update_frame.connect(self.update_position_frame)
             self.audio_player.playback_finished.connect(self.reset_position_line)
 
         layout = QVBoxLayout(self)
-        layout.addWidget(self.canvas)
+        layout.addWidget(self.renderer)
         self.setLayout(layout)
 
-        self.setup_plot()
         self.connect_events()
 
-    def setup_plot(self):
-        """Initial configuration for the plot's appearance."""
-        self.figure.subplots_adjust(left=0, bottom=0, right=1, top=1, wspace=0, hspace=0)
-        self.ax.set_facecolor('black')
-        self.figure.patch.set_facecolor('black')
-
-        for axis in ['x', 'y']:
-            self.ax.tick_params(axis=axis, colors='orange', direction='out')
-        self.ax.grid(color='orange', linestyle='-', linewidth=0.25, alpha=0.5)
-        self.ax.set_axisbelow(False)
-
-        self.position_line = self.ax.axvline(0, color='gray', lw=1, zorder=3)
-
-    def connect_events(self):
-        """Connect canvas events for clicking and selection."""
-        self.canvas.mpl_connect('button_press_event', self.on_click)
-        self.reset_span_selector()
-
-    def reset_span_selector(self):
-        """Reset the span selector to allow new region selection."""
-        if self.span_selector:
-            self.span_selector.disconnect_events()
-        self.span_selector = SpanSelector(
-            self.ax, self.on_select, 'horizontal',
-            useblit=True, props=dict(alpha=0.3, facecolor='pink')
-        )
-
-    def set_ticks(self, duration, data_length, xmin=None, xmax=None):
+    def set_view_mode(self, mode):
         """
-        Dynamically set the ticks based on the current zoom level or total data length.
+        Switch between the 'waveform' and 'spectrogram' renderers,
+        keeping the data, the visible range and the selection.
         """
-        if xmin is not None and xmax is not None:
-            xticks = np.linspace(xmin, xmax, 10)
-            time_labels = np.char.mod('%.2f', np.linspace(xmin / self.fs, xmax / self.fs, 10))
+        if mode == self.view_mode:
+            return
+        view = self.renderer.get_view() if self.data is not None else None
+        old_renderer = self.renderer
+        if mode == 'spectrogram':
+            self.renderer = SpectrogramRenderer(self)
         else:
-            xticks = np.linspace(0, data_length, 10)
-            time_labels = np.char.mod('%.2f', np.linspace(0, duration, 10))
+            self.renderer = create_renderer(self.backend, self)
+        self.view_mode = mode
 
-        time_labels[0] = ''
-        self.ax.set_xticks(xticks)
-        self.ax.set_xticklabels(time_labels, color='orange', fontsize=8, ha='left', va='bottom', y=0.03)
+        old_renderer.cleanup()
+        self.layout().replaceWidget(old_renderer, self.renderer)
+        old_renderer.deleteLater()
+        self.connect_events()
 
-        yticks = np.linspace(-1.6, 1.6, 15)
-        self.ax.set_yticks(yticks)
-        amplitude_labels = np.char.mod('%.1f', yticks)
-        amplitude_labels[0], amplitude_labels[-1] = '', ''
-        self.ax.set_yticklabels(amplitude_labels, color='orange', fontsize=8, ha='left', va='top', x=0.02)
+        if self.data is not None:
+            self.renderer.set_data(self.data, self.fs)
+            self.renderer.set_view(*view)
+            if self.selected_region:
+                self.renderer.set_selection(*self.selected_region)
+
+    def connect_events(self):
+        """Connect renderer signals for clicking and selection."""
+        self.renderer.clicked.connect(self.on_click)
+        self.renderer.region_selected.connect(self.on_select)
+
+    def load_data(self, data, fs, audio):
+        """Show a newly opened file: the edit history starts over from `data`."""
+        if not isinstance(data, EditList):
+            data = Source(data, fs)
+        self.history.reset(data)
+        self.selected_region = None
+        self.update_plot(data, fs, audio)
 
     def update_plot(self, data, fs, audio):
         """Update the plot with new data."""
         self.audio = audio
         self.data = data
         self.fs = fs
-        x_data = np.arange(len(data))
-
-        if self.line is None:
-            self.line, = self.ax.plot(x_data, data, color='purple', lw=0.5)
-        else:
-            self.line.set_xdata(x_data)
-            self.line.set_ydata(data)
-
-        self.position_line.set_xdata([0])
-        self.ax.set_xlim(0, len(data))
+        self.renderer.set_data(data, fs)
+        self.data_changed.emit(data)
 
-        duration = audio.duration_seconds if audio else len(data) / fs if fs else 0
-        self.set_ticks(duration, len(data))
-        self.canvas.draw_idle()
-        self.reset_span_selector()
-
-    def on_click(self, event):
+    def on_click(self, x, button):
         """
         Clear selection if left-click outside the selected region,
-        or open context menu on right-click.
+        or remember where a right-click happened for the context menu.
         """
-        if event.button == 1:
-            if self.selected_region and event.inaxes == self.ax:
-                xmin, xmax = self.selected_region
-                if not (xmin <= event.xdata <= xmax):
-                    self.clear_selection()
-        elif event.button == 3:
+        if button == 1:
             if self.selected_region:
                 xmin, xmax = self.selected_region
-                if xmin <= event.xdata <= xmax:
-                    self.context_menu(event, 'selected_region')
-                else:
-                    self.context_menu(event)
-            else:
-                self.context_menu(event)
+                if not (xmin <= x <= xmax):
+                    self.clear_selection()
+        elif button == 3:
+            self._context_x = x
 
     def on_select(self, xmin, xmax):
-        """Handle selection of a region with the SpanSelector."""
+        """Handle selection of a region in the renderer."""
         if xmax - xmin > 1:
             self.selected_region = (xmin, xmax)
-            if self.selection_rect:
-                self.selection_rect.remove()
-            self.selection_rect = self.ax.axvspan(xmin, xmax, color='pink', alpha=0.3)
+            self.renderer.set_selection(xmin, xmax)
 
             start_frame = int(xmin)
             end_frame = int(xmax)
@@ -148,39 +124,37 @@ class PlotWidget(QWidget):
             if self.audio_player:
                 self.audio_player.set_audio_data(selected_segment, self.fs)
                 self.audio_player.set_initial_frame(start_frame)
-            self.position_line.set_xdata([xmin])
+            self.renderer.set_position(xmin)
         else:
             self.clear_selection()
-        self.canvas.draw_idle()
 
     def clear_selection(self):
         """Clear the selection rectangle and reset the audio player to full data."""
-        if self.selection_rect:
-            self.selection_rect.remove()
-        self.selection_rect = None
+        self.renderer.clear_selection()
         self.selected_region = None
         if self.audio_player:
             self.audio_player.set_audio_data(self.data, self.fs)
-        self.position_line.set_xdata([0])
-        self.canvas.draw_idle()
+            self.audio_player.set_initial_frame(0)
+        self.renderer.set_position(0)
 
-    def update_position_line(self, position):
-        """Update the position line based on playback time in ms."""
-        if self.fs and self.data is not None:
-            position_index = int(position / 1000 * self.fs)
-            if position_index <= len(self.data):
-                self.position_line.set_xdata([position_index])
-                self.canvas.draw_idle()
+    def update_position_frame(self, frame):
+        """Update the position line to a sample index reported by the audio player."""
+        if self.data is not None and 0 <= frame <= len(self.data):
+            self.renderer.set_position(frame)
 
     def reset_position_line(self):
         """Reset the position line to the start of the selection or 0."""
         initial_position = int(self.selected_region[0]) if self.selected_region else 0
-        self.position_line.set_xdata([initial_position])
-        self.canvas.draw_idle()
+        self.renderer.set_position(initial_position)
 
     def contextMenuEvent(self, event):
         """Override Qt context menu event to show our own menu."""
-        if self.selected_region:
+        in_selection = self.selected_region and (
+            self._context_x is None
+            or self.selected_region[0] <= self._context_x <= self.selected_region[1]
+        )
+        self._context_x = None
+        if in_selection:
             self.context_menu(event, 'selected_region')
         else:
             self.context_menu(event)
@@ -219,41 +193,44 @@ class PlotWidget(QWidget):
         reset_plot_action.triggered.connect(self.reset_plot)
         menu.addAction(reset_plot_action)
 
+        if self.view_mode == 'spectrogram':
+            view_action = QAction('Show waveform', self)
+            view_action.triggered.connect(lambda: self.set_view_mode('waveform'))
+        else:
+            view_action = QAction('Show spectrogram', self)
+            view_action.triggered.connect(lambda: self.set_view_mode('spectrogram'))
+        menu.addAction(view_action)
+
         save_action = QAction('Save plot', self)
         save_action.triggered.connect(self.save_plot)
         menu.addAction(save_action)
 
         global_point = self.mapToGlobal(event.pos())
         menu.exec_(global_point)
-        self.reset_span_selector()
+        self.renderer.reset_interaction()
 
     def zoom_out(self):
         """Zoom out to show the entire data range."""
         if self.data is not None:
-            self.ax.set_xlim(0, len(self.data))
-            self.canvas.draw_idle()
-            self.undo_stack.append(self.data)
-            self.redo_stack.append(self.data)
-            duration = len(self.data) / self.fs if self.fs else 0
-            self.set_ticks(duration, len(self.data))
+            self.history.push_view(self.renderer.get_view())
+            self.renderer.set_view(0, len(self.data))
             self.clear_selection()
 
     def zoom_into_selected(self):
         """Zoom into the selected region in the plot."""
         if self.selected_region:
             xmin, xmax = self.selected_region
-            self.undo_stack.append((np.copy(self.data), self.ax.get_xlim()))
-            self.ax.set_xlim(xmin, xmax)
-            self.set_ticks(None, None, xmin, xmax)
+            self.history.push_view(self.renderer.get_view())
+            self.renderer.set_view(xmin, xmax)
             self.clear_selection()
-            self.canvas.draw_idle()
 
     def crop_selected(self):
         """Crop the audio data so that only the selected region remains."""
         if self.selected_region:
             xmin, xmax = self.selected_region
-            self.undo_stack.append((np.copy(self.data), self.ax.get_xlim()))
-            self.data = self.data[int(xmin):int(xmax)]
+            previous = self.data
+            self.data = previous.crop(int(xmin), int(xmax))
+            self.history.push_state(previous, self.renderer.get_view())
             self.clear_selection()
             self.update_plot(self.data, self.fs, self.audio)
 
@@ -261,40 +238,63 @@ class PlotWidget(QWidget):
         """Crop the audio data so that only the unselected region remains."""
         if self.selected_region:
             xmin, xmax = self.selected_region
-            self.undo_stack.append((np.copy(self.data), self.ax.get_xlim()))
-            self.data = np.concatenate((self.data[:int(xmin)], self.data[int(xmax):]))
+            previous = self.data
+            self.data = previous.cut(int(xmin), int(xmax))
+            self.history.push_state(previous, self.renderer.get_view())
             self.clear_selection()
             self.update_plot(self.data, self.fs, self.audio)
 
-    def push_state(self, data):
-        """Push current data + view limits onto undo stack."""
-        current_view = self.ax.get_xlim()
-        self.undo_stack.append((np.copy(data), current_view))
-        self.redo_stack.clear()
+    def apply_effect(self, effect):
+        """Add an effect node on top of the current edit list (undoable)."""
+        if self.data is None:
+            return
+        previous = self.data
+        self.data = previous.apply(effect)
+        self.history.push_state(previous, self.renderer.get_view())
+        self.clear_selection()
+        self.update_plot(self.data, self.fs, self.audio)
+
+    def set_edit(self, data):
+        """Show `data`, an edit derived from the current one, as a new undoable state."""
+        if self.data is None:
+            return
+        previous = self.data
+        self.data = data
+        self.history.push_state(previous, self.renderer.get_view())
+        self.clear_selection()
+        self.update_plot(self.data, self.fs, self.audio)
+
+    def replace_step(self, index, effect=None):
+        """
+        Replace the effect of node `index` of the edit graph (or remove it when
+        `effect` is None), rebuilding only the nodes after it (undoable).
+        """
+        if self.data is None:
+            return
+        previous = self.data
+        self.data = previous.replace_node(index, effect)
+        self.history.push_state(previous, self.renderer.get_view())
+        self.clear_selection()
+        self.update_plot(self.data, self.fs, self.audio)
 
     def undo_last_action(self):
-        """Undo the last action by popping from the undo stack and pushing current to redo stack."""
-        if self.undo_stack:
-            try:
-                last_state, last_view = self.undo_stack.pop()
-                self.redo_stack.append((np.copy(self.data), self.ax.get_xlim()))
-                self.data = last_state
-                self.ax.set_xlim(last_view)
-                self.update_plot(self.data, self.fs, self.audio)
-                self.canvas.draw_idle()
-            except ValueError as e:
-                logging.error(f"Failed to unpack undo stack: {e}")
+        """Undo the last action, making it available to redo."""
+        restored = self.history.undo(self.data, self.renderer.get_view())
+        if restored:
+            self.restore(*restored)
 
     def redo_last_action(self):
-        """Redo the last undone action by popping from the redo stack."""
-        if self.redo_stack:
-            next_state, next_view = self.redo_stack.pop()
-            self.undo_stack.append((np.copy(self.data), self.ax.get_xlim()))
-            self.data = next_state
-            self.update_plot(self.data, self.fs, self.audio)
-            self.clear_selection()
-            self.ax.set_xlim(next_view)
-            self.canvas.draw_idle()
+        """Redo the last undone action."""
+        restored = self.history.redo(self.data, self.renderer.get_view())
+        if restored:
+            self.restore(*restored)
+
+    def restore(self, data, view):
+        """Show a state coming from the edit history."""
+        self.data = data
+        self.update_plot(self.data, self.fs, self.audio)
+        self.clear_selection()
+        self.renderer.set_view(*view)
 
     def save_plot(self):
         """Save the waveform plot to an image file."""
@@ -304,13 +304,13 @@ class PlotWidget(QWidget):
             "Images (*.png)"
         )
         if file_path:
-            self.figure.savefig(file_path, facecolor='black')
+            self.renderer.save_image(file_path)
             logging.info(f"Plot saved to {file_path}")
 
     def reset_plot(self):
-        """Reset the plot to the original data (if stored in the stacks)."""
-        if self.undo_stack:
-            stored = self.undo_stack[0]
-            self.data, _ = stored if isinstance(stored, tuple) else (stored, None)
+        """Reset the plot to the data originally loaded (undoable)."""
+        if self.history.original is not None and self.data is not self.history.original:
+            self.history.push_state(self.data, self.renderer.get_view())
+            self.data = self.history.original
             self.clear_selection()
-            self.update_plot(self.data, self.fs, self.audio)
\ No newline at end of file
+            self.update_plot(self.data, self.fs, self.audio)
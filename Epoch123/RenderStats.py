@@ -0,0 +1,74 @@
+import os
+import time
+import logging
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def percentiles(times_ms):
+    """Summarise a list of frame times (ms) as mean / p50 / p90 / p99 / max."""
+    if not len(times_ms):
+        return {}
+    values = np.asarray(times_ms, dtype=float)
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {
+        'count': int(len(values)),
+        'mean': round(float(values.mean()), 3),
+        'p50': round(float(p50), 3),
+        'p90': round(float(p90), 3),
+        'p99': round(float(p99), 3),
+        'max': round(float(values.max()), 3),
+    }
+
+
+class RenderStats:
+    """
+    Keeps a rolling window of frame times per named operation.
+    When enabled (EPOCH123_RENDER_STATS=1), a summary is logged every
+    `log_interval` seconds and renderers may draw the last frame time as an overlay.
+    Recording is a deque append, so it is cheap enough to leave in place.
+    """
+    def __init__(self, window=240, log_interval=5.0, enabled=None):
+        if enabled is None:
+            enabled = os.environ.get('EPOCH123_RENDER_STATS', '') not in ('', '0')
+        self.enabled = enabled
+        self.log_interval = log_interval
+        self.frames = defaultdict(lambda: deque(maxlen=window))
+        self.last = {}
+        self._last_log = time.perf_counter()
+
+    def record(self, name, elapsed_ms):
+        """Record one frame time for `name`."""
+        self.frames[name].append(elapsed_ms)
+        self.last[name] = elapsed_ms
+        if self.enabled and time.perf_counter() - self._last_log >= self.log_interval:
+            self.log_summary()
+
+    @contextmanager
+    def measure(self, name):
+        """Context manager that records the time spent in its body."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def summary(self):
+        """Return {name: percentiles} for the current window."""
+        return {name: percentiles(list(times)) for name, times in self.frames.items()}
+
+    def log_summary(self):
+        self._last_log = time.perf_counter()
+        for name, stats in sorted(self.summary().items()):
+            logger.info(
+                f"{name}: p50 {stats['p50']:.2f} ms, p90 {stats['p90']:.2f} ms, "
+                f"max {stats['max']:.2f} ms over {stats['count']} frames"
+            )
+
+
+# Shared instance used by the renderers
+render_stats = RenderStats()
@@ -0,0 +1,67 @@
+from fractions import Fraction
+from functools import lru_cache
+
+import numpy as np
+import scipy.signal as sig
+
+# Input samples resampled at a time for a whole signal
+CHUNK = 1 << 17
+
+# Half the anti-aliasing filter, in samples of the faster of the two rates (resample_poly's default)
+HALF_TAPS = 10
+
+
+def rate_ratio(fs, rate):
+    """(up, down): the smallest integers with rate / fs = up / down."""
+    ratio = Fraction(int(rate), int(fs))
+    return ratio.numerator, ratio.denominator
+
+
+@lru_cache(maxsize=32)
+def resample_filter(up, down):
+    """
+    The Kaiser-windowed anti-aliasing filter resample_poly designs for
+    up/down, built once per ratio and shared by every conversion at it.
+    """
+    taps = sig.firwin(2 * HALF_TAPS * max(up, down) + 1, 1 / max(up, down), window=('kaiser', 5.0))
+    taps.setflags(write=False)
+    return taps
+
+
+def resample_margin(up, down):
+    """Input samples spanned by half the filter, rounded up to whole `down` steps."""
+    half = HALF_TAPS * max(up, down) // up + 1
+    return down * -(-half // down)
+
+
+def resample_range(read, length, up, down, start, stop):
+    """
+    Frames [start, stop) of the signal `read(a, b)` (`length` frames long)
+    resampled by up/down. The input is read with enough context, aligned to
+    `down`, that any range joins exactly with its neighbours and equals the
+    same range of the whole signal resampled at once.
+    """
+    first = (start // up) * down                      # input frame where output frame (start // up) * up lies
+    last = min(-(-stop // up) * down, length)
+    margin = resample_margin(up, down)
+    low, high = max(0, first - margin), min(length, last + margin)
+    block = sig.resample_poly(read(low, high), up, down, axis=0, window=resample_filter(up, down))
+    offset = (first - low) * up // down + start - (start // up) * up
+    return block[offset:offset + stop - start].astype(np.float32, copy=False)
+
+
+def resample(data, up, down, chunk=CHUNK):
+    """
+    resample_poly along the first axis, in chunks with enough context on
+    each side that they join exactly as if the whole signal were resampled.
+    """
+    if up == down:
+        return data
+    length = len(data)
+    out_length = -(-length * up // down)
+    step = up * max(1, chunk * up // down // up)
+    out = np.empty((out_length,) + data.shape[1:], dtype=np.float32)
+    for start in range(0, out_length, step):
+        stop = min(start + step, out_length)
+        out[start:stop] = resample_range(lambda a, b: data[a:b], length, up, down, start, stop)
+    return out
@@ -0,0 +1,215 @@
+import io
+import os
+
+import numpy as np
+import soundfile as sf
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Analysis frame and hop, in seconds
+FRAME_SECONDS = 0.02
+HOP_SECONDS = 0.01
+
+# Frames quieter than this (dBFS RMS) are silent
+THRESHOLD_DB = -50.0
+# Shortest gap that separates two sounds, silence kept around each sound,
+# and shortest sound kept, in seconds
+MIN_SILENCE = 0.3
+PADDING = 0.05
+MIN_SOUND = 0.05
+
+# Frames read from disk at a time when scanning a file
+READ_BLOCK = 1 << 16
+
+
+class SilenceDetector:
+    """
+    Streaming silence detector: feed blocks of samples to process() and
+    call flush() at the end; both return the (start, stop) sample ranges of
+    the sounds completed so far. Frame RMS is computed on strided views of
+    the signal's energy, whole blocks at a time, and only the samples of one
+    partial frame are carried between blocks, so any length of recording is
+    analysed in a single pass with constant memory.
+    """
+    def __init__(self, fs, threshold_db=THRESHOLD_DB, min_silence=MIN_SILENCE,
+                 padding=PADDING, min_sound=MIN_SOUND):
+        self.frame = max(1, int(FRAME_SECONDS * fs))
+        self.hop = max(1, int(HOP_SECONDS * fs))
+        # Compared with the mean energy of a frame, which saves the square root
+        self.threshold = 10 ** (threshold_db / 10)
+        self.min_gap = int(min_silence * fs)
+        self.padding = int(padding * fs)
+        self.min_sound = int(min_sound * fs)
+
+        self._energy = np.zeros(0, dtype=np.float32)   # samples not covered by a whole frame yet
+        self._offset = 0                               # sample index of _energy[0]
+        self._length = 0                               # samples fed so far
+        self._start = None                             # current sound, while it lasts
+        self._end = None
+
+    def process(self, block):
+        """Analyse a block of frames (or frames x channels); returns the sounds that ended in it."""
+        block = np.asarray(block, dtype=np.float32)
+        energy = np.square(block) if block.ndim == 1 else np.square(block).mean(axis=1)
+        self._length += len(block)
+        energy = np.concatenate((self._energy, energy))
+        count = (len(energy) - self.frame) // self.hop + 1 if len(energy) >= self.frame else 0
+        if count <= 0:
+            self._energy = energy
+            return []
+
+        frames = sliding_window_view(energy, self.frame)[::self.hop][:count]
+        loud = np.flatnonzero(frames.mean(axis=1) > self.threshold)
+        starts = self._offset + loud * self.hop
+        consumed = count * self.hop
+        self._energy = energy[consumed:]
+        self._offset += consumed
+
+        sounds = self._add(starts)
+        # A sound is over once a whole gap of silence has followed it
+        if self._start is not None and self._offset - self._end >= self.min_gap:
+            sounds.append(self._close())
+        return self._finish(sounds)
+
+    def flush(self):
+        """Analyse the last partial frame; returns the sounds not returned yet."""
+        sounds = []
+        if len(self._energy) and self._energy.mean() > self.threshold:
+            sounds = self._add(np.array([self._offset]))
+        self._energy = self._energy[:0]
+        if self._start is not None:
+            sounds.append(self._close())
+        return self._finish(sounds)
+
+    def _add(self, starts):
+        """Extend or start sounds with the loud frames beginning at `starts`."""
+        sounds = []
+        if not len(starts):
+            return sounds
+        if self._start is not None and starts[0] - self._end >= self.min_gap:
+            sounds.append(self._close())
+        if self._start is None:
+            self._start = int(starts[0])
+        # Loud frames separated by a long enough silence belong to different sounds
+        for index in np.flatnonzero(starts[1:] - starts[:-1] - self.frame >= self.min_gap) + 1:
+            sounds.append((self._start, int(starts[index - 1]) + self.frame))
+            self._start = int(starts[index])
+        self._end = int(starts[-1]) + self.frame
+        return sounds
+
+    def _close(self):
+        sound = (self._start, self._end)
+        self._start = self._end = None
+        return sound
+
+    def _finish(self, sounds):
+        """Drop blips and add the padding, within the samples fed."""
+        return [(max(0, start - self.padding), min(stop + self.padding, self._length))
+                for start, stop in sounds if stop - start >= self.min_sound]
+
+
+def find_sounds(blocks, fs, **kwargs):
+    """(start, stop) sample ranges of the sounds in an iterable of blocks (see SilenceDetector)."""
+    detector = SilenceDetector(fs, **kwargs)
+    sounds = []
+    for block in blocks:
+        sounds.extend(detector.process(block))
+    sounds.extend(detector.flush())
+    return sounds
+
+
+def relative_threshold(edit, db):
+    """Threshold `db` below the peak of an edit list, in dBFS (None for a silent edit list)."""
+    peak = edit.peak()
+    return 20 * np.log10(peak) + db if peak > 0 else None
+
+
+def detect(edit, db, **kwargs):
+    """Sounds of an edit list, louder than `db` relative to its peak, rendered block by block."""
+    threshold_db = relative_threshold(edit, db)
+    if threshold_db is None:
+        return []
+    return find_sounds(edit.blocks(), edit.fs, threshold_db=threshold_db, **kwargs)
+
+
+def trim_silence(edit, db, **kwargs):
+    """The edit list without its leading and trailing silence (empty if it is all silent)."""
+    sounds = detect(edit, db, **kwargs)
+    if not sounds:
+        return edit.crop(0, 0)
+    return edit.crop(sounds[0][0], sounds[-1][1])
+
+
+def remove_silence(edit, db, **kwargs):
+    """The sounds of the edit list, played back to back without the gaps between them."""
+    return edit.keep(detect(edit, db, **kwargs))
+
+
+def scan_file(path, blocksize=READ_BLOCK, **kwargs):
+    """
+    Sounds of the file at `path` (louder than `threshold_db` dBFS), read and
+    analysed block by block. Returns (sounds, frames, samplerate).
+    """
+    with sf.SoundFile(path) as f:
+        detector = SilenceDetector(f.samplerate, **kwargs)
+        sounds = []
+        for block in f.blocks(blocksize, dtype='float32', always_2d=True):
+            sounds.extend(detector.process(block))
+        sounds.extend(detector.flush())
+        return sounds, f.frames, f.samplerate
+
+
+def clip_path(path, output_dir, number, extension=None):
+    """Path of the `number`th clip cut from `path`: <name>_001<ext> in `output_dir`."""
+    name, original = os.path.splitext(os.path.basename(path))
+    return os.path.join(output_dir, f"{name}_{number:03d}{extension or original}")
+
+
+def writable_subtype(file_format, subtype, samplerate, channels):
+    """
+    `subtype` if libsndfile can write it in `file_format` for this rate and
+    channel count, else the format's default. Files read in an encoding it
+    only decodes (MP3 in WAV, say) are thus written in one it can encode.
+    """
+    if subtype and sf.check_format(file_format, subtype):
+        try:
+            with sf.SoundFile(io.BytesIO(), 'w', samplerate=samplerate, channels=channels,
+                              format=file_format, subtype=subtype):
+                return subtype
+        except (sf.LibsndfileError, RuntimeError):
+            pass
+    return sf.default_subtype(file_format)
+
+
+def split_file(path, output_dir, file_format=None, subtype=None, blocksize=READ_BLOCK, **kwargs):
+    """
+    Cut the file at `path` into one file per sound, in `output_dir`. The
+    recording is scanned once, block by block, and each sound is then
+    copied block by block, so memory does not depend on its length.
+    Returns ([(clip path, start, stop)], samplerate); positions are frames of `path`.
+    """
+    sounds, _, fs = scan_file(path, blocksize, **kwargs)
+    os.makedirs(output_dir, exist_ok=True)
+    clips = []
+    with sf.SoundFile(path) as source:
+        file_format = file_format or source.format
+        if not subtype and file_format == source.format:
+            subtype = writable_subtype(file_format, source.subtype, fs, source.channels)
+        extension = '.' + file_format.lower() if file_format != source.format else None
+        for number, (start, stop) in enumerate(sounds, 1):
+            out_path = clip_path(path, output_dir, number, extension)
+            partial = out_path + '.part'
+            options = {'format': file_format}
+            if subtype:
+                options['subtype'] = subtype
+            source.seek(start)
+            with sf.SoundFile(partial, 'w', samplerate=fs, channels=source.channels, **options) as out:
+                remaining = stop - start
+                while remaining > 0:
+                    block = source.read(min(blocksize, remaining), dtype='float32', always_2d=True)
+                    if not len(block):
+                        break
+                    out.write(block)
+                    remaining -= len(block)
+            os.replace(partial, out_path)
+            clips.append((out_path, start, stop))
+    return clips, fs
@@ -1,13 +1,39 @@
-from PySide6.QtWidgets import QFrame, QVBoxLayout, QHBoxLayout, QMessageBox
-from PySide6.QtCore import Qt
+from PySide6.QtWidgets import QFrame, QVBoxLayout, QHBoxLayout, QMessageBox, QListWidget, QListWidgetItem, QInputDialog
+from PySide6.QtCore import Qt, QThreadPool
 import numpy as np
-import scipy.signal as sig
-from numpy.fft import fft, ifft
-import soundfile as sf
+import logging
+import os
 
 from GUIElements import Button, LineEdit, GuiWidget, CustomComboBox, Slider
 from PlotWidget import PlotWidget
 from AudioManager import AudioControlWidget
+from EditList import Filter, PitchShift, TimeStretch, Gate, Gain, Downmix, EffectNode
+from StreamingDSP import FILTER_TYPES, ORDER_RANGE, StreamFilter
+from Silence import detect, trim_silence, remove_silence, clip_path
+from BatchProcessor import file_row
+from AudioSaver import SAVE_FORMATS, SaveJob, save_target
+
+# Range of the cutoff slider in Hz (the slider is logarithmic)
+CUTOFF_RANGE = (20.0, 20000.0)
+
+# Editable parameter of each effect step: (label, read it from the effect, build an effect with a new value)
+STEP_PARAMETERS = {
+    Filter: ("Cutoff (Hz)",
+             lambda e: e.cutoff,
+             lambda e, v: Filter(e.name, v, e.fs, e.order, e.zero_phase, e.bandwidth)),
+    PitchShift: ("Pitch Shift (Semitones)",
+                 lambda e: 12 * np.log2(e.factor),
+                 lambda e, v: PitchShift(2 ** (v / 12))),
+    TimeStretch: ("Tempo (%)",
+                  lambda e: e.rate * 100,
+                  lambda e, v: TimeStretch(v / 100)),
+    Gain: ("Gain (dB)",
+           lambda e: 20 * np.log10(max(e.gain, 1e-10)),
+           lambda e, v: Gain(10 ** (v / 20))),
+    Gate: ("Threshold",
+           lambda e: e.threshold,
+           lambda e, v: Gate(v)),
+}
 
 class SoundEditor(QFrame):
     """
@@ -21,6 +47,13 @@ class SoundEditor(QFrame):
         self.audio_file = None
         self.sample_rate = None
         self.audio = None  # pydub AudioSegment
+        self.filter_name = None
+        self.cutoff = 1000.0
+        self.order = 4
+        self.zero_phase = True
+        self.preview_filter = None
+        self.save_format = "Same as File"
+        self.save_job = None
 
         self.setStyleSheet("background-color: #111111; color: white;")
         layout = QVBoxLayout(self)
@@ -28,6 +61,7 @@ class SoundEditor(QFrame):
 
         # Plot and nav buttons
         self.plot_widget = PlotWidget(audio_player=self.audio_player, parent=self)
+        self.plot_widget.data_changed.connect(self.on_plot_data_changed)
         self.set_nav_buttons(layout)
         layout.addWidget(self.plot_widget)
 
@@ -43,27 +77,105 @@ class SoundEditor(QFrame):
         self.sample_rate = sample_rate
         self.audio = audio
 
+    def on_plot_data_changed(self, data):
+        """Keep the editor's edit list in sync with edits, undo and redo done in the plot."""
+        self.audio_data = data
+        self.refresh_steps()
+
+    def refresh_steps(self):
+        """List the effect steps of the current edit graph, oldest first."""
+        self.steps_list.clear()
+        if self.audio_data is None:
+            return
+        for index, node in enumerate(self.audio_data.nodes()):
+            if isinstance(node, EffectNode) and not isinstance(node.effect, Downmix):
+                item = QListWidgetItem(node.effect.describe())
+                item.setData(Qt.UserRole, index)
+                self.steps_list.addItem(item)
+
+    def selected_step(self):
+        """(node index, effect) of the selected step, or None."""
+        item = self.steps_list.currentItem()
+        if item is None:
+            return None
+        index = item.data(Qt.UserRole)
+        return index, self.audio_data.nodes()[index].effect
+
+    def edit_step(self):
+        """
+        Change the main parameter of the selected step. Steps before it keep
+        their cached output, so only it and the steps after it are recomputed.
+        """
+        selected = self.selected_step()
+        if selected is None:
+            return
+        index, effect = selected
+        if type(effect) not in STEP_PARAMETERS:
+            QMessageBox.information(self, "Edit Step", f"{effect.describe()} has no editable parameter.")
+            return
+        label, get, build = STEP_PARAMETERS[type(effect)]
+        value, ok = QInputDialog.getDouble(self, "Edit Step", f"{label}:", float(get(effect)), -1e6, 1e6, 4)
+        if not ok:
+            return
+        try:
+            self.plot_widget.replace_step(index, build(effect, value))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to edit step: {str(e)}")
+
+    def remove_step(self):
+        """Remove the selected step, rebuilding the steps after it."""
+        selected = self.selected_step()
+        if selected is None:
+            return
+        try:
+            self.plot_widget.replace_step(selected[0])
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to remove step: {str(e)}")
+
     def set_nav_buttons(self, layout):
         """Create top navigation row with 'back', 'save', and audio controls."""
         nav_layout = QHBoxLayout()
         nav_layout.addWidget(Button("\u2190", self.parent.show_file_nav_widget, setFixedWidth=75))
-        nav_layout.addWidget(Button("Save", self.save_audio, setFixedWidth=75))
+        self.save_button = Button("Save", self.save_audio, setFixedWidth=75)
+        nav_layout.addWidget(self.save_button)
+        save_format = CustomComboBox(list(SAVE_FORMATS))
+        save_format.set_on_change(lambda index: setattr(self, 'save_format', list(SAVE_FORMATS)[index]))
+        nav_layout.addWidget(save_format)
         nav_layout.addWidget(AudioControlWidget(self.audio_player))
         nav_layout.addWidget(Button("\u23EA", self.audio_player.play_reverse, setFixedWidth=75))
         layout.addLayout(nav_layout)
 
     def set_editor(self):
         """Create interactive elements for filters, pitch shift, trim, volume."""
-        self.create_dropdown("Filter", ["Low Pass", "High Pass", "Band Pass"], self.apply_filter)
+        self.create_dropdown("Filter", ["Off"] + list(FILTER_TYPES), self.on_filter_changed)
+        cutoff_slider = self.create_slider("Cutoff", 0, 1000, 10, self.on_cutoff_changed, 200)
+        cutoff_slider.setValue(self.cutoff_to_slider(self.cutoff))
+        order_slider = self.create_slider("Order", *ORDER_RANGE, 1, self.on_order_changed, 200)
+        order_slider.setValue(self.order)
+        self.create_dropdown("Phase", ["Zero Phase", "Causal"], self.on_phase_changed)
+        self.editor_layout.addWidget(Button("Apply Filter", self.apply_filter, setFixedWidth=120))
         self.create_input("Pitch Shift (Semitones):", "0", self.change_pitch, 200)
-        self.create_input("Trim Level (dB):", "0.0", self.trim_audio, 200)
+        self.create_input("Tempo (%):", "100", self.change_tempo, 200)
+        self.create_input("Trim Level (dB):", "-40", self.trim_audio, 200)
+        self.create_input("Remove Gaps (dB):", "-40", self.remove_gaps, 200)
+        self.create_input("Split Clips (dB):", "-40", self.split_clips, 200)
         self.create_slider("Volume", 0, 100, 1, self.audio_player.set_volume, 200)
 
+        self.steps_list = QListWidget()
+        self.steps_list.setFixedHeight(100)
+        self.steps_list.itemDoubleClicked.connect(lambda item: self.edit_step())
+        self.editor_layout.addWidget(GuiWidget(label_text="Steps:", gui_elements=[self.steps_list]))
+        steps_layout = QHBoxLayout()
+        steps_layout.addWidget(Button("Edit Step", self.edit_step, setFixedWidth=120))
+        steps_layout.addWidget(Button("Remove Step", self.remove_step, setFixedWidth=120))
+        self.editor_layout.addLayout(steps_layout)
+
     def create_dropdown(self, label, items, callback):
         dropdown = CustomComboBox(items)
         dropdown.set_on_change(callback)
         layout = GuiWidget(label_text=f"{label}:", gui_elements=[dropdown])
         self.editor_layout.addWidget(layout)
+        return dropdown
 
     def create_input(self, label, placeholder, action, width):
         input_field = LineEdit(placeholder=placeholder, setFixedWidth=50)
@@ -76,97 +188,173 @@ class SoundEditor(QFrame):
         slider.valueChanged.connect(callback)
         layout = GuiWidget(label_text=f"{label}:", gui_elements=[slider], setFixedWidth=width)
         self.editor_layout.addWidget(layout)
+        return slider
+
+    @staticmethod
+    def cutoff_to_slider(cutoff):
+        low, high = CUTOFF_RANGE
+        return int(round(np.log(cutoff / low) / np.log(high / low) * 1000))
+
+    @staticmethod
+    def slider_to_cutoff(value):
+        low, high = CUTOFF_RANGE
+        return low * (high / low) ** (value / 1000)
+
+    def on_filter_changed(self, index):
+        """Preview the chosen filter type live (index 0 turns the preview off)."""
+        self.filter_name = list(FILTER_TYPES)[index - 1] if index > 0 else None
+        self.update_preview()
+
+    def on_cutoff_changed(self, value):
+        self.cutoff = self.slider_to_cutoff(value)
+        self.update_preview()
+
+    def on_order_changed(self, value):
+        self.order = value
+        self.update_preview()
+
+    def on_phase_changed(self, index):
+        """Zero phase (index 0) or causal filtering when the filter is applied; the preview is always causal."""
+        self.zero_phase = index == 0
+
+    def update_preview(self):
+        """
+        Point the playback preview at the current filter settings. Only the
+        streaming filter's coefficients change, so it is heard within one block.
+        """
+        if self.filter_name is None:
+            self.preview_filter = None
+            self.audio_player.set_preview([])
+        elif self.preview_filter is None:
+            self.preview_filter = StreamFilter(self.filter_name, self.cutoff, self.order)
+            self.audio_player.set_preview([self.preview_filter])
+        else:
+            self.preview_filter.set(self.filter_name, self.cutoff, self.order)
 
-    def apply_filter(self, index):
-        """Apply a simple Butterworth filter to the current audio data."""
-        filter_options = ["Low Pass", "High Pass", "Band Pass"]
-        if not self.audio_data is not None or len(self.audio_data) == 0:
+    def apply_filter(self):
+        """Commit the previewed filter as a full-quality filter node (zero phase unless Causal is chosen)."""
+        if self.audio_data is None or len(self.audio_data) == 0:
             QMessageBox.critical(self, "Error", "Audio data is empty.")
             return
-        if 0 <= index < len(filter_options):
-            selected_filter = filter_options[index]
-            try:
-                if self.audio_data.ndim > 1:
-                    self.audio_data = np.mean(self.audio_data, axis=1)
-
-                # Map filter name to Butterworth design
-                filter_map = {
-                    "Low Pass": sig.butter(4, 0.1),
-                    "High Pass": sig.butter(4, 0.1, btype='high'),
-                    "Band Pass": sig.butter(4, [0.05, 0.15], btype='band')
-                }
-                if selected_filter not in filter_map:
-                    QMessageBox.critical(self, "Filter Error", "Unknown filter type.")
-                    return
-                b, a = filter_map[selected_filter]
-
-                # Push current state to undo stack
-                self.plot_widget.undo_stack.append((np.copy(self.audio_data), self.plot_widget.ax.get_xlim()))
-
-                self.audio_data = sig.filtfilt(b, a, self.audio_data)
-                self.audio_player.set_audio_data(self.audio_data, self.sample_rate)
-                self.plot_widget.update_plot(self.audio_data, self.sample_rate, self.audio)
-                QMessageBox.information(self, "Filter Applied", f"{selected_filter} filter applied successfully!")
-            except Exception as e:
-                QMessageBox.critical(self, "Filter Application Error", f"Failed to apply {selected_filter} filter: {str(e)}")
-        else:
-            QMessageBox.critical(self, "Filter Error", "Index out of range.")
+        if self.filter_name is None:
+            QMessageBox.critical(self, "Filter Error", "Choose a filter type first.")
+            return
+        try:
+            self.plot_widget.apply_effect(Filter(self.filter_name, self.cutoff, self.sample_rate,
+                                                 self.order, self.zero_phase))
+            # The committed filter is now part of the data; stop previewing it on top
+            self.audio_player.set_preview([])
+            self.preview_filter = None
+            logging.info(f"{self.filter_name} filter (order {self.order}) at {self.cutoff:.0f} Hz applied")
+        except Exception as e:
+            QMessageBox.critical(self, "Filter Application Error", f"Failed to apply {self.filter_name} filter: {str(e)}")
 
     def change_pitch(self, semitones):
-        """Change pitch by shifting FFT bins."""
-        if not self.audio_data is not None or len(self.audio_data) == 0:
+        """Add a pitch shift node to the current edit list."""
+        if self.audio_data is None or len(self.audio_data) == 0:
             QMessageBox.critical(self, "Error", "No audio data to process.")
             return
         try:
-            factor = 2 ** (semitones / 12)
-            self.plot_widget.undo_stack.append((np.copy(self.audio_data), self.plot_widget.ax.get_xlim()))
-            self.audio_data = self.fft_pitch_shift(self.audio_data, factor)
-
-            self.audio_player.set_audio_data(self.audio_data, self.sample_rate)
-            self.plot_widget.update_plot(self.audio_data, self.sample_rate, self.audio)
+            self.plot_widget.apply_effect(PitchShift(2 ** (semitones / 12)))
             QMessageBox.information(self, "Pitch Shift", "Pitch changed successfully!")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to change pitch: {str(e)}")
 
-    def fft_pitch_shift(self, data, factor):
-        """Shift pitch by factoring index in FFT domain."""
-        fft_spectrum = fft(data)
-        new_fft_spectrum = np.zeros_like(fft_spectrum)
-        N = len(fft_spectrum)
-        new_indices = (np.arange(N) * factor).astype(int)
-        valid = (new_indices < N)
-        new_fft_spectrum[new_indices[valid]] = fft_spectrum[valid]
-        return ifft(new_fft_spectrum).real
+    def change_tempo(self, percent):
+        """Add a time stretch node that plays the audio at `percent` of its tempo, keeping the pitch."""
+        if self.audio_data is None or len(self.audio_data) == 0:
+            QMessageBox.critical(self, "Error", "No audio data to process.")
+            return
+        try:
+            self.plot_widget.apply_effect(TimeStretch(percent / 100))
+            QMessageBox.information(self, "Tempo", "Tempo changed successfully!")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to change tempo: {str(e)}")
 
     def trim_audio(self, decibel_level):
         """
-        Zero out samples below a threshold derived from decibel_level 
-        relative to the maximum amplitude.
+        Cut the leading and trailing silence: everything before the first and
+        after the last frame louder than decibel_level relative to the peak.
         """
-        if not self.audio_data is not None or len(self.audio_data) == 0:
+        if self.audio_data is None or len(self.audio_data) == 0:
             QMessageBox.critical(self, "Error", "No audio data to process.")
             return
-        ref_level = np.max(np.abs(self.audio_data))
-        if ref_level == 0:
+        trimmed = trim_silence(self.audio_data, decibel_level)
+        if len(trimmed) == 0:
+            QMessageBox.critical(self, "Trim Audio", "The audio is silent at this level.")
             return
+        removed = (len(self.audio_data) - len(trimmed)) / self.sample_rate
+        self.plot_widget.set_edit(trimmed)
+        QMessageBox.information(self, "Trim Audio", f"Trimmed {removed:.2f} seconds of silence.")
 
-        threshold = ref_level * (10 ** (decibel_level / 20.0))
-        self.plot_widget.undo_stack.append((np.copy(self.audio_data), self.plot_widget.ax.get_xlim()))
-        self.audio_data = np.where(np.abs(self.audio_data) < threshold, 0, self.audio_data)
+    def remove_gaps(self, decibel_level):
+        """Remove the silent gaps too, keeping only the sounds, back to back."""
+        if self.audio_data is None or len(self.audio_data) == 0:
+            QMessageBox.critical(self, "Error", "No audio data to process.")
+            return
+        kept = remove_silence(self.audio_data, decibel_level)
+        if len(kept) == 0:
+            QMessageBox.critical(self, "Remove Gaps", "The audio is silent at this level.")
+            return
+        self.plot_widget.set_edit(kept)
 
-        self.audio_player.set_audio_data(self.audio_data, self.sample_rate)
-        self.plot_widget.update_plot(self.audio_data, self.sample_rate, self.audio)
-        QMessageBox.information(self, "Trim Audio", f"Audio trimmed at {decibel_level} dB successfully!")
+    def split_clips(self, decibel_level):
+        """
+        Save each sound (separated by silence below decibel_level relative to
+        the peak) as its own file in a "<name>_clips" folder next to the file,
+        register the clips and store where they were cut in the database.
+        """
+        if self.audio_data is None or len(self.audio_data) == 0 or not self.audio_file:
+            QMessageBox.critical(self, "Error", "No audio data to process.")
+            return
+        try:
+            sounds = detect(self.audio_data, decibel_level)
+            folder = os.path.splitext(self.audio_file)[0] + "_clips"
+            segments = []
+            for number, (start, stop) in enumerate(sounds, 1):
+                path = clip_path(self.audio_file, folder, number)
+                os.makedirs(folder, exist_ok=True)
+                self.audio_data.crop(start, stop).export(path, self.sample_rate)
+                segments.append((start / self.sample_rate, stop / self.sample_rate, path))
+            metadata_db = self.parent.metaDataDB
+            metadata_db.insert_many(file_row(path) for _, _, path in segments)
+            metadata_db.set_segments(self.audio_file, segments)
+            QMessageBox.information(self, "Split Clips", f"Saved {len(segments)} clips to {folder}")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to split the audio: {str(e)}")
 
     def save_audio(self):
         """
-        Save the modified audio data back to the file with the same sample rate.
+        Save the edited audio in the background: it is rendered block by block
+        to a temporary file that replaces the original only once it is
+        complete. Saving in another format writes a new file next to it.
         """
-        if not self.audio_file:
+        if not self.audio_file or self.audio_data is None:
             QMessageBox.critical(self, "Error", "No audio file specified.")
             return
+        if self.save_job is not None:
+            QMessageBox.information(self, "Save Audio", "The previous save is still running.")
+            return
         try:
-            sf.write(self.audio_file, self.audio_data, self.sample_rate)
-            QMessageBox.information(self, "Save Audio", "Audio saved successfully!")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to save audio: {str(e)}")
\ No newline at end of file
+            path, file_format, subtype = save_target(self.audio_file, *SAVE_FORMATS[self.save_format])
+        except ValueError as e:
+            QMessageBox.critical(self, "Error", str(e))
+            return
+        self.save_job = SaveJob(self.audio_data, path, self.sample_rate, file_format, subtype,
+                                self.parent.metaDataDB, self.parent.peak_cache)
+        self.save_job.signals.progress.connect(lambda percent: self.save_button.setText(f"{percent}%"))
+        self.save_job.signals.finished.connect(self.on_save_finished)
+        self.save_job.signals.error.connect(self.on_save_error)
+        QThreadPool.globalInstance().start(self.save_job)
+
+    def on_save_finished(self, path):
+        self.save_job = None
+        self.save_button.setText("Save")
+        logging.info(f"Audio saved to {path}")
+        self.parent.file_navigator.on_file_saved(path)
+        QMessageBox.information(self, "Save Audio", f"Audio saved to {os.path.basename(path)}")
+
+    def on_save_error(self, message):
+        self.save_job = None
+        self.save_button.setText("Save")
+        QMessageBox.critical(self, "Error", f"Failed to save audio: {message}")
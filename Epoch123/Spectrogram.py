@@ -0,0 +1,227 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.fft
+import scipy.signal as sig
+from matplotlib import colormaps
+from PySide6.QtCore import QObject, QRectF, Signal
+from PySide6.QtGui import QImage, QPainter, QPixmap, QPen, QFont
+
+from WaveformRenderer import QtWaveformRenderer, display_samples
+
+logger = logging.getLogger(__name__)
+
+
+def colormap_lut(name='magma'):
+    """Return a 256-entry ARGB32 lookup table for a matplotlib colormap."""
+    rgba = (colormaps[name](np.linspace(0, 1, 256)) * 255).astype(np.uint32)
+    return (0xFF << 24) | (rgba[:, 0] << 16) | (rgba[:, 1] << 8) | rgba[:, 2]
+
+
+class SpectrogramTiler(QObject):
+    """
+    Computes a spectrogram as fixed-size tiles of STFT frames.
+    Zoom level L uses a hop of BASE_HOP * 2**L samples, so one tile always
+    holds TILE_FRAMES columns whatever the zoom. Tiles are computed in
+    vectorized batches on a thread pool and kept in an LRU per (level, index).
+    Signals:
+      - tile_ready(level: int, index: int)
+    """
+    tile_ready = Signal(int, int)
+
+    NFFT = 1024
+    BASE_HOP = 256
+    TILE_FRAMES = 256
+    MAX_TILES = 128
+    DB_RANGE = (-100.0, 0.0)
+
+    def __init__(self, samples, fs, workers=None, parent=None):
+        super().__init__(parent)
+        self.samples = samples
+        self.fs = fs
+        self.window = sig.get_window('hann', self.NFFT).astype(np.float32)
+        self.scale = 2.0 / self.window.sum()
+        self.lut = colormap_lut()
+
+        self.tiles = OrderedDict()
+        self.pending = set()
+        self._lock = threading.Lock()
+        self.closed = False
+        self.executor = ThreadPoolExecutor(max_workers=workers or max(1, (os.cpu_count() or 2) - 1))
+
+        frames = max(1, len(samples) // self.BASE_HOP)
+        self.max_level = max(0, int(np.ceil(np.log2(max(frames / self.TILE_FRAMES, 1)))))
+
+    def hop(self, level):
+        return self.BASE_HOP << level
+
+    def tile_span(self, level):
+        """Number of samples covered by one tile at this level."""
+        return self.TILE_FRAMES * self.hop(level)
+
+    def level_for(self, samples_per_pixel):
+        """Pick the level whose hop is closest to one frame per pixel."""
+        level = int(np.floor(np.log2(max(samples_per_pixel / self.BASE_HOP, 1))))
+        return min(level, self.max_level)
+
+    def get(self, level, index):
+        """Return the cached tile image or None."""
+        with self._lock:
+            key = (level, index)
+            if key in self.tiles:
+                self.tiles.move_to_end(key)
+                return self.tiles[key]
+        return None
+
+    def request(self, level, index):
+        """Schedule a tile for computation unless it is cached or already queued."""
+        key = (level, index)
+        with self._lock:
+            if self.closed or key in self.tiles or key in self.pending:
+                return
+            self.pending.add(key)
+        self.executor.submit(self._compute, level, index)
+
+    def compute_tile(self, level, index):
+        """
+        Return the tile as a (bins, TILE_FRAMES) uint8 array of dB values, low
+        frequencies last (ready to be drawn top-down).
+        """
+        hop = self.hop(level)
+        start = index * self.tile_span(level)
+        needed = (self.TILE_FRAMES - 1) * hop + self.NFFT
+        segment = self.samples[start:start + needed]
+        if len(segment) < needed:
+            segment = np.pad(segment, (0, needed - len(segment)))
+
+        frames = np.lib.stride_tricks.sliding_window_view(segment, self.NFFT)[::hop]
+        spectrum = np.abs(scipy.fft.rfft(frames * self.window, axis=1)) * self.scale
+        db = 20 * np.log10(spectrum + 1e-10)
+        low, high = self.DB_RANGE
+        levels = np.clip((db - low) / (high - low) * 255, 0, 255).astype(np.uint8)
+        return levels.T[::-1]
+
+    def _compute(self, level, index):
+        try:
+            levels = self.compute_tile(level, index)
+            pixels = np.ascontiguousarray(self.lut[levels])
+            height, width = pixels.shape
+            image = QImage(pixels.data, width, height, 4 * width, QImage.Format_ARGB32).copy()
+        except Exception as e:
+            logger.error(f"Failed to compute spectrogram tile {level}/{index}: {e}")
+            with self._lock:
+                self.pending.discard((level, index))
+            return
+
+        with self._lock:
+            self.pending.discard((level, index))
+            self.tiles[(level, index)] = image
+            while len(self.tiles) > self.MAX_TILES:
+                self.tiles.popitem(last=False)
+            # Emitted under the lock so shutdown() cannot slip in between the
+            # check and the emit; after it returns, no tile reaches the owner.
+            if not self.closed:
+                self.tile_ready.emit(level, index)
+
+    def shutdown(self):
+        """Stop accepting work, drop queued tiles and stop signalling finished ones."""
+        with self._lock:
+            self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class SpectrogramRenderer(QtWaveformRenderer):
+    """
+    Renders a tiled spectrogram instead of the waveform, with the same
+    selection, cursor, zoom and pan behaviour as QtWaveformRenderer.
+    Tiles missing at the current zoom level are drawn from coarser cached
+    levels until their own computation finishes.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.tiler = None
+
+    def set_data(self, data, fs):
+        if self.tiler:
+            self.tiler.shutdown()
+        self.samples = display_samples(data)
+        self.fs = fs
+        self.view = (0.0, float(max(len(self.samples), 1)))
+        self.position = 0
+        self.selection = None
+        self.tiler = SpectrogramTiler(self.samples, fs, parent=self)
+        self.tiler.tile_ready.connect(self.on_tile_ready)
+        self.invalidate()
+
+    def cleanup(self):
+        if self.tiler:
+            self.tiler.shutdown()
+
+    def on_tile_ready(self, level, index):
+        self.invalidate()
+
+    def render_waveform(self):
+        """Draw visible spectrogram tiles (or coarser stand-ins) into the cache."""
+        ratio = self.devicePixelRatioF()
+        pixmap = QPixmap(self.size() * ratio)
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(self.BACKGROUND)
+
+        painter = QPainter(pixmap)
+        width, height = self.width(), self.height()
+        xmin, xmax = self.view
+
+        if self.tiler and width > 0:
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, False)
+            level = self.tiler.level_for((xmax - xmin) / width)
+            span = self.tiler.tile_span(level)
+            for index in range(int(xmin // span), int(xmax // span) + 1):
+                start = index * span
+                if start >= len(self.samples):
+                    break
+                image = self.tiler.get(level, index)
+                if image is None:
+                    self.tiler.request(level, index)
+                    self.draw_fallback(painter, level, start, start + span)
+                else:
+                    self.draw_tile(painter, image, start, start + span)
+
+        painter.setPen(QPen(self.GRID_COLOR, 0))
+        nyquist = self.fs / 2 if self.fs else 0
+        painter.setFont(QFont(painter.font().family(), 8))
+        for fraction in np.linspace(0, 1, 5)[1:-1]:
+            py = height - fraction * height
+            painter.drawLine(0, int(py), width, int(py))
+            painter.setPen(self.LABEL_COLOR)
+            painter.drawText(4, int(py) - 2, f"{fraction * nyquist / 1000:.1f} kHz")
+            painter.setPen(QPen(self.GRID_COLOR, 0))
+
+        if self.fs:
+            painter.setPen(self.LABEL_COLOR)
+            for x in np.linspace(xmin, xmax, 10)[1:]:
+                painter.drawText(self.x_to_px(x) + 2, height - 4, f"{x / self.fs:.2f}")
+        painter.end()
+        self._cache = pixmap
+
+    def draw_tile(self, painter, image, start, stop, source=None):
+        left, right = self.x_to_px(start), self.x_to_px(stop)
+        target = QRectF(left, 0, right - left, self.height())
+        painter.drawImage(target, image, source or QRectF(image.rect()))
+
+    def draw_fallback(self, painter, level, start, stop):
+        """Draw the part of a coarser cached tile that covers [start, stop)."""
+        for coarse in range(level + 1, self.tiler.max_level + 1):
+            span = self.tiler.tile_span(coarse)
+            image = self.tiler.get(coarse, start // span)
+            if image is None:
+                continue
+            offset = (start % span) / span * image.width()
+            part = (stop - start) / span * image.width()
+            self.draw_tile(painter, image, start, stop, QRectF(offset, 0, part, image.height()))
+            return
+        # Nothing cached yet: make sure the cheap overview tile is on its way
+        self.tiler.request(self.tiler.max_level, start // self.tiler.tile_span(self.tiler.max_level))
@@ -0,0 +1,155 @@
+import numpy as np
+import scipy.signal as sig
+
+# Filter names offered in the SoundEditor, mapped to scipy band types
+FILTER_TYPES = {
+    "Low Pass": 'lowpass',
+    "High Pass": 'highpass',
+    "Band Pass": 'bandpass',
+    "Band Stop": 'bandstop',
+}
+
+# Filter orders offered in the SoundEditor
+ORDER_RANGE = (1, 12)
+
+
+def design_filter(name, cutoff, fs, order=4, bandwidth=1.0):
+    """
+    Butterworth filter in second-order sections. `cutoff` is in Hz; band
+    filters span `bandwidth` octaves centred on it.
+    """
+    if name not in FILTER_TYPES:
+        raise ValueError(f"Unknown filter type: {name}")
+    if not ORDER_RANGE[0] <= order <= ORDER_RANGE[1]:
+        raise ValueError(f"Filter order must be between {ORDER_RANGE[0]} and {ORDER_RANGE[1]}")
+    top = fs / 2 * 0.99
+    if FILTER_TYPES[name] in ('bandpass', 'bandstop'):
+        half = 2 ** (bandwidth / 2)
+        edges = [min(cutoff / half, top / 2), min(cutoff * half, top)]
+    else:
+        edges = min(cutoff, top)
+    return sig.butter(int(order), edges, btype=FILTER_TYPES[name], fs=fs, output='sos')
+
+
+def settle_length(sos, tolerance=1e-7, limit=1 << 20, chunk=4096):
+    """
+    Samples until the impulse response of `sos` has decayed below
+    `tolerance` of its peak (at most `limit`): how much context each side of
+    a chunk needs for the filtered chunk to match filtering the whole signal.
+    """
+    zi = np.zeros((len(sos), 2))
+    impulse = np.zeros(chunk)
+    impulse[0] = 1
+    peak, length = 0.0, 0
+    while length < limit:
+        response, zi = sig.sosfilt(sos, impulse, zi=zi)
+        impulse[0] = 0
+        level = np.abs(response).max()
+        peak = max(peak, level)
+        if length and level < tolerance * peak:
+            break
+        length += chunk
+    return min(length, limit)
+
+
+class StreamEffect:
+    """
+    An effect processed block by block in the playback path, carrying its
+    state from one block to the next. Parameter changes may come from the
+    UI thread at any time; they take effect at the start of the next block.
+    """
+    def process(self, block, fs):
+        """Process one (frames, channels) block and return the result."""
+        raise NotImplementedError
+
+    def reset(self):
+        """Forget the carried state (after a seek)."""
+
+
+class StreamGain(StreamEffect):
+    """Gain, ramped over one block whenever it changes."""
+    def __init__(self, gain=1.0):
+        self.gain = gain
+        self._applied = gain
+
+    def process(self, block, fs):
+        gain = self.gain
+        if gain == self._applied:
+            return block * gain
+        ramp = np.linspace(self._applied, gain, len(block), dtype=np.float32)[:, np.newaxis]
+        self._applied = gain
+        return block * ramp
+
+    def reset(self):
+        self._applied = self.gain
+
+
+class StreamFilter(StreamEffect):
+    """
+    Causal Butterworth filter (sosfilt with its zi carried between blocks).
+    Changing the type, cutoff or order designs a new filter, started from its
+    steady state and crossfaded with the old one over one block, so the
+    change is heard within a buffer period without clicks.
+    """
+    def __init__(self, name, cutoff, order=4):
+        self.settings = (name, cutoff, order)
+        self._fs = None
+        self._sos = None
+        self._designed = None
+        self._zi = None
+
+    def set(self, name, cutoff, order=4):
+        self.settings = (name, cutoff, order)
+
+    def _start(self, sos, block):
+        """Initial state for `sos`, as if the first sample of `block` had always been there."""
+        return sig.sosfilt_zi(sos)[:, :, np.newaxis] * block[0]
+
+    def process(self, block, fs):
+        if not len(block):
+            return block
+        settings, fading = self.settings, None
+        if self._sos is None or fs != self._fs or settings != self._designed:
+            if self._sos is not None and self._zi is not None and fs == self._fs:
+                fading = (self._sos, self._zi)
+            name, cutoff, order = settings
+            self._sos = design_filter(name, cutoff, fs, order)
+            self._designed = settings
+            self._fs = fs
+            self._zi = None
+        if self._zi is None:
+            self._zi = self._start(self._sos, block)
+
+        out, self._zi = sig.sosfilt(self._sos, block, axis=0, zi=self._zi)
+        if fading is not None:
+            old, _ = sig.sosfilt(fading[0], block, axis=0, zi=fading[1])
+            ramp = np.linspace(0, 1, len(block))[:, np.newaxis]
+            out = old * (1 - ramp) + out * ramp
+        return out
+
+    def reset(self):
+        self._zi = None
+
+
+class StreamChain:
+    """
+    Stream effects applied in order. The effect tuple is replaced, never
+    modified, so the UI can swap effects while the sink thread is processing.
+    """
+    def __init__(self, effects=()):
+        self.effects = tuple(effects)
+
+    def __bool__(self):
+        return bool(self.effects)
+
+    def set_effects(self, effects):
+        self.effects = tuple(effects)
+
+    def process(self, block, fs):
+        for effect in self.effects:
+            block = effect.process(block, fs)
+        return block
+
+    def reset(self):
+        for effect in self.effects:
+            effect.reset()
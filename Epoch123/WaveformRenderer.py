@@ -0,0 +1,582 @@
+import numpy as np
+from PySide6.QtWidgets import QWidget, QVBoxLayout
+from PySide6.QtCore import Qt, Signal, QObject, QRunnable, QThreadPool, QPointF, QLineF, QRectF
+from PySide6.QtGui import QPainter, QPixmap, QColor, QPen, QPolygonF, QFont
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+import matplotlib.pyplot as plt
+from matplotlib.widgets import SpanSelector
+import time
+import logging
+
+from RenderStats import render_stats
+
+logger = logging.getLogger(__name__)
+
+# Amplitude range shown on the y axis by every renderer
+Y_RANGE = 1.6
+
+
+def build_peak_levels(samples, block=64, factor=4):
+    """
+    Build a min/max peak pyramid for a 1-D signal.
+    Returns a list of (samples_per_entry, mins, maxs), finest level first.
+    Each level is `factor` times coarser than the previous one, so any
+    zoom level can be drawn from at most ~factor entries per pixel.
+    """
+    return stream_peak_levels((samples,), block, factor)
+
+
+def stream_peak_levels(chunks, block=64, factor=4):
+    """
+    Same as build_peak_levels, over consecutive 1-D chunks of a signal, so the
+    signal never has to be held in memory at once. Every chunk but the last
+    must be a multiple of `block` samples long.
+    """
+    mins, maxs = [], []
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+        full = len(chunk) // block * block
+        if full:
+            blocks = chunk[:full].reshape(-1, block)
+            mins.append(blocks.min(axis=1))
+            maxs.append(blocks.max(axis=1))
+        if full < len(chunk):
+            tail = chunk[full:]
+            mins.append(np.array([tail.min()]))
+            maxs.append(np.array([tail.max()]))
+
+    levels = []
+    if total < block:
+        return levels
+    mins, maxs = np.concatenate(mins), np.concatenate(maxs)
+
+    size = block
+    while True:
+        levels.append((size, mins, maxs))
+        if len(mins) < 2 * factor:
+            break
+        pad = (-len(mins)) % factor
+        if pad:
+            mins = np.pad(mins, (0, pad), mode='edge')
+            maxs = np.pad(maxs, (0, pad), mode='edge')
+        mins = mins.reshape(-1, factor).min(axis=1)
+        maxs = maxs.reshape(-1, factor).max(axis=1)
+        size *= factor
+    return levels
+
+
+def column_peaks(samples, levels, xmin, xmax, width):
+    """
+    Reduce the visible range [xmin, xmax) to one (min, max) pair per pixel column,
+    using the coarsest pyramid level that still has at least one entry per column.
+    """
+    spp = (xmax - xmin) / width
+    size, mins, maxs = 1, samples, samples
+    for level_size, level_mins, level_maxs in levels:
+        if level_size > spp:
+            break
+        size, mins, maxs = level_size, level_mins, level_maxs
+
+    edges = (np.linspace(xmin, xmax, width + 1) / size).astype(np.int64)
+    edges = np.clip(edges, 0, len(mins) - 1)
+    start, stop = edges[0], edges[-1] + 1
+    offsets = edges[:-1] - start
+    return (np.minimum.reduceat(mins[start:stop], offsets),
+            np.maximum.reduceat(maxs[start:stop], offsets))
+
+
+def display_samples(data):
+    """Return a 1-D view of `data` suitable for drawing (mono mix if needed)."""
+    if not isinstance(data, np.ndarray):
+        # An EditList: mixing down is just another lazy node
+        return data.mono()
+    if data.ndim == 1:
+        return data
+    if data.shape[1] == 1:
+        return data[:, 0]
+    return data.mean(axis=1)
+
+
+class LevelsJobSignals(QObject):
+    """
+    Signals for LevelsJob (QRunnable cannot emit signals itself).
+      - ready(samples: EditList, levels: list)
+    """
+    ready = Signal(object, object)
+
+
+class LevelsJob(QRunnable):
+    """Builds the peak pyramid of an edit list on the thread pool, rendering it for the first time if needed."""
+    def __init__(self, samples):
+        super().__init__()
+        self.samples = samples
+        self.signals = LevelsJobSignals()
+
+    def run(self):
+        try:
+            levels = self.samples.peak_levels()
+        except Exception as e:
+            logger.error(f"Failed to render the waveform: {e}")
+            levels = []
+        self.signals.ready.emit(self.samples, levels)
+
+
+class WaveformRenderer(QWidget):
+    """
+    Interface for the widgets that draw a waveform for PlotWidget.
+    Renderers only draw and report mouse interaction; PlotWidget owns the data,
+    the selection logic and the undo history.
+    Signals:
+      - region_selected(xmin: float, xmax: float)  -> a span was dragged (in samples)
+      - clicked(x: float, button: int)              -> a click at sample x (1 = left, 3 = right)
+    """
+    region_selected = Signal(float, float)
+    clicked = Signal(float, int)
+
+    def set_data(self, data, fs):
+        """Show new data, reset the view to the full range and clear the overlay."""
+        raise NotImplementedError
+
+    def set_view(self, xmin, xmax):
+        """Show the sample range [xmin, xmax]."""
+        raise NotImplementedError
+
+    def get_view(self):
+        """Return the visible sample range as (xmin, xmax)."""
+        raise NotImplementedError
+
+    def set_position(self, x):
+        """Move the playback cursor to sample x."""
+        raise NotImplementedError
+
+    def set_selection(self, xmin, xmax):
+        """Highlight the sample range [xmin, xmax]."""
+        raise NotImplementedError
+
+    def clear_selection(self):
+        """Remove the selection highlight."""
+        raise NotImplementedError
+
+    def cleanup(self):
+        """Stop background work before the widget is discarded."""
+
+    def save_image(self, file_path):
+        """Save the current rendering to an image file."""
+        raise NotImplementedError
+
+    def reset_interaction(self):
+        """Reset any in-progress mouse interaction (e.g. after a context menu)."""
+
+
+class MatplotlibRenderer(WaveformRenderer):
+    """
+    Draws the waveform with matplotlib. The cursor and selection are animated
+    artists blitted over a background cached on every full draw.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.figure, self.ax = plt.subplots()
+        self.canvas = FigureCanvas(self.figure)
+        self.line = None
+        self.position_line = None
+        self.selection_rect = None
+        self.span_selector = None
+        self.fs = None
+
+        # Cached figure pixels (without the animated cursor/selection overlay)
+        self._background = None
+        self._last_cursor_px = None
+        self._redraw_requested = None
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.canvas)
+
+        self.setup_plot()
+        self.connect_events()
+
+    def setup_plot(self):
+        """Initial configuration for the plot's appearance."""
+        self.figure.subplots_adjust(left=0, bottom=0, right=1, top=1, wspace=0, hspace=0)
+        self.ax.set_facecolor('black')
+        self.figure.patch.set_facecolor('black')
+
+        for axis in ['x', 'y']:
+            self.ax.tick_params(axis=axis, colors='orange', direction='out')
+        self.ax.grid(color='orange', linestyle='-', linewidth=0.25, alpha=0.5)
+        self.ax.set_axisbelow(False)
+
+        self.position_line = self.ax.axvline(0, color='gray', lw=1, zorder=3, animated=True)
+
+    def connect_events(self):
+        """Connect canvas events for clicking, selection and redraws."""
+        self.canvas.mpl_connect('button_press_event', self.on_click)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        self.reset_span_selector()
+
+    def reset_span_selector(self):
+        """Reset the span selector to allow new region selection."""
+        if self.span_selector:
+            self.span_selector.disconnect_events()
+        self.span_selector = SpanSelector(
+            self.ax, self.region_selected.emit, 'horizontal',
+            useblit=True, props=dict(alpha=0.3, facecolor='pink')
+        )
+
+    def reset_interaction(self):
+        self.reset_span_selector()
+
+    def on_click(self, event):
+        """Forward clicks inside the axes as sample positions."""
+        if event.inaxes == self.ax and event.xdata is not None:
+            self.clicked.emit(float(event.xdata), int(event.button))
+
+    def on_draw(self, event):
+        """
+        Cache the freshly drawn figure (which excludes animated artists)
+        and paint the cursor/selection overlay on top of it.
+        """
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._last_cursor_px = None
+        if self._redraw_requested is not None:
+            # Time from the redraw request until the frame is on the canvas
+            render_stats.record('MatplotlibRenderer.frame', (time.perf_counter() - self._redraw_requested) * 1000)
+            self._redraw_requested = None
+        self.draw_overlay()
+
+    def redraw(self):
+        """
+        Schedule a full redraw of the figure. Only needed when the waveform,
+        the view limits or the ticks change; the overlay is blitted separately.
+        """
+        self._background = None
+        if self._redraw_requested is None:
+            self._redraw_requested = time.perf_counter()
+        self.canvas.draw_idle()
+
+    def draw_overlay(self):
+        """Restore the cached background and blit the cursor and selection."""
+        if self._background is None:
+            # A full redraw is pending; on_draw will paint the overlay.
+            return
+        with render_stats.measure('MatplotlibRenderer.overlay'):
+            self.canvas.restore_region(self._background)
+            if self.selection_rect:
+                self.ax.draw_artist(self.selection_rect)
+            self.ax.draw_artist(self.position_line)
+            self.canvas.blit(self.figure.bbox)
+
+    def set_ticks(self, xmin, xmax):
+        """Set the time and amplitude ticks for the visible range."""
+        xticks = np.linspace(xmin, xmax, 10)
+        time_labels = np.char.mod('%.2f', xticks / self.fs if self.fs else np.zeros(10))
+
+        time_labels[0] = ''
+        self.ax.set_xticks(xticks)
+        self.ax.set_xticklabels(time_labels, color='orange', fontsize=8, ha='left', va='bottom', y=0.03)
+
+        yticks = np.linspace(-Y_RANGE, Y_RANGE, 15)
+        self.ax.set_yticks(yticks)
+        amplitude_labels = np.char.mod('%.1f', yticks)
+        amplitude_labels[0], amplitude_labels[-1] = '', ''
+        self.ax.set_yticklabels(amplitude_labels, color='orange', fontsize=8, ha='left', va='top', x=0.02)
+
+    def set_data(self, data, fs):
+        self.fs = fs
+        data = np.asarray(display_samples(data))
+        x_data = np.arange(len(data))
+
+        if self.line is None:
+            self.line, = self.ax.plot(x_data, data, color='purple', lw=0.5)
+        else:
+            self.line.set_xdata(x_data)
+            self.line.set_ydata(data)
+
+        self.position_line.set_xdata([0])
+        self.ax.set_xlim(0, len(data))
+        self.set_ticks(0, len(data))
+        self.redraw()
+        self.reset_span_selector()
+
+    def set_view(self, xmin, xmax):
+        self.ax.set_xlim(xmin, xmax)
+        self.set_ticks(xmin, xmax)
+        self.redraw()
+
+    def get_view(self):
+        return self.ax.get_xlim()
+
+    def set_position(self, x):
+        """Move the cursor; only blits when it moves by at least one pixel."""
+        cursor_px = int(self.ax.transData.transform((x, 0))[0])
+        if cursor_px == self._last_cursor_px:
+            return
+        self._last_cursor_px = cursor_px
+        self.position_line.set_xdata([x])
+        self.draw_overlay()
+
+    def set_selection(self, xmin, xmax):
+        if self.selection_rect:
+            self.selection_rect.remove()
+        self.selection_rect = self.ax.axvspan(xmin, xmax, color='pink', alpha=0.3, animated=True)
+        self.draw_overlay()
+
+    def clear_selection(self):
+        if self.selection_rect:
+            self.selection_rect.remove()
+        self.selection_rect = None
+        self.draw_overlay()
+
+    def save_image(self, file_path):
+        self.figure.savefig(file_path, facecolor='black')
+
+
+class QtWaveformRenderer(WaveformRenderer):
+    """
+    Draws the waveform with QPainter from a min/max peak pyramid, so the cost of
+    a frame depends on the widget width rather than on the length of the file.
+    The waveform is cached in a pixmap; cursor and selection are painted on top.
+    Besides span selection, the mouse wheel zooms around the pointer and
+    middle-drag (or horizontal scrolling) pans.
+    """
+    BACKGROUND = QColor('black')
+    WAVE_COLOR = QColor('purple')
+    GRID_COLOR = QColor(255, 165, 0, 64)
+    LABEL_COLOR = QColor('orange')
+    CURSOR_COLOR = QColor('gray')
+    SELECTION_COLOR = QColor(255, 192, 203, 77)
+    ZOOM_STEP = 0.8
+    MIN_SPAN = 16
+    DRAG_THRESHOLD = 3
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumHeight(100)
+        self.samples = None
+        self.levels = []
+        self.fs = None
+        self.view = (0.0, 1.0)
+        self.position = 0
+        self.selection = None
+
+        self._cache = None
+        self._drag_start = None
+        self._drag_current = None
+        self._pan_anchor = None
+
+    # ---- renderer interface ----
+
+    def set_data(self, data, fs):
+        self.samples = display_samples(data)
+        if isinstance(self.samples, np.ndarray):
+            self.levels = build_peak_levels(self.samples)
+        else:
+            self.levels = self.samples.cached_peak_levels()
+            if self.levels is None:
+                # Rendered in the background; the waveform is drawn once they arrive
+                job = LevelsJob(self.samples)
+                job.signals.ready.connect(self.on_levels_ready)
+                QThreadPool.globalInstance().start(job)
+        self.fs = fs
+        # An empty edit list still gets a span of one sample to map to pixels
+        self.view = (0.0, float(max(len(self.samples), 1)))
+        self.position = 0
+        self.selection = None
+        self.invalidate()
+
+    def set_view(self, xmin, xmax):
+        if self.samples is None:
+            return
+        length = max(len(self.samples), 1)
+        span = min(max(xmax - xmin, self.MIN_SPAN), length)
+        xmin = min(max(xmin, 0.0), length - span)
+        self.view = (float(xmin), float(xmin + span))
+        self.invalidate()
+
+    def get_view(self):
+        return self.view
+
+    def on_levels_ready(self, samples, levels):
+        if samples is self.samples:
+            self.levels = levels
+            self.invalidate()
+
+    def set_position(self, x):
+        old_px, self.position = self.x_to_px(self.position), x
+        new_px = self.x_to_px(x)
+        if new_px != old_px:
+            # Repaint only the two cursor columns from the cached pixmap
+            self.update(old_px - 1, 0, 3, self.height())
+            self.update(new_px - 1, 0, 3, self.height())
+
+    def set_selection(self, xmin, xmax):
+        self.selection = (xmin, xmax)
+        self.update()
+
+    def clear_selection(self):
+        self.selection = None
+        self.update()
+
+    def save_image(self, file_path):
+        self.grab().save(file_path)
+
+    # ---- coordinates ----
+
+    def x_to_px(self, x):
+        xmin, xmax = self.view
+        return int((x - xmin) / max(xmax - xmin, 1) * self.width())
+
+    def px_to_x(self, px):
+        xmin, xmax = self.view
+        return xmin + px / max(self.width(), 1) * max(xmax - xmin, 1)
+
+    def amp_to_py(self, amplitude):
+        half = self.height() / 2
+        return half - amplitude / Y_RANGE * half
+
+    # ---- painting ----
+
+    def invalidate(self):
+        """Drop the cached waveform pixmap; it is rebuilt on the next paint."""
+        self._cache = None
+        self.update()
+
+    def resizeEvent(self, event):
+        self._cache = None
+        super().resizeEvent(event)
+
+    def render_waveform(self):
+        """Render grid, waveform and labels for the current view into the cache."""
+        ratio = self.devicePixelRatioF()
+        pixmap = QPixmap(self.size() * ratio)
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(self.BACKGROUND)
+
+        painter = QPainter(pixmap)
+        width, height = self.width(), self.height()
+        xmin, xmax = self.view
+
+        painter.setPen(QPen(self.GRID_COLOR, 0))
+        grid = [QLineF(px, 0, px, height) for px in np.linspace(0, width, 10).tolist()]
+        grid += [QLineF(0, py, width, py) for py in self.amp_to_py(np.linspace(-Y_RANGE, Y_RANGE, 15)).tolist()]
+        painter.drawLines(grid)
+
+        if self.levels is None:
+            painter.setPen(self.LABEL_COLOR)
+            painter.drawText(QRectF(0, 0, width, height), Qt.AlignCenter, "Rendering...")
+        elif self.samples is not None and len(self.samples) and width > 0:
+            painter.setRenderHint(QPainter.Antialiasing, False)
+            painter.setPen(QPen(self.WAVE_COLOR, 0))
+            if (xmax - xmin) / width < 1:
+                start, stop = int(xmin), min(int(np.ceil(xmax)) + 1, len(self.samples))
+                xs = (np.arange(start, stop) - xmin) / (xmax - xmin) * width
+                ys = self.amp_to_py(self.samples[start:stop])
+                painter.drawPolyline(QPolygonF(list(map(QPointF, xs.tolist(), ys.tolist()))))
+            else:
+                # One vertical min-max stroke per pixel column
+                mins, maxs = column_peaks(self.samples, self.levels, xmin, xmax, width)
+                tops = self.amp_to_py(maxs).tolist()
+                bottoms = self.amp_to_py(mins).tolist()
+                painter.drawLines(list(map(QLineF, range(width), tops, range(width), bottoms)))
+
+        if self.fs:
+            painter.setPen(self.LABEL_COLOR)
+            painter.setFont(QFont(painter.font().family(), 8))
+            for x in np.linspace(xmin, xmax, 10)[1:]:
+                painter.drawText(self.x_to_px(x) + 2, height - 4, f"{x / self.fs:.2f}")
+        painter.end()
+        self._cache = pixmap
+
+    def paintEvent(self, event):
+        start = time.perf_counter()
+        full_frame = self._cache is None
+        if full_frame:
+            self.render_waveform()
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self._cache)
+
+        spans = [self.selection]
+        if self._drag_start is not None and self._drag_current is not None:
+            spans.append((self._drag_start, self._drag_current))
+        for span in filter(None, spans):
+            left, right = sorted(self.x_to_px(x) for x in span)
+            painter.fillRect(QRectF(left, 0, right - left, self.height()), self.SELECTION_COLOR)
+
+        painter.setPen(QPen(self.CURSOR_COLOR, 1))
+        cursor_px = self.x_to_px(self.position)
+        painter.drawLine(cursor_px, 0, cursor_px, self.height())
+
+        name = f"{type(self).__name__}.{'frame' if full_frame else 'overlay'}"
+        if render_stats.enabled:
+            painter.setPen(self.LABEL_COLOR)
+            last_frame = render_stats.last.get(f"{type(self).__name__}.frame", 0.0)
+            painter.drawText(self.rect().adjusted(0, 4, -6, 0), Qt.AlignRight | Qt.AlignTop,
+                             f"frame {last_frame:.1f} ms")
+        painter.end()
+        render_stats.record(name, (time.perf_counter() - start) * 1000)
+
+    # ---- mouse interaction ----
+
+    def mousePressEvent(self, event):
+        if self.samples is None:
+            return
+        x = self.px_to_x(event.position().x())
+        if event.button() == Qt.LeftButton:
+            self._drag_start, self._drag_current = x, None
+        elif event.button() == Qt.MiddleButton:
+            self._pan_anchor = (event.position().x(), self.view)
+        elif event.button() == Qt.RightButton:
+            self.clicked.emit(x, 3)
+
+    def mouseMoveEvent(self, event):
+        if self._drag_start is not None:
+            self._drag_current = self.px_to_x(event.position().x())
+            self.update()
+        elif self._pan_anchor is not None:
+            anchor_px, (xmin, xmax) = self._pan_anchor
+            shift = (anchor_px - event.position().x()) / max(self.width(), 1) * (xmax - xmin)
+            self.set_view(xmin + shift, xmax + shift)
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.LeftButton and self._drag_start is not None:
+            start, end = self._drag_start, self.px_to_x(event.position().x())
+            self._drag_start = self._drag_current = None
+            if abs(self.x_to_px(end) - self.x_to_px(start)) < self.DRAG_THRESHOLD:
+                self.clicked.emit(end, 1)
+            else:
+                self.region_selected.emit(min(start, end), max(start, end))
+            self.update()
+        elif event.button() == Qt.MiddleButton:
+            self._pan_anchor = None
+
+    def wheelEvent(self, event):
+        if self.samples is None:
+            return
+        xmin, xmax = self.view
+        delta = event.angleDelta()
+        if delta.x():
+            shift = -delta.x() / 120 * 0.1 * (xmax - xmin)
+            self.set_view(xmin + shift, xmax + shift)
+        elif delta.y():
+            anchor = self.px_to_x(event.position().x())
+            scale = self.ZOOM_STEP ** (delta.y() / 120)
+            self.set_view(anchor - (anchor - xmin) * scale, anchor + (xmax - anchor) * scale)
+        event.accept()
+
+    def reset_interaction(self):
+        self._drag_start = self._drag_current = self._pan_anchor = None
+        self.update()
+
+
+RENDERERS = {
+    'qt': QtWaveformRenderer,
+    'matplotlib': MatplotlibRenderer,
+}
+
+
+def create_renderer(name, parent=None):
+    """Instantiate the renderer registered under `name`."""
+    if name not in RENDERERS:
+        raise ValueError(f"Unknown plot backend '{name}'. Choose from: {', '.join(RENDERERS)}")
+    return RENDERERS[name](parent)
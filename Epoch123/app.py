@@ -5,11 +5,12 @@ import logging
 from pathlib import Path
 
 from FileNavigator import FileNavigator
-from eutils import get_main_sound_dir_path
+from eutils import get_main_sound_dir_path, is_audio_file
 from MetaData import MetaDataDB
 from pydub import AudioSegment
 from AudioManager import AudioPlayer
 from SoundEditor import SoundEditor
+from PeakCache import PeakCache
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -28,6 +29,9 @@ class MainWindow(QMainWindow):
         self.audio_path = Path(get_main_sound_dir_path('Epoch123/ESMD'))  # Changed to Path
         self.scan_and_insert_metadata(self.audio_path)
 
+        # Peak envelopes shared by thumbnails and anything that rewrites files
+        self.peak_cache = PeakCache()
+
         # Audio player instance
         self.audio_player = AudioPlayer()
 
@@ -45,28 +49,29 @@ class MainWindow(QMainWindow):
     def scan_and_insert_metadata(self, directory: Path):
         """
         Walk through 'directory' and insert metadata for audio files 
-        into the database if they don't already exist.
+        into the database if they don't already exist (in one transaction).
         """
-        audio_extensions = {'.wav', '.flac', '.mp3'}
+        rows = []
         for file_path in directory.rglob('*'):
-            if file_path.suffix.lower() in audio_extensions:
+            if is_audio_file(file_path):
                 full_path = str(file_path.resolve())
                 if self.metaDataDB.file_already_exists(full_path):
                     continue
                 try:
                     audio = AudioSegment.from_file(full_path)
-                    metadata = {
-                        'file_name': file_path.name,
-                        'file_path': full_path,
-                        'num_channels': audio.channels,
-                        'sample_rate': audio.frame_rate,
-                        'file_size_kb': round(file_path.stat().st_size / 1024, 2),
-                        'duration_seconds': round(audio.duration_seconds, 2)
-                    }
-                    self.metaDataDB.insert_metadata(**metadata)
-                    logging.info(f"Inserted metadata for {full_path}")
+                    rows.append((
+                        file_path.name,
+                        full_path,
+                        audio.channels,
+                        audio.frame_rate,
+                        round(file_path.stat().st_size / 1024, 2),
+                        round(audio.duration_seconds, 2)
+                    ))
                 except Exception as e:
                     logging.error(f"Failed to process {full_path}: {e}")
+        if rows:
+            self.metaDataDB.insert_many(rows)
+            logging.info(f"Inserted metadata for {len(rows)} files")
 
     def show_file_nav_widget(self):
         """Show the file navigator view."""
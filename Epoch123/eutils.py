@@ -1,6 +1,9 @@
 import os
 from PySide6.QtWidgets import QMessageBox
 
+# File extensions the archive treats as audio
+AUDIO_EXTENSIONS = {'.wav', '.flac', '.mp3'}
+
 
 def get_main_sound_dir_path(ext: str) -> str:
     """
@@ -17,3 +20,8 @@ def get_main_sound_dir_path(ext: str) -> str:
 def show_error_message(self, message):
     """Show error message as a critical message box."""
     QMessageBox.critical(self, "Error", message)
+
+
+def is_audio_file(file_path) -> bool:
+    """Return True if file_path has one of the supported audio extensions."""
+    return os.path.splitext(str(file_path))[1].lower() in AUDIO_EXTENSIONS
@@ -0,0 +1,148 @@
+"""
+Offscreen benchmark for PlotWidget.
+
+Loads synthetic signals of growing length into PlotWidget and times
+update_plot, cursor redraws, zoom in/out, crop and undo for each renderer.
+Frame times and their percentiles are written to JSON. Passing --baseline
+compares p90 times against an earlier run and exits with status 1 on a
+regression, so it can gate a release.
+
+    python3 Epoch123/plot_benchmark.py --output bench.json
+    python3 Epoch123/plot_benchmark.py --baseline bench.json --tolerance 0.25
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PySide6.QtWidgets import QApplication
+
+from PlotWidget import PlotWidget
+from RenderStats import percentiles
+
+SAMPLE_RATE = 44100
+OPERATIONS = ('update_plot', 'cursor', 'zoom_in', 'zoom_out', 'crop', 'undo')
+
+
+def synthetic_signal(seconds, fs=SAMPLE_RATE, seed=0):
+    """A decaying tone mixed with noise, long enough to stress the renderer."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * fs), dtype=np.float32) / fs
+    tone = 0.5 * np.sin(2 * np.pi * 220 * t) * np.exp(-(t % 2.0))
+    return (tone + 0.1 * rng.standard_normal(len(t), dtype=np.float32)).astype(np.float32)
+
+
+def flush(app, widget):
+    """Process pending events and force the renderer to paint synchronously."""
+    app.processEvents()
+    widget.renderer.repaint()
+
+
+def timed(app, widget, action):
+    start = time.perf_counter()
+    action()
+    flush(app, widget)
+    return (time.perf_counter() - start) * 1000
+
+
+def run_case(app, backend, seconds, repeats, cursor_frames):
+    """Return {operation: [frame times in ms]} for one backend and signal length."""
+    data = synthetic_signal(seconds)
+    widget = PlotWidget(backend=backend)
+    widget.resize(1200, 300)
+    widget.show()
+    flush(app, widget)
+
+    times = {name: [] for name in OPERATIONS}
+    n = len(data)
+    for _ in range(repeats):
+        times['update_plot'].append(timed(app, widget, lambda: widget.load_data(data, SAMPLE_RATE, None)))
+
+        for frame in np.linspace(0, n - 1, cursor_frames).astype(int):
+            times['cursor'].append(timed(app, widget, lambda: widget.update_position_frame(int(frame))))
+
+        widget.on_select(n * 0.25, n * 0.75)
+        times['zoom_in'].append(timed(app, widget, widget.zoom_into_selected))
+        times['zoom_out'].append(timed(app, widget, widget.zoom_out))
+
+        widget.on_select(n * 0.25, n * 0.75)
+        times['crop'].append(timed(app, widget, widget.crop_selected))
+        times['undo'].append(timed(app, widget, widget.undo_last_action))
+
+    widget.close()
+    widget.deleteLater()
+    return times
+
+
+def find_regressions(results, baseline, tolerance):
+    """Return descriptions of cases whose p90 grew by more than `tolerance`."""
+    previous = {(r['backend'], r['seconds'], r['operation']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        key = (result['backend'], result['seconds'], result['operation'])
+        if key not in previous or not previous[key].get('p90'):
+            continue
+        old, new = previous[key]['p90'], result['p90']
+        if new > old * (1 + tolerance):
+            regressions.append(f"{key[0]} {key[1]}s {key[2]}: p90 {old:.2f} ms -> {new:.2f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark PlotWidget rendering offscreen.")
+    parser.add_argument('--backends', nargs='+', default=['qt', 'matplotlib'])
+    parser.add_argument('--lengths', nargs='+', type=float, default=[10, 60, 600, 3600],
+                        help="Signal lengths in seconds")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--cursor-frames', type=int, default=60)
+    parser.add_argument('--output', default='plot_benchmark.json')
+    parser.add_argument('--baseline', help="Earlier JSON output to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Allowed relative p90 slowdown before a case counts as a regression")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    results = []
+    for backend in args.backends:
+        for seconds in args.lengths:
+            times = run_case(app, backend, seconds, args.repeats, args.cursor_frames)
+            for operation, frame_times in times.items():
+                stats = percentiles(frame_times)
+                results.append({
+                    'backend': backend, 'seconds': seconds, 'samples': int(seconds * SAMPLE_RATE),
+                    'operation': operation, **stats,
+                    'frame_times_ms': [round(t, 3) for t in frame_times],
+                })
+                print(f"{backend:>10} {seconds:>7.0f}s {operation:<12} "
+                      f"p50 {stats['p50']:8.2f} ms  p90 {stats['p90']:8.2f} ms  max {stats['max']:8.2f} ms")
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sample_rate': SAMPLE_RATE,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
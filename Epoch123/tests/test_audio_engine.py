@@ -0,0 +1,130 @@
+import time
+import threading
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from AudioEngine import AudioEngine, FileSink, NullSink, RingBuffer
+
+BLOCK = 64
+RING = 4
+# Samples are frame_index * STEP (exact in float32), so every block tells where it came from
+STEP = 2.0 ** -16
+
+
+def ramp(frames, channels=2):
+    """(frames, channels) float32 audio whose first channel is frame_index * STEP."""
+    index = np.arange(frames, dtype=np.float32) * np.float32(STEP)
+    return np.stack([index * (1 - c / channels) for c in range(channels)], axis=1).astype(np.float32)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail("timed out waiting for the engine")
+        time.sleep(0.001)
+
+
+class RecordingSink(NullSink):
+    """Keeps every block it consumes; with `hold_after` it stops there until `release` is set."""
+    def __init__(self, hold_after=None):
+        super().__init__(realtime=False)
+        self.blocks = []
+        self.hold_after = hold_after
+        self.holding = threading.Event()
+        self.release = threading.Event()
+
+    def consume(self, frames):
+        self.blocks.append(frames.copy())
+        if len(self.blocks) == self.hold_after:
+            self.holding.set()
+            self.release.wait(5)
+
+
+def play(engine, data, fs=8000):
+    engine.load(data, fs)
+    engine.start()
+    wait_for(lambda: engine.finished)
+    engine.stop()
+
+
+def test_ring_buffer_wraps_around_and_skips_stale_generations():
+    ring = RingBuffer(RING, BLOCK, 1)
+    data = ramp(BLOCK * 10, channels=1)
+    popped = []
+    for n in range(10):
+        ring.push(1, n * BLOCK, data[n * BLOCK:(n + 1) * BLOCK])
+        start, block = ring.pop(1)
+        popped.append(block)
+        assert start == n * BLOCK
+    np.testing.assert_array_equal(np.concatenate(popped), data)
+
+    # Blocks decoded before a seek are dropped, not returned
+    ring.push(1, 0, data[:BLOCK])
+    ring.push(1, BLOCK, data[BLOCK:2 * BLOCK])
+    ring.push(2, 5 * BLOCK, data[5 * BLOCK:6 * BLOCK])
+    start, block = ring.pop(2)
+    assert start == 5 * BLOCK
+    np.testing.assert_array_equal(block, data[5 * BLOCK:6 * BLOCK])
+    assert ring.pop(2) is None
+    assert ring.free() == RING
+
+
+def test_file_sink_renders_the_input_exactly(tmp_path):
+    # Many times the ring's size, and a partial last block
+    data = ramp(BLOCK * RING * 10 + 17)
+    path = str(tmp_path / "out.wav")
+    engine = AudioEngine(FileSink(path, subtype='FLOAT'), block_frames=BLOCK, ring_blocks=RING)
+    play(engine, data)
+
+    rendered, fs = sf.read(path, dtype='float32', always_2d=True)
+    assert fs == 8000
+    np.testing.assert_array_equal(rendered, data)
+    assert engine.position == len(data)
+    assert engine.at_end()
+
+
+def test_mono_input_stays_mono(tmp_path):
+    data = ramp(BLOCK * 7 + 3)[:, 0]
+    path = str(tmp_path / "mono.wav")
+    play(AudioEngine(FileSink(path, subtype='FLOAT'), block_frames=BLOCK, ring_blocks=RING), data)
+
+    rendered, _ = sf.read(path, dtype='float32')
+    np.testing.assert_array_equal(rendered, data)
+
+
+def test_seek_flushes_blocks_decoded_for_the_old_position():
+    data = ramp(BLOCK * RING * 8)
+    sink = RecordingSink(hold_after=1)
+    engine = AudioEngine(sink, block_frames=BLOCK, ring_blocks=RING)
+    engine.load(data, 8000)
+    engine.start()
+    # The sink sits on its first block while the decoder fills the ring for the old position
+    assert sink.holding.wait(5)
+    wait_for(lambda: engine.ring.free() == 0)
+    target = BLOCK * 20 + 5
+    engine.seek(target)
+    sink.release.set()
+    wait_for(lambda: engine.finished)
+    engine.stop()
+
+    first, *after = sink.blocks
+    np.testing.assert_array_equal(first, data[:BLOCK])
+    assert int(after[0][0, 0] / STEP) == target
+    np.testing.assert_array_equal(np.concatenate(after), data[target:])
+    assert engine.position == len(data)
+
+
+def test_seek_to_the_end_finishes_without_audio():
+    data = ramp(BLOCK * 3)
+    sink = RecordingSink()
+    engine = AudioEngine(sink, block_frames=BLOCK, ring_blocks=RING)
+    engine.load(data, 8000)
+    engine.start(len(data))
+    wait_for(lambda: engine.finished)
+    engine.stop()
+
+    assert sink.blocks == []
+    assert engine.position == len(data)
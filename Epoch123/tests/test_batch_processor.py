@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from BatchProcessor import BatchProcessor, parse_chain, output_path, MANIFEST_NAME
+
+FS = 8000
+
+
+@pytest.mark.parametrize('steps, message', [
+    ({'op': 'gain', 'db': 1}, "must be a list"),
+    ([{'op': 'echo'}], "Step 1: unknown op 'echo'"),
+    (["gain"], "Step 1: unknown op None"),
+    ([{'op': 'gain', 'db': 1}, {'op': 'pitch'}], r"Step 2 \(pitch\): missing semitones"),
+    ([{'op': 'gain', 'db': 1, 'gain': 2}], r"Step 1 \(gain\): unknown parameter gain"),
+    ([{'op': 'filter', 'type': 'Notch Pass', 'cutoff': 100}], "unknown filter type 'Notch Pass'"),
+    ([{'op': 'format', 'format': 'XYZ'}], "unknown format 'XYZ'"),
+    ([{'op': 'split'}, {'op': 'gain', 'db': 1}], "split step can only be the last step"),
+])
+def test_parse_chain_rejects_mistakes(steps, message):
+    with pytest.raises(ValueError, match=message):
+        parse_chain(steps)
+
+
+def test_parse_chain_fills_in_defaults():
+    chain = parse_chain([{'op': 'filter', 'type': 'High Pass', 'cutoff': 80},
+                         {'op': 'split'}, {'op': 'format', 'format': 'flac'}])
+    assert chain[0] == {'op': 'filter', 'type': 'High Pass', 'cutoff': 80, 'order': 4, 'zero_phase': True}
+    assert chain[1]['op'] == 'split' and 'threshold_db' in chain[1]
+    assert chain[2] == {'op': 'format', 'format': 'flac', 'subtype': None}
+    assert output_path('/in/a/b.wav', '/in', '/out', chain) == os.path.join('/out', 'a', 'b.flac')
+
+
+def write_inputs(folder, count=3):
+    os.makedirs(folder)
+    paths = []
+    for number in range(count):
+        path = os.path.join(folder, f"sound{number}.wav")
+        sf.write(path, np.full(FS // 4, 0.1 * (number + 1), dtype=np.float32), FS, subtype='FLOAT')
+        paths.append(path)
+    return paths
+
+
+def test_a_second_run_resumes_from_the_manifest(tmp_path):
+    paths = write_inputs(str(tmp_path / "in"))
+    output_dir = str(tmp_path / "out")
+    chain = [{'op': 'gain', 'db': 6}]
+
+    summary = BatchProcessor(chain, output_dir, workers=1).run(paths)
+    assert summary == {'total': 3, 'skipped': 0, 'done': 3, 'failed': 0}
+    assert os.path.exists(os.path.join(output_dir, MANIFEST_NAME))
+    written, fs = sf.read(os.path.join(output_dir, "sound1.wav"))
+    assert fs == FS
+    np.testing.assert_allclose(written, 0.2 * 10 ** (6 / 20), rtol=1e-6)
+
+    # Finished files are skipped, unless their output is gone
+    assert BatchProcessor(chain, output_dir, workers=1).run(paths)['skipped'] == 3
+    os.remove(os.path.join(output_dir, "sound2.wav"))
+    summary = BatchProcessor(chain, output_dir, workers=1).run(paths)
+    assert (summary['skipped'], summary['done']) == (2, 1)
+    assert os.path.exists(os.path.join(output_dir, "sound2.wav"))
+
+    # Another chain starts over
+    summary = BatchProcessor([{'op': 'gain', 'db': -6}], output_dir, workers=1).run(paths)
+    assert (summary['skipped'], summary['done']) == (0, 3)
+
+
+def test_failed_files_are_recorded_and_retried(tmp_path):
+    paths = write_inputs(str(tmp_path / "in"), count=1)
+    broken = os.path.join(str(tmp_path / "in"), "broken.wav")
+    with open(broken, 'w') as f:
+        f.write("not audio")
+    output_dir = str(tmp_path / "out")
+
+    processor = BatchProcessor([{'op': 'gain', 'db': 0}], output_dir, workers=1)
+    summary = processor.run(paths + [broken])
+    assert (summary['done'], summary['failed']) == (1, 1)
+    assert processor.manifest['files'][broken]['status'] == 'failed'
+
+    summary = BatchProcessor([{'op': 'gain', 'db': 0}], output_dir, workers=1).run(paths + [broken])
+    assert (summary['skipped'], summary['failed']) == (1, 1)
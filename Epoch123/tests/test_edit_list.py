@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+import scipy.signal as sig
+
+import EditList as edit_list
+from EditList import BLOCK_SIZE, Source, Filter, Gain, PitchShift, TimeStretch, RenderCache
+from PhaseVocoder import pitch_shift, time_stretch
+
+FS = 8000
+
+
+def noise(frames, channels=2, seed=0):
+    return np.random.default_rng(seed).standard_normal((frames, channels)).astype(np.float32) * 0.1
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    """Each test renders into its own cache, so hits and misses are its own."""
+    cache = RenderCache()
+    monkeypatch.setattr(edit_list, 'render_cache', cache)
+    return cache
+
+
+class CountingGain(Gain):
+    """A gain that logs each range it renders (in a class attribute, so it stays out of its key)."""
+    rendered = []
+
+    def render(self, input, start, stop):
+        CountingGain.rendered.append((self.gain, start, stop))
+        return super().render(input, start, stop)
+
+
+@pytest.mark.parametrize('zero_phase', [True, False])
+def test_filter_in_blocks_matches_filtering_the_whole_signal(zero_phase):
+    # Several blocks, and a partial last one
+    data = noise(2 * BLOCK_SIZE + 1234)
+    effect = Filter("Low Pass", 1000, FS, order=4, zero_phase=zero_phase)
+    edit = Source(data, FS).apply(effect)
+
+    np.testing.assert_allclose(edit.render(), effect.process(data), atol=1e-6)
+    # A range straddling a block boundary, rendered on its own
+    start, stop = BLOCK_SIZE - 500, BLOCK_SIZE + 700
+    np.testing.assert_allclose(edit.render(start, stop), effect.process(data)[start:stop], atol=1e-6)
+
+
+@pytest.mark.parametrize('rate', [16000, 11025, 6000])
+def test_at_rate_matches_resample_poly(rate):
+    data = noise(BLOCK_SIZE + 999)
+    edit = Source(data, FS).at_rate(rate)
+    up, down = edit.up, edit.down
+    whole = sig.resample_poly(data, up, down, axis=0, window=('kaiser', 5.0))
+
+    assert edit.fs == rate
+    assert len(edit) == len(whole)
+    np.testing.assert_allclose(edit.render(), whole, atol=1e-6)
+    np.testing.assert_allclose(edit.render(1000, 5000), whole[1000:5000], atol=1e-6)
+    assert Source(data, FS).at_rate(FS).fs == FS
+
+
+def test_edits_match_numpy():
+    data = noise(10000)
+    edit = Source(data, FS)
+
+    np.testing.assert_array_equal(edit.crop(100, 900).render(), data[100:900])
+    np.testing.assert_array_equal(edit.cut(100, 900).render(), np.concatenate((data[:100], data[900:])))
+    np.testing.assert_array_equal(edit.reverse().render(), data[::-1])
+    np.testing.assert_array_equal(edit.reverse().reverse().render(), data)
+    ranges = [(5000, 6000), (10, 20), (9990, 10000)]
+    np.testing.assert_array_equal(edit.keep(ranges).render(), np.concatenate([data[a:b] for a, b in ranges]))
+
+    # Edits of edits compose into ranges of the source
+    nested = edit.cut(0, 1000).crop(500, 4000).reverse().cut(100, 200)
+    expected = np.delete(data[1000:][500:4000][::-1], np.s_[100:200], axis=0)
+    assert nested.input.input.input is edit
+    np.testing.assert_array_equal(nested.render(), expected)
+    np.testing.assert_array_equal(nested[10:20], expected[10:20])
+    assert len(edit.crop(0, 0)) == 0
+
+
+def test_replace_node_recomputes_only_the_steps_after_it():
+    data = noise(BLOCK_SIZE + 100)
+    CountingGain.rendered.clear()
+    edit = Source(data, FS).apply(CountingGain(2.0)).apply(CountingGain(0.5)).apply(CountingGain(3.0))
+    np.testing.assert_allclose(edit.render(), data * 3.0, rtol=1e-6)
+    assert sorted({gain for gain, _, _ in CountingGain.rendered}) == [0.5, 2.0, 3.0]
+
+    CountingGain.rendered.clear()
+    changed = edit.replace_node(2, CountingGain(0.25))
+    np.testing.assert_allclose(changed.render(), data * 1.5, rtol=1e-6)
+    # The first gain is served from the cache, the replaced step and the one after it are rendered
+    assert sorted({gain for gain, _, _ in CountingGain.rendered}) == [0.25, 3.0]
+
+    CountingGain.rendered.clear()
+    removed = edit.replace_node(2)
+    np.testing.assert_allclose(removed.render(), data * 6.0, rtol=1e-6)
+    assert {gain for gain, _, _ in CountingGain.rendered} == {3.0}
+    assert [type(node).__name__ for node in removed.nodes()] == ['Source', 'EffectNode', 'EffectNode']
+
+    with pytest.raises(ValueError):
+        edit.replace_node(0)
+
+
+def test_phase_vocoder_nodes_render_any_range_like_the_whole_signal():
+    data = noise(BLOCK_SIZE + 5000, channels=1)[:, 0]
+    source = Source(data, FS)
+
+    pitched = source.apply(PitchShift(2 ** (3 / 12)))
+    expected = pitch_shift(data, 2 ** (3 / 12))
+    np.testing.assert_allclose(pitched.render(), expected, atol=1e-5)
+    np.testing.assert_allclose(pitched.render(BLOCK_SIZE - 100, BLOCK_SIZE + 100),
+                               expected[BLOCK_SIZE - 100:BLOCK_SIZE + 100], atol=1e-5)
+
+    slower = source.apply(TimeStretch(0.8))
+    expected = time_stretch(data, 1 / 0.8)
+    assert len(slower) == len(expected)
+    np.testing.assert_allclose(slower.render(), expected, atol=1e-5)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from Loudness import measure, analyze_file, full_scale, CLIP_RUN
+
+FS = 48000
+
+
+def sine(seconds=5.0, frequency=997.0, fs=FS):
+    return np.sin(2 * np.pi * frequency * np.arange(int(seconds * fs)) / fs)
+
+
+def in_blocks(data, size):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+def test_full_scale_sine_measures_minus_3_lufs():
+    data = sine()[:, None]
+    stats = measure(in_blocks(data, 4096), FS, 1)
+    assert stats['lufs'] == pytest.approx(-3.01, abs=0.01)
+    assert stats['peak_db'] == pytest.approx(0.0, abs=0.01)
+    assert stats['rms_db'] == pytest.approx(-3.01, abs=0.01)
+    assert stats['clipped'] == 0
+
+
+def test_silence_has_no_levels():
+    stats = measure([np.zeros((FS, 2))], FS, 2)
+    assert stats['lufs'] is None and stats['peak_db'] is None and stats['rms_db'] is None
+    assert stats['dc_offset'] == 0.0
+
+
+def test_clipped_samples_are_runs_at_full_scale(tmp_path):
+    # A full-scale 16-bit sine touches the top code once per peak: not clipping
+    path = str(tmp_path / "clean.wav")
+    sf.write(path, sine(), FS, subtype='PCM_16')
+    assert analyze_file(path)['clipped'] == 0
+
+    clipped = np.clip(1.5 * sine(1.0), -1, 1)
+    path = str(tmp_path / "clipped.wav")
+    sf.write(path, clipped, FS, subtype='PCM_16')
+    expected = analyze_file(path)['clipped']
+    assert expected > 0
+    # Runs crossing block boundaries count the same
+    assert analyze_file(path, blocksize=CLIP_RUN - 1)['clipped'] == expected
+    assert analyze_file(path, blocksize=1000)['clipped'] == expected
+
+    # Short runs do not count, long ones count every sample
+    marks = np.zeros(100)
+    marks[[10, 20, 21]] = 1.0
+    marks[50:50 + CLIP_RUN] = -1.0
+    assert measure(in_blocks(marks[:, None], 1), FS, 1)['clipped'] == CLIP_RUN
+
+
+def test_full_scale_of_subtypes():
+    assert full_scale('PCM_16') == 32767 / 32768
+    assert full_scale('PCM_24') == (2 ** 23 - 1) / 2 ** 23
+    assert full_scale('FLOAT') == 1.0
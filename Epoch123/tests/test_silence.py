@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from Silence import SilenceDetector, find_sounds
+
+FS = 8000
+
+
+def bursts(seed=0):
+    """Noise bursts of varied length separated by silences, some shorter than MIN_SILENCE."""
+    rng = np.random.default_rng(seed)
+    pieces = []
+    for sound, gap in [(0.2, 0.5), (0.01, 0.5), (0.3, 0.1), (0.4, 1.0), (0.05, 0.35), (0.6, 0.0)]:
+        pieces.append(rng.standard_normal(int(sound * FS)).astype(np.float32) * 0.3)
+        pieces.append(np.zeros(int(gap * FS), dtype=np.float32))
+    return np.concatenate([np.zeros(int(0.25 * FS), dtype=np.float32)] + pieces)
+
+
+def in_blocks(data, size):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+def test_sounds_are_found_between_long_silences():
+    data = bursts()
+    sounds = find_sounds([data], FS)
+    # The 10 ms blip is dropped; the bursts 0.1 s apart are one sound
+    assert len(sounds) == 4
+    assert all(0 <= start < stop <= len(data) for start, stop in sounds)
+    assert all(a[1] <= b[0] for a, b in zip(sounds, sounds[1:]))
+    assert sounds[0][0] == pytest.approx(0.2 * FS, abs=0.02 * FS)
+
+
+@pytest.mark.parametrize('size', [1, 7, 80, 161, 4096])
+def test_block_size_does_not_change_the_sounds(size):
+    data = bursts()
+    assert find_sounds(in_blocks(data, size), FS) == find_sounds([data], FS)
+
+
+def test_stereo_blocks_and_silence():
+    data = bursts()
+    stereo = np.stack((data, data), axis=1)
+    assert find_sounds(in_blocks(stereo, 333), FS) == find_sounds([data], FS)
+    assert find_sounds([np.zeros(FS, dtype=np.float32)], FS) == []
+
+    detector = SilenceDetector(FS)
+    assert detector.process(np.zeros(10, dtype=np.float32)) == []
+    assert detector.flush() == []